@@ -9,12 +9,16 @@ from django.db.models import Q
 from bson import ObjectId
 from pymongo.errors import PyMongoError
 from apps.admin_management.models.notification import Notification 
+from apps.common.pagination import keyset_paginate
+from apps.common.utils import search_tokens
 
 # 引入 Models
 from apps.diet.models.mongo.recipe import Recipe as MongoRecipe
 from apps.diet.models.mongo.restaurant import Restaurant
 from apps.diet.models.mysql.gamification import ChallengeTask, Remedy, Achievement
 from apps.diet.models.mongo.community import CommunityFeed, Comment
+from apps.diet.domains.community.comments import FeedComments
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
 
 # 引入 Serializer
 from apps.admin_management.serializers.business_s import (
@@ -31,11 +35,23 @@ from apps.admin_management.permissions import RBACPermission
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
+def filter_by_keyword(queryset, keyword):
+    """
+    n-gram 多键索引检索，避免整表正则扫描
+    search_tokens 尚未回填 (未执行 rebuild_search_tokens) 的历史文档查不到，此时退回 name 模糊匹配
+    """
+    matched = queryset.filter(search_tokens__all=search_tokens(keyword, for_query=True))
+    if matched.only('id').first() is not None:
+        return matched
+    return queryset.filter(name__icontains=keyword)
+
+
 # 🚀 [新增核心函数]：MongoEngine 通用分页器
-def paginate_mongo_queryset(request, queryset, serializer_class):
+def paginate_mongo_queryset(request, queryset, serializer_class, order_field='created_at'):
     """
     针对 MongoEngine QuerySet 的通用分页辅助函数
-    返回格式适配主流后台表格: { total, page, size, list }
+    返回格式适配主流后台表格: { total, page, size, list, next_cursor, has_more }
+    传 cursor 时按 (order_field, _id) 游标翻页，否则沿用 page 跳页
     """
     try:
         page = int(request.query_params.get('page', 1))
@@ -45,18 +61,18 @@ def paginate_mongo_queryset(request, queryset, serializer_class):
         page_size = 20
 
     total = queryset.count()
-    start = (page - 1) * page_size
-    end = start + page_size
-    
-    # 利用 MongoEngine 的切片特性做 Skip 和 Limit
-    paginated_qs = queryset[start:end]
-    serializer = serializer_class(paginated_qs, many=True)
+    result = keyset_paginate(
+        queryset, cursor=request.query_params.get('cursor'), page_size=page_size, page=page, field=order_field
+    )
+    serializer = serializer_class(result.items, many=True)
     
     return {
         "total": total,
         "page": page,
         "size": page_size,
-        "list": serializer.data
+        "list": serializer.data,
+        "next_cursor": result.next_cursor,
+        "has_more": result.has_more,
     }
 
 
@@ -71,7 +87,9 @@ def build_empty_mongo_page(request):
         "total": 0,
         "page": page,
         "size": page_size,
-        "list": []
+        "list": [],
+        "next_cursor": None,
+        "has_more": False,
     }
 
 
@@ -170,7 +188,7 @@ class RecipeAuditViewSet(viewsets.ViewSet):
             recipes = MongoRecipe.objects.all().order_by('-created_at')
             keyword = request.query_params.get('search', '')
             if keyword:
-                recipes = recipes.filter(name__icontains=keyword)
+                recipes = filter_by_keyword(recipes, keyword)
 
             status_filter = request.query_params.get('status')
             if status_filter not in (None, ''):
@@ -221,6 +239,7 @@ class RecipeAuditViewSet(viewsets.ViewSet):
         if result == 'pass':
             recipe.status = 1 
             recipe.save()
+            RecipeCatalog.mark_changed([recipe.id])
             
             if target_user:
                 Notification.objects.create(
@@ -234,6 +253,7 @@ class RecipeAuditViewSet(viewsets.ViewSet):
         elif result == 'reject':
             recipe.status = 2
             recipe.save()
+            RecipeCatalog.mark_changed([recipe.id])
             
             if target_user:
                 Notification.objects.create(
@@ -267,14 +287,14 @@ class RestaurantViewSet(viewsets.ViewSet):
         try:
             query = request.query_params.get('search', '')
             if query:
-                queryset = Restaurant.objects(name__icontains=query)
+                queryset = filter_by_keyword(Restaurant.objects, query)
             else:
                 queryset = Restaurant.objects.all()
 
             queryset = queryset.order_by('-cached_at')
 
             # 🚀 使用分页器
-            page_data = paginate_mongo_queryset(request, queryset, MongoRestaurantSerializer)
+            page_data = paginate_mongo_queryset(request, queryset, MongoRestaurantSerializer, order_field='cached_at')
             return Response({"code": 200, "data": page_data["list"], "pagination": page_data})
         except PyMongoError:
             return mongo_list_unavailable_response(request, "MongoDB 服务未连接，商家列表已降级为空")
@@ -475,11 +495,8 @@ class CommentViewSet(viewsets.ViewSet):
         try:
             obj = Comment.objects.get(id=ObjectId(pk))
             
-            # 手动扣减动态的评论数
-            if obj.feed_id:
-                obj.feed_id.update(dec__comments_count=1)
-                
-            obj.delete()
+            # 同步扣减动态评论数并移出预览快照
+            FeedComments.delete(obj)
             return Response({"code": 200, "msg": "违规评论删除成功"})
         except PyMongoError:
             return mongo_action_unavailable_response("MongoDB 服务未连接，当前无法删除评论")
@@ -9,6 +9,7 @@ from pymongo.errors import PyMongoError
 # 引入模型
 from apps.diet.models.mongo.recipe import Recipe as MongoRecipe
 from apps.diet.models.mysql.journal import DailyIntake
+from apps.diet.domains.tools.ai_metrics import AIMetrics
 
 User = get_user_model()
 
@@ -74,3 +75,32 @@ class DashboardSummaryView(APIView):
                 "mongo_available": mongo_available,
             }
         })
+
+
+class AIMetricsView(APIView):
+    """
+    AI 调用指标：按 任务 × 模型 汇总耗时分位数、直方图、成功率与 JSON 解析失败率
+    GET ?minutes=60&source=live|benchmark&task_name=&model=
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        try:
+            minutes = min(max(int(request.query_params.get('minutes', 60)), 1), 30 * 24 * 60)
+        except (TypeError, ValueError):
+            minutes = 60
+        source = request.query_params.get('source', 'live')
+        # 先写入本进程尚未落库的缓冲
+        AIMetrics.flush()
+        since = timezone.now() - timedelta(minutes=minutes)
+        rows = AIMetrics.summary(
+            since,
+            source=None if source == 'all' else source,
+            task_name=request.query_params.get('task_name') or None,
+            model_name=request.query_params.get('model') or None,
+        )
+        return Response({
+            "code": 200,
+            "msg": "success",
+            "data": {"minutes": minutes, "source": source, "since": since.isoformat(), "items": rows},
+        })
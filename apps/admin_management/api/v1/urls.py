@@ -1,7 +1,7 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .auth import AdminLoginView
-from .dashboard import DashboardSummaryView 
+from .dashboard import DashboardSummaryView, AIMetricsView
 from .business import (
     UserManageViewSet, 
     RecipeAuditViewSet, 
@@ -53,6 +53,7 @@ urlpatterns = [
     
     # 仪表盘与统计
     path('dashboard/summary/', DashboardSummaryView.as_view(), name='dashboard_summary'),
+    path('dashboard/ai-metrics/', AIMetricsView.as_view(), name='dashboard_ai_metrics'),
     path('business/stats/journal/', JournalMacroStatsView.as_view(), name='biz_journal_stats'),
     
     # 社交异常处理
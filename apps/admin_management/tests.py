@@ -1,12 +1,17 @@
+import time
 from types import SimpleNamespace
+from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from rest_framework.test import APIClient
 
 from apps.admin_management.models import AdminRole, Menu
 from apps.admin_management.permissions import IsGameAdmin, RBACPermission
+from apps.diet.domains.tools.ai_metrics import AIMetrics
+from apps.diet.models import AIMetricBucket
 from apps.diet.models.mysql.gamification import ChallengeTask, Remedy
 from apps.diet.models.mysql.journal import WaterIntake
 from apps.users.models import Profile, UserFollow
@@ -15,6 +20,7 @@ from apps.users.models import Profile, UserFollow
 User = get_user_model()
 
 
+@override_settings(AI_METRICS_WORKER=False)
 class AdminManagementTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -214,6 +220,47 @@ class AdminManagementTests(TestCase):
         self.assertEqual(payload["avg_price"], 42.0)
         self.assertEqual(payload["location"], [0.0, 0.0])
 
+    def test_ai_metrics_api_reports_percentiles_and_rates_across_sources(self):
+        admin = User.objects.create_user(username="ai-metrics-admin", password="pass123456", is_staff=True)
+        self.client.force_authenticate(admin)
+        for elapsed, success, parsed in [(80, True, True), (300, True, True), (700, True, False), (2500, False, None)]:
+            AIMetrics.record({
+                "task_name": "recognize_food",
+                "task_type": "vision",
+                "model_name": "metrics-m1",
+                "elapsed_ms": elapsed,
+                "success": success,
+                "json_parsed": parsed,
+            })
+        # 数据库故障时聚合留在缓冲区，下一次刷新补写
+        with patch.object(AIMetricBucket.objects, "select_for_update", side_effect=DatabaseError("db down")):
+            self.assertEqual(AIMetrics.flush(), 0)
+        # 持续故障时缓冲只保留最新的桶，不会无限增长
+        stale_key = (AIMetrics._bucket_start(time.time() - 86400), "recognize_food", "metrics-m0", "live")
+        with override_settings(AI_METRICS_MAX_BUFFERED_BUCKETS=len(AIMetrics._buffer)):
+            AIMetrics._restore({stale_key: AIMetrics._empty("vision")})
+        self.assertNotIn(stale_key, AIMetrics._buffer)
+        with AIMetrics.tagged("benchmark"):
+            AIMetrics.record({"task_name": "ai_chat", "task_type": "text", "model_name": "metrics-m2", "elapsed_ms": 50, "success": True})
+        AIMetrics.flush()
+
+        response = self.client.get("/api/admin/v1/dashboard/ai-metrics/", {"minutes": 30, "model": "metrics-m1"})
+
+        self.assertEqual(response.status_code, 200)
+        items = response.json()["data"]["items"]
+        self.assertEqual([(row["task_name"], row["model_name"]) for row in items], [("recognize_food", "metrics-m1")])
+        row = items[0]
+        self.assertEqual(row["count"], 4)
+        self.assertEqual(row["success_rate"], 0.75)
+        self.assertEqual(row["json_parse_failure_rate"], round(1 / 3, 4))
+        self.assertEqual(row["max_ms"], 2500)
+        self.assertTrue(250 <= row["p50_ms"] <= 500)
+        self.assertTrue(2000 <= row["p99_ms"] <= 2500)
+        self.assertEqual(sum(bucket["count"] for bucket in row["histogram"]), 4)
+
+        benchmark = self.client.get("/api/admin/v1/dashboard/ai-metrics/", {"source": "benchmark", "model": "metrics-m2"}).json()["data"]["items"]
+        self.assertEqual([(row["task_name"], row["count"]) for row in benchmark], [("ai_chat", 1)])
+
     def test_audit_log_serializer_exposes_request_path_alias(self):
         admin = self.create_staff_user_with_perm("log-admin", "system:log:list")
         self.client.force_authenticate(admin)
@@ -0,0 +1,70 @@
+import base64
+import datetime
+import json
+from collections import namedtuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.db.models import Q, QuerySet
+from mongoengine.queryset.visitor import Q as MongoQ
+
+from apps.common.exceptions import BusinessException
+
+
+KeysetPage = namedtuple("KeysetPage", "items next_cursor has_more")
+
+
+def encode_cursor(value, pk):
+    """Opaque cursor for the position right after ``(value, pk)``."""
+    payload = json.dumps({"v": value.isoformat(), "id": str(pk)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """``(datetime, pk_string)`` of a cursor; raises BusinessException when it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor) + "=" * (-len(str(cursor)) % 4))
+        payload = json.loads(raw)
+        return datetime.datetime.fromisoformat(payload["v"]), str(payload["id"])
+    except (TypeError, ValueError, KeyError):
+        raise BusinessException("cursor 参数无效")
+
+
+def keyset_paginate(queryset, cursor=None, page_size=20, page=None, field="created_at"):
+    """Newest-first page of a mongoengine or Django queryset ordered by ``(field, id)``.
+
+    With a cursor the next page is selected with a range condition on the
+    index instead of skipping rows, so deep pages cost the same as the first.
+    Without one, ``page`` keeps the legacy skip behaviour for old clients;
+    every page returns a ``next_cursor`` so they can switch over. One extra
+    row is read to tell whether more pages exist.
+    """
+    page_size = max(int(page_size), 1)
+    is_django = isinstance(queryset, QuerySet)
+    pk_name = "pk" if is_django else "id"
+    queryset = queryset.order_by(f"-{field}", f"-{pk_name}")
+
+    skip = 0
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        if is_django:
+            pk = queryset.model._meta.pk.to_python(pk)
+            queryset = queryset.filter(Q(**{f"{field}__lt": value}) | Q(**{field: value, "pk__lt": pk}))
+        else:
+            try:
+                pk = ObjectId(pk)
+            except InvalidId:
+                raise BusinessException("cursor 参数无效")
+            # Mongo 中的时间为 naive UTC
+            if value.tzinfo is not None:
+                value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            queryset = queryset.filter(MongoQ(**{f"{field}__lt": value}) | MongoQ(**{field: value, "id__lt": pk}))
+    elif page:
+        skip = (max(int(page), 1) - 1) * page_size
+
+    rows = list(queryset[skip:skip + page_size + 1])
+    items, has_more = rows[:page_size], len(rows) > page_size
+    next_cursor = None
+    if has_more and getattr(items[-1], field, None) is not None:
+        next_cursor = encode_cursor(getattr(items[-1], field), items[-1].pk)
+    return KeysetPage(items, next_cursor, has_more)
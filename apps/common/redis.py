@@ -0,0 +1,12 @@
+from django.core.cache import cache
+
+
+def get_redis():
+    """Raw redis-py client behind the default cache, or None when the cache is not django-redis."""
+    redis_client = getattr(cache, "client", None)
+    if not redis_client:
+        return None
+    try:
+        return redis_client.get_client()
+    except Exception:
+        return None
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+
+from apps.common.exceptions import BusinessException
+
+
+def max_upload_bytes():
+    return int(getattr(settings, 'AI_UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+
+
+def upload_too_large(limit):
+    return BusinessException(f'图片不能超过 {limit // (1024 * 1024)}MB', status_code=413)
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """
+    放在上传处理链最前面，按块累计字节数，超过上限立即中止解析。
+    用于没有 Content-Length（分块传输）或声明值不可信的请求。
+    """
+
+    def __init__(self, request=None, limit=None):
+        super().__init__(request)
+        self.limit = limit or max_upload_bytes()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.limit:
+            raise upload_too_large(self.limit)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class BoundedUploadMixin:
+    """
+    图片上传视图的内存上限：
+    1. 解析请求体之前按 Content-Length 拒绝超限请求；
+    2. 解析时由 SizeLimitUploadHandler 逐块计数；
+    3. 其余处理器沿用 Django 默认链，超过 FILE_UPLOAD_MAX_MEMORY_SIZE 的文件落盘为临时文件。
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        limit = max_upload_bytes()
+        try:
+            declared = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            declared = 0
+        if declared > limit:
+            raise upload_too_large(limit)
+        django_request = request._request
+        django_request.upload_handlers = [
+            SizeLimitUploadHandler(django_request, limit),
+            *django_request.upload_handlers,
+        ]
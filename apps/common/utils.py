@@ -1,8 +1,9 @@
 from django.conf import settings
 from rest_framework.exceptions import AuthenticationFailed
 import requests
-import base64
 import logging
+import re
+import unicodedata
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +42,28 @@ def normalize_ingredient_name(name):
     clean_name = name.strip()
     return _REVERSE_SYNONYM_MAP.get(clean_name, clean_name)
 
+
+# 中文连续片段 / 英文数字单词
+_SEARCH_SEGMENT_RE = re.compile(r"[\u3400-\u9fff]+|[a-z0-9]+")
+
+
+def search_tokens(text, for_query=False):
+    """
+    搜索分词：中文按单字 + 相邻二元组切分，英文/数字按整词
+    文档侧同时保留单字与二元组；查询侧两字以上的中文片段只取二元组，
+    单字查询 (如 "鸡") 则命中单字倒排
+    """
+    tokens = []
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    for segment in _SEARCH_SEGMENT_RE.findall(text):
+        if segment.isascii() or len(segment) == 1:
+            tokens.append(segment)
+            continue
+        if not for_query:
+            tokens.extend(segment)
+        tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
 class WeChatService:
     @staticmethod
     def get_openid(code):
@@ -77,6 +100,47 @@ class WeChatService:
             "session_key": data.get("session_key")
         }
 
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lng, precision=6):
+    """经纬度编码为 geohash 字符串 (precision=6 约为 1.2km × 0.6km 的格子)"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, bounds = (lng, lng_range) if even else (lat, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            bounds[0] = mid
+        else:
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_decode(geohash):
+    """geohash 格子中心点，返回 (lat, lng)"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lng_range if even else lat_range
+            mid = (bounds[0] + bounds[1]) / 2
+            if value >> shift & 1:
+                bounds[0] = mid
+            else:
+                bounds[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2
+
+
 class AMapService:
     @staticmethod
     def search_nearby_restaurants(lng, lat, radius=3000, page=1, offset=20):
@@ -131,41 +195,140 @@ def encode_image_to_base64(image_file):
         return None  
     
 
+def _sniff_image_mime(image_content, content_type=''):
+    """结合 Content-Type 与文件魔数（JPEG / PNG / WebP / GIF）判断真实 MIME"""
+    if content_type and content_type != 'application/octet-stream':
+        return content_type
+    if image_content.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if image_content.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if image_content.startswith(b'GIF87a') or image_content.startswith(b'GIF89a'):
+        return 'image/gif'
+    if image_content.startswith(b'RIFF') and image_content[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'  # 默认降级
+
+
+def _upload_size(image_file):
+    size = getattr(image_file, 'size', None)
+    if size is None and hasattr(image_file, 'seek'):
+        image_file.seek(0, 2)
+        size = image_file.tell()
+    return size or 0
+
+
+def preprocess_image(image_file):
+    """
+    送入视觉模型前的图片预处理：按 EXIF 方向摆正、长边缩放到 AI_IMAGE_MAX_EDGE、
+    以 AI_IMAGE_FORMAT / AI_IMAGE_QUALITY 重新编码。
+    返回 (bytes, mime)；无法解码或重新编码后反而更大时返回 None，由调用方回退为原图。
+    """
+    from io import BytesIO
+    from PIL import Image, ImageOps
+
+    max_edge = int(getattr(settings, 'AI_IMAGE_MAX_EDGE', 1568))
+    fmt = str(getattr(settings, 'AI_IMAGE_FORMAT', 'JPEG')).upper()
+    quality = int(getattr(settings, 'AI_IMAGE_QUALITY', 85))
+
+    image_file.seek(0)
+    with Image.open(image_file) as image:
+        needs_resize = max(image.size) > max_edge
+        # 非 JPEG 无法在解码时缩放，像素过多时直接放弃预处理以限制单请求内存
+        if image.format != 'JPEG' and image.size[0] * image.size[1] > int(getattr(settings, 'AI_IMAGE_MAX_PIXELS', 40_000_000)):
+            raise ValueError(f"image too large to decode: {image.size}")
+        rotated = image.getexif().get(0x0112, 1) != 1
+        if not needs_resize and not rotated and image.format == fmt:
+            return None
+        # JPEG 可在解码阶段按 DCT 缩放，避免把整张大图解码进内存
+        image.draft('RGB', (max_edge, max_edge))
+        oriented = ImageOps.exif_transpose(image)
+        if needs_resize:
+            oriented.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if oriented.mode not in ('RGB', 'L'):
+            # 透明背景铺白，避免 JPEG 把透明区域编码成黑色
+            rgba = oriented.convert('RGBA')
+            oriented = Image.new('RGB', rgba.size, (255, 255, 255))
+            oriented.paste(rgba, mask=rgba.getchannel('A'))
+        buffer = BytesIO()
+        oriented.save(buffer, format=fmt, quality=quality, optimize=True)
+
+    if not needs_resize and buffer.tell() >= _upload_size(image_file):
+        return None
+    buffer.seek(0)
+    return buffer, Image.MIME.get(fmt, 'image/jpeg')
+
+
+def stream_to_data_url(stream, size, mime_type, chunk_size=3 * 64 * 1024):
+    """
+    分块 base64 编码到预分配的缓冲区，避免 原始字节 + 编码结果 + 拼接字符串 的多份整图拷贝。
+    chunk_size 须为 3 的倍数，保证中间分块不产生填充字符。
+    """
+    import binascii
+
+    prefix = f"data:{mime_type};base64,".encode('ascii')
+    buffer = bytearray(len(prefix) + 4 * ((size + 2) // 3))
+    view = memoryview(buffer)
+    view[:len(prefix)] = prefix
+    pos = len(prefix)
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        chunk = pending + chunk if pending else chunk
+        usable = len(chunk) - len(chunk) % 3
+        pending = chunk[usable:]
+        encoded = binascii.b2a_base64(memoryview(chunk)[:usable], newline=False)
+        if pos + len(encoded) > len(buffer):
+            raise ValueError("upload grew while encoding")
+        view[pos:pos + len(encoded)] = encoded
+        pos += len(encoded)
+    if pending:
+        encoded = binascii.b2a_base64(pending, newline=False)
+        view[pos:pos + len(encoded)] = encoded
+        pos += len(encoded)
+    return str(view[:pos], 'ascii')
+
+
 def uploaded_image_to_data_url(image_file):
     """
-    读取原始字节，结合 Content-Type 与 文件魔数（JPEG / PNG / WebP / GIF）
-    生成与真实格式一致的 data:<mime>;base64,... URL
+    生成与真实格式一致的 data:<mime>;base64,... URL。
+    默认先经 preprocess_image 缩放、重新编码，并在日志中记录节省的字节数；
+    无法处理的图片回退为原始字节。
     """
     try:
-        # 重置文件指针
-        if hasattr(image_file, 'seek'):
+        original_size = _upload_size(image_file)
+        processed = None
+        if getattr(settings, 'AI_IMAGE_PREPROCESS', True):
+            try:
+                processed = preprocess_image(image_file)
+            except Exception as e:
+                logger.warning("Image preprocess skipped: %s", e)
+
+        if processed:
+            stream, mime_type = processed
+            size = stream.getbuffer().nbytes
+            logger.info(
+                "[IMAGE] preprocessed %d -> %d bytes (saved %.0f%%)",
+                original_size, size,
+                100 * (1 - size / original_size) if original_size else 0,
+            )
+        else:
+            # 重置文件指针，原图按块读取（大文件保持在磁盘临时文件中）
+            stream, size = image_file, original_size
+            if hasattr(image_file, 'seek'):
+                image_file.seek(0)
+            head = image_file.read(16)
             image_file.seek(0)
-        
-        image_content = image_file.read()
-        if not image_content:
+            mime_type = _sniff_image_mime(head, getattr(image_file, 'content_type', ''))
+
+        if not size:
             logger.warning("Image encode failed: empty file content")
             return None
-            
-        base64_content = base64.b64encode(image_content).decode('utf-8')
-        
-        # 1. 尝试从文件对象获取 Content-Type
-        mime_type = getattr(image_file, 'content_type', '')
-        
-        # 2. 如果没有 Content-Type 或者是通用流，则通过文件魔数判断
-        if not mime_type or mime_type == 'application/octet-stream':
-            if image_content.startswith(b'\xff\xd8'):
-                mime_type = 'image/jpeg'
-            elif image_content.startswith(b'\x89PNG\r\n\x1a\n'):
-                mime_type = 'image/png'
-            elif image_content.startswith(b'GIF87a') or image_content.startswith(b'GIF89a'):
-                mime_type = 'image/gif'
-            elif image_content.startswith(b'RIFF') and image_content[8:12] == b'WEBP':
-                mime_type = 'image/webp'
-            else:
-                mime_type = 'image/jpeg'  # 默认降级
-        
-        return f"data:{mime_type};base64,{base64_content}"
-        
+
+        return stream_to_data_url(stream, size, mime_type)
+
     except Exception as e:
         logger.exception("Image encode failed: %s", e)
         return None
@@ -9,6 +9,14 @@ import uuid
 import os
 
 
+def _preview_comments(request):
+    """?preview_comments=N：动态流内嵌的最新评论条数 (上限见 COMMUNITY_COMMENT_PREVIEW_SIZE)"""
+    try:
+        return max(int(request.query_params.get('preview_comments', 0)), 0)
+    except ValueError:
+        return 0
+
+
 class CommunityFeedView(APIView):
     """动态流: GET/POST /diet/community/feed/ 及 POST /diet/community/share/"""
     permission_classes = [IsAuthenticated]
@@ -18,18 +26,39 @@ class CommunityFeedView(APIView):
         page_size = int(request.query_params.get('page_size', 10))
         
         # 1. 基础数据查询 (来自 Service 层，已含有基础的 is_saved, is_liked 判定)
-        data = CommunityService.get_feed_list(page, page_size, current_user_id=request.user.id)
+        # 传 cursor 时按游标翻页，page 参数仅为旧客户端保留
+        data = CommunityService.get_feed_page(
+            page, page_size, current_user_id=request.user.id, cursor=request.query_params.get('cursor'),
+            preview_comments=_preview_comments(request),
+        )
         
         # 2. [新增] 增强层：动态聚合用户徽章、组装标准数据结构
         from apps.diet.serializers.community import FeedResponseEnhancer
-        enhanced_data = FeedResponseEnhancer.enhance_feed_list(data, request.user)
+        enhanced_data = FeedResponseEnhancer.enhance_feed_list(data["list"], request.user)
         
-        return Response({"code": 200, "msg": "success", "data": {"list": enhanced_data}})
+        return Response({"code": 200, "msg": "success", "data": {
+            "list": enhanced_data, "next_cursor": data["next_cursor"], "has_more": data["has_more"]
+        }})
     
     def post(self, request):
         feed_id = CommunityService.publish_feed(request.user.id, request.data)
         return Response({"code": 200, "msg": "发布成功", "data": {"id": feed_id}})
     
+class CommunityTimelineView(APIView):
+    """关注流: GET /diet/community/timeline/?cursor=&page_size="""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            page_size = max(1, min(int(request.query_params.get('page_size', 10)), 50))
+        except ValueError:
+            page_size = 10
+        data = CommunityService.get_following_feed(
+            request.user.id, cursor=request.query_params.get('cursor'), page_size=page_size,
+            preview_comments=_preview_comments(request),
+        )
+        return Response({"code": 200, "msg": "success", "data": data})
+
 class CommunityShareListView(APIView):
     """分类分享列表: GET /diet/community/recipes/ 或 /restaurants/"""
     permission_classes = [IsAuthenticated]
@@ -38,8 +67,11 @@ class CommunityShareListView(APIView):
     def get(self, request):
         page = int(request.query_params.get('page', 1))
         page_size = int(request.query_params.get('page_size', 10))
-        data = CommunityService.get_feed_list(page, page_size, feed_type=self.feed_type)
-        return Response({"code": 200, "msg": "success", "data": {"list": data}})
+        data = CommunityService.get_feed_page(
+            page, page_size, feed_type=self.feed_type, cursor=request.query_params.get('cursor'),
+            preview_comments=_preview_comments(request),
+        )
+        return Response({"code": 200, "msg": "success", "data": data})
 
 class CommunityLikeView(APIView):
     """点赞与取消: POST/DELETE /diet/community/feed/{feedId}/like/"""
@@ -62,8 +94,18 @@ class CommunityCommentView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, feedId):
-        data = CommunityService.get_comments(feedId)
-        return Response({"code": 200, "msg": "success", "data": data})
+        try:
+            page_size = max(1, min(int(request.query_params.get('page_size', 20)), 50))
+            page = int(request.query_params['page']) if 'page' in request.query_params else None
+        except ValueError:
+            page_size, page = 20, None
+        data = CommunityService.get_comments(
+            feedId, cursor=request.query_params.get('cursor'), page_size=page_size, page=page
+        )
+        # data 仍为评论数组以兼容旧客户端，翻页信息放在 pagination
+        return Response({"code": 200, "msg": "success", "data": data["list"], "pagination": {
+            "next_cursor": data["next_cursor"], "has_more": data["has_more"]
+        }})
 
     def post(self, request, feedId):
         content = request.data.get("content")
@@ -164,12 +206,11 @@ class UserProfileView(APIView):
 
     def get(self, request, userId):
         from django.shortcuts import get_object_or_404
-        from apps.users.models import User, Profile, UserFollow
+        from apps.users.models import User, UserFollow
         from apps.diet.models.mongo.community import CommunityFeed
-        from apps.diet.models.mysql.gamification import UserFeaturedBadge
+        from apps.diet.domains.community.user_cards import UserCards
         
         target_user = get_object_or_404(User, id=userId)
-        profile, _ = Profile.objects.get_or_create(user=target_user)
         
         # 1. 社交统计
         follow_count = UserFollow.objects.filter(follower=target_user).count()
@@ -183,26 +224,14 @@ class UserProfileView(APIView):
         except Exception:
             like_count = 0
             
-        # 3. 拉取名片代表徽章
-        featured = UserFeaturedBadge.objects.filter(user=target_user).select_related('achievement')
-        badges = [{"id": str(b.achievement.id), "name": b.achievement.title, "icon": b.achievement.icon} for b in featured]
-
-        # 4. 头像防腐处理
-        avatar_url = target_user.avatar
-        if not avatar_url and getattr(profile, 'avatar', None):
-            avatar_url = profile.avatar.url if hasattr(profile.avatar, 'url') else str(profile.avatar)
-
-        data = {
-            "id": target_user.id,
-            "nickname": target_user.nickname or target_user.username,
-            "avatar": avatar_url,
-            "signature": getattr(profile, 'signature', ''),
+        # 3. 名片信息 (昵称、头像、签名、代表徽章) 走共享的用户名片缓存
+        data = UserCards.get(target_user.id)
+        data.update({
             "follow_count": follow_count,
             "fans_count": fans_count,
             "like_count": like_count,
             "is_followed": is_followed,
-            "featured_badges": badges
-        }
+        })
         return Response({"code": 200, "msg": "success", "data": data})
 
 class UserPostsView(APIView):
@@ -222,12 +251,16 @@ class UserPostsView(APIView):
         from apps.diet.models.mongo.community import CommunityFeed
         from apps.diet.serializers.community import FeedResponseEnhancer
         
-        skip = (page - 1) * page_size
-        # 降序查询 MongoDB 个人帖子，排除违规隐藏项
-        qs = CommunityFeed.objects.filter(user_id=int(userId), is_hidden=False).order_by('-created_at')[skip:skip+page_size]
+        from apps.common.pagination import keyset_paginate
+        
+        # 降序查询 MongoDB 个人帖子，排除违规隐藏项；cursor 优先于 page
+        result = keyset_paginate(
+            CommunityFeed.objects.filter(user_id=int(userId), is_hidden=False),
+            cursor=request.query_params.get('cursor'), page_size=page_size, page=page,
+        )
         
         raw_list = []
-        for post in qs:
+        for post in result.items:
             raw_list.append({
                 "id": str(post.id),
                 "user_id": post.user_id,
@@ -243,7 +276,9 @@ class UserPostsView(APIView):
         # [复用聚合层] 批量补齐徽章、用户信息及状态
         enhanced_data = FeedResponseEnhancer.enhance_feed_list(raw_list, request.user)
         
-        return Response({"code": 200, "msg": "success", "data": {"list": enhanced_data}})
+        return Response({"code": 200, "msg": "success", "data": {
+            "list": enhanced_data, "next_cursor": result.next_cursor, "has_more": result.has_more
+        }})
 
 
 class CommunityUploadView(APIView):
@@ -8,6 +8,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.common.utils import normalize_ingredient_name
+from apps.diet.domains.discovery.health_classifier import HealthClassifier
 from apps.diet.domains.discovery.lbs_service import LBSService
 from apps.diet.domains.discovery.matching_service import MatchingService
 from apps.diet.domains.discovery.recommendation_service import RecommendationService
@@ -54,7 +55,16 @@ class RecommendSearchView(APIView):
             lng, lat = request.data.get("lng"), request.data.get("lat")
             if not lng or not lat:
                 return Response({"code": 400, "msg": "需要经纬度"}, status=400)
-            data = LBSService.get_recommendations(float(lng), float(lat))
+            try:
+                min_health_score = int(request.data.get("min_health_score") or 0)
+            except (TypeError, ValueError):
+                min_health_score = 0
+            data = LBSService.get_recommendations(
+                float(lng),
+                float(lat),
+                sort_by=request.data.get("sort_by", "distance"),
+                min_health_score=min_health_score,
+            )
             return Response({"code": 200, "data": {"recommendations": data}})
 
         return Response({"code": 400, "msg": "无效参数"}, status=400)
@@ -150,6 +160,7 @@ class RestaurantDetailView(APIView):
                     "rating": shop.rating,
                     "photos": getattr(shop, "photos", []),
                     "menu_items": shop.menu if getattr(shop, "menu", None) else [],
+                    **HealthClassifier.summary(shop),
                 },
             }
         )
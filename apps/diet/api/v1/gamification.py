@@ -269,6 +269,10 @@ class UserFeaturedBadgeView(APIView):
             
             if new_badges:
                 UserFeaturedBadge.objects.bulk_create(new_badges)
+
+        # bulk_create 不触发 post_save，名片缓存需手动失效
+        from apps.diet.domains.community.user_cards import UserCards
+        UserCards.invalidate([request.user.id])
                 
         return Response({"code": 200, "msg": "名片徽章配置成功"})
 
@@ -7,7 +7,9 @@ from django.utils import timezone
 from django.core.cache import cache
 import datetime
 from django.http import StreamingHttpResponse 
+from apps.common.uploads import BoundedUploadMixin
 from apps.diet.domains.tools.ai_service import AIService
+from apps.diet.domains.tools.chat_context import ChatContextStore
 from apps.diet.models import DailyIntake
 from apps.users.models import Profile
 
@@ -15,7 +17,7 @@ from django.core.files.storage import default_storage
 import uuid
 import os
 
-class AIFoodRecognitionView(APIView):
+class AIFoodRecognitionView(BoundedUploadMixin, APIView):
     """拍图识热量"""
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser]
@@ -69,14 +71,21 @@ class AIChatStreamView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
+        user_id = request.user.id
+        if request.data.get("reset"):
+            ChatContextStore.reset(user_id)
         question = request.data.get("question")
         if not question:
+            if request.data.get("reset"):
+                return Response({"code": 200, "msg": "对话已重置"})
             return Response({"code": 400, "msg": "问题不能为空"}, status=400)
-            
-        context_messages = request.data.get("context", [])
-        
-        # 获取生成器
-        stream_generator = AIService.chat_with_ai_stream(question, context_messages)
+
+        # 上下文由服务端维护，客户端只需提交本轮问题 (旧版客户端传入的 context 将被忽略)
+        stream_generator = AIService.chat_with_ai_stream(
+            question,
+            ChatContextStore.messages(user_id),
+            on_complete=lambda answer: ChatContextStore.append(user_id, question, answer),
+        )
         
         # 返回 SSE 响应
         response = StreamingHttpResponse(
@@ -115,12 +124,11 @@ class AIChatView(APIView):
         if not question:
             return Response({"code": 400, "msg": "问题不能为空"}, status=400)
             
-        # 接收前端传递的上下文数组
-        context_messages = request.data.get("context", [])
-        
-        res = AIService.chat_with_ai(question, context_messages)
+        # 与流式问答共用服务端会话上下文
+        res = AIService.chat_with_ai(question, ChatContextStore.messages(request.user.id))
         if "error" in res:
             return Response({"code": 500, "msg": res['error']}, status=500)
+        ChatContextStore.append(request.user.id, question, res["answer"])
             
         return Response({"code": 200, "msg": "success", "data": res})
 
@@ -154,7 +162,7 @@ class AIAttachmentUploadView(APIView):
     
 
 # [新增] 食材智能识别视图
-class AIIngredientRecognitionView(APIView):
+class AIIngredientRecognitionView(BoundedUploadMixin, APIView):
     """食材智能识别 (用于冰箱添加): POST /diet/ingredient/recognize/"""
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser]
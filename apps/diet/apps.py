@@ -1,6 +1,16 @@
+import atexit
+
 from django.apps import AppConfig
 
 class DietConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.diet'
-    verbose_name = "饮食与健康管理"
\ No newline at end of file
+    verbose_name = "饮食与健康管理"
+
+    def ready(self):
+        # 注册推荐索引等增量更新的信号处理器
+        from apps.diet import signals  # noqa: F401
+        from apps.diet.domains.tools.ai_metrics import AIMetrics
+
+        # 进程退出时补写 AI 指标缓冲 (仅限启动过回写线程的进程)
+        atexit.register(AIMetrics.flush_at_exit)
@@ -0,0 +1,230 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from apps.common.pagination import keyset_paginate
+from apps.common.redis import get_redis
+from apps.diet.domains.community.user_cards import UserCards
+from apps.diet.models.mongo.community import Comment, CommunityFeed
+
+
+logger = logging.getLogger(__name__)
+
+
+class FeedComments:
+    """Comment threads of community feeds.
+
+    Threads are read newest first with keyset cursors, and authors are
+    hydrated with one ``UserCards.get_many`` per page. Each feed embeds its
+    newest COMMUNITY_COMMENT_PREVIEW_SIZE comments in ``recent_comments``, so
+    feed lists can show a preview without another query. Adding or deleting
+    a comment updates ``comments_count`` and the preview in one atomic update
+    of the feed document. Mongo has no cross-document transaction here, so
+    the feed is marked dirty in Redis before and again after that update. A
+    per-process worker re-counts dirty feeds and repairs any drift with a
+    write conditioned on the count it read, so a concurrent ``$inc`` is never
+    overwritten. ``reconcile`` sweeps every feed.
+    """
+
+    DIRTY_KEY = "diet_comment:dirty"
+    _worker_pid = None
+    _worker_lock = threading.Lock()
+
+    @staticmethod
+    def preview_size():
+        return max(int(getattr(settings, "COMMUNITY_COMMENT_PREVIEW_SIZE", 3)), 0)
+
+    @staticmethod
+    def _interval():
+        return float(getattr(settings, "COMMUNITY_COMMENT_RECONCILE_INTERVAL", 30))
+
+    @staticmethod
+    def _entry(comment):
+        return {
+            "id": str(comment.id),
+            "user_id": comment.user_id,
+            "content": comment.content,
+            "created_at": comment.created_at,
+        }
+
+    @staticmethod
+    def format(entries, cards):
+        """API shape of comments or preview entries; ``cards`` comes from UserCards.get_many."""
+        result = []
+        for entry in entries:
+            if not isinstance(entry, dict):
+                entry = FeedComments._entry(entry)
+            result.append({
+                "id": str(entry["id"]),
+                "user_id": entry["user_id"],
+                "user": cards.get(entry["user_id"]) or UserCards.placeholder(entry["user_id"]),
+                "content": entry["content"],
+                "created_at": entry["created_at"].strftime('%Y-%m-%d %H:%M:%S'),
+            })
+        return result
+
+    @classmethod
+    def previews(cls, feeds, limit):
+        """Embedded preview entries per feed id, newest first, at most ``limit`` each."""
+        limit = min(max(int(limit or 0), 0), cls.preview_size())
+        if not limit:
+            return {}
+        return {str(feed.id): list(getattr(feed, "recent_comments", None) or [])[:limit] for feed in feeds}
+
+    @classmethod
+    def page(cls, feed, cursor=None, page_size=20, page=None):
+        result = keyset_paginate(Comment.objects.filter(feed_id=feed), cursor=cursor, page_size=page_size, page=page)
+        cards = UserCards.get_many([comment.user_id for comment in result.items])
+        return {
+            "list": cls.format(result.items, cards),
+            "next_cursor": result.next_cursor,
+            "has_more": result.has_more,
+        }
+
+    @classmethod
+    def add(cls, user_id, feed, content):
+        """Store a comment and bump the feed's count and preview."""
+        cls._mark_dirty([feed.id])
+        comment = Comment(feed_id=feed, user_id=user_id, content=content)
+        comment.save()
+        update = {"$inc": {"comments_count": 1}}
+        if cls.preview_size():
+            update["$push"] = {"recent_comments": {"$each": [cls._entry(comment)], "$position": 0, "$slice": cls.preview_size()}}
+        try:
+            CommunityFeed._get_collection().update_one({"_id": feed.id}, update)
+        except PyMongoError as exc:
+            # 评论已落库，计数与预览交由后台对账补齐
+            logger.warning("Comment count update of feed %s failed: %s", feed.id, exc)
+        # 写前标记防进程中断，写后再标记：对账可能在 save 与 $inc 之间取走了标记
+        cls._mark_dirty([feed.id])
+        cls.ensure_worker()
+        return comment
+
+    @classmethod
+    def delete(cls, comment):
+        feed_id = comment.feed_id.id if comment.feed_id else None
+        if feed_id is not None:
+            cls._mark_dirty([feed_id])
+        comment.delete()
+        if feed_id is not None:
+            try:
+                CommunityFeed._get_collection().update_one(
+                    {"_id": feed_id, "comments_count": {"$gt": 0}},
+                    {"$inc": {"comments_count": -1}, "$pull": {"recent_comments": {"id": str(comment.id)}}},
+                )
+            except PyMongoError as exc:
+                logger.warning("Comment count update of feed %s failed: %s", feed_id, exc)
+            cls._mark_dirty([feed_id])
+            cls.ensure_worker()
+
+    @classmethod
+    def _mark_dirty(cls, feed_ids):
+        r = get_redis()
+        if r is None or not feed_ids:
+            return
+        try:
+            r.sadd(cls.DIRTY_KEY, *[str(feed_id) for feed_id in feed_ids])
+        except Exception as exc:
+            logger.warning("Marking feeds for comment reconciliation failed: %s", exc)
+
+    @classmethod
+    def ensure_worker(cls):
+        """Start the per-process reconcile thread (again after a fork)."""
+        if cls._worker_pid == os.getpid() or get_redis() is None or not getattr(settings, "COMMUNITY_COMMENT_WORKER", True):
+            return
+        with cls._worker_lock:
+            if cls._worker_pid == os.getpid():
+                return
+
+            def run():
+                while True:
+                    time.sleep(cls._interval())
+                    try:
+                        cls.reconcile_dirty()
+                    except Exception as exc:
+                        logger.warning("Comment reconcile failed: %s", exc)
+
+            threading.Thread(target=run, name="comment-reconcile", daemon=True).start()
+            cls._worker_pid = os.getpid()
+
+    @classmethod
+    def reconcile_dirty(cls, batch_size=500):
+        """Re-check feeds marked dirty since the last run; returns the repair statistics."""
+        stats = {"feeds": 0, "fixed": 0}
+        r = get_redis()
+        if r is None:
+            return stats
+        while True:
+            feed_ids = [member.decode() if isinstance(member, bytes) else member for member in r.spop(cls.DIRTY_KEY, batch_size) or []]
+            if not feed_ids:
+                return stats
+            try:
+                docs = CommunityFeed.objects(id__in=feed_ids).only("id", "comments_count", "recent_comments").as_pymongo()
+                cls._reconcile_batch(list(docs), stats)
+            except Exception:
+                # 失败时放回脏集合，下轮重试
+                r.sadd(cls.DIRTY_KEY, *feed_ids)
+                raise
+
+    @classmethod
+    def reconcile(cls, batch_size=500):
+        """Sweep every feed: fix ``comments_count`` and refill previews from the comment collection."""
+        stats = {"feeds": 0, "fixed": 0}
+        batch = []
+        for doc in CommunityFeed.objects.only("id", "comments_count", "recent_comments").as_pymongo().batch_size(batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                cls._reconcile_batch(batch, stats)
+                batch = []
+        if batch:
+            cls._reconcile_batch(batch, stats)
+        return stats
+
+    @classmethod
+    def _reconcile_batch(cls, docs, stats):
+        if not docs:
+            return
+        size = cls.preview_size()
+        feed_ids = [doc["_id"] for doc in docs]
+        counts = {
+            row["_id"]: row["count"]
+            for row in Comment._get_collection().aggregate([
+                {"$match": {"feed_id": {"$in": feed_ids}}},
+                {"$group": {"_id": "$feed_id", "count": {"$sum": 1}}},
+            ])
+        }
+        operations = []
+        for doc in docs:
+            stats["feeds"] += 1
+            actual = counts.get(doc["_id"], 0)
+            preview = doc.get("recent_comments") or []
+            if doc.get("comments_count", 0) == actual and len(preview) == min(actual, size):
+                continue
+            # 只有出现偏差的帖子才重建预览，单帖按 (feed_id, -created_at) 索引取前 N 条
+            recent = Comment.objects(feed_id=doc["_id"]).order_by("-created_at", "-id").limit(size) if size else []
+            # 以读到的计数为条件：期间有并发 $inc/$dec 时本次修复落空，留给下一轮复核
+            operations.append(UpdateOne(
+                {"_id": doc["_id"], "comments_count": doc.get("comments_count", 0)},
+                {"$set": {"comments_count": actual, "recent_comments": [cls._entry(comment) for comment in recent]}},
+            ))
+        if operations:
+            CommunityFeed._get_collection().bulk_write(operations, ordered=False)
+            stats["fixed"] += len(operations)
+
+
+def _reconcile_at_exit():
+    if FeedComments._worker_pid != os.getpid():
+        return
+    try:
+        FeedComments.reconcile_dirty()
+    except Exception as exc:
+        logger.warning("Comment reconcile at exit failed: %s", exc)
+
+
+atexit.register(_reconcile_at_exit)
@@ -0,0 +1,378 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from mongoengine.errors import ValidationError
+from pymongo import UpdateOne
+from redis.exceptions import WatchError
+
+from apps.common.redis import get_redis
+from apps.diet.models.mongo.community import CommunityFeed
+from apps.diet.models.mysql.preference import UserPreference
+
+
+logger = logging.getLogger(__name__)
+
+
+class FeedCounters:
+    """Redis-authoritative like/save state for community feeds.
+
+    Per feed and action a Redis set holds the user ids; its cardinality is the
+    count. A tap is one pipelined round trip (membership change, count and an
+    entry on the pending-ops list). A per-process background worker drains the
+    list in batches, reads the current membership back from Redis and writes
+    it to MySQL UserPreference rows and the Mongo ``likes_count``/``save_count``
+    fields, so duplicated or reordered ops are harmless. A set is seeded from
+    MySQL the first time its feed is touched; ``reconcile`` repairs any drift
+    between the three stores. Without Redis the callers keep their
+    synchronous MySQL/Mongo path. Taps that fall back to it because Redis
+    failed mid-request are remembered and replayed into the sets once Redis
+    answers again, so they are not undone by the next flush.
+    """
+
+    ACTIONS = {"like": "likes_count", "save": "save_count"}
+    OPS_KEY = "diet_feed_counter:ops"
+    READY_CACHE_SIZE = 10000
+    _ready = set()
+    # Redis 故障期间走了 MySQL 同步路径的操作 (feed_id, action, user_id, add)，恢复后按序回放
+    _fallback = []
+    _fallback_lock = threading.Lock()
+    _worker_pid = None
+    _worker_lock = threading.Lock()
+
+    @staticmethod
+    def _flush_interval():
+        return float(getattr(settings, "COMMUNITY_COUNTER_FLUSH_INTERVAL", 2))
+
+    @staticmethod
+    def _flush_batch():
+        return max(int(getattr(settings, "COMMUNITY_COUNTER_FLUSH_BATCH", 1000)), 1)
+
+    @staticmethod
+    def set_key(feed_id, action):
+        return f"diet_feed_{action}:{feed_id}"
+
+    @classmethod
+    def _ready_key(cls, feed_id, action):
+        return f"{cls.set_key(feed_id, action)}:ready"
+
+    @classmethod
+    def _seed(cls, r, feed_id, action):
+        """Load the MySQL members of a cold set once; concurrent seeders are ignored."""
+        members = list(UserPreference.objects.filter(
+            target_type="feed", target_id=feed_id, action=action
+        ).values_list("user_id", flat=True))
+        ready_key = cls._ready_key(feed_id, action)
+        with r.pipeline() as pipe:
+            try:
+                pipe.watch(ready_key)
+                if pipe.exists(ready_key):
+                    return
+                pipe.multi()
+                # 旧版本尽力写入的同名集合可能残留已取消的成员，先清空再以 MySQL 为准
+                pipe.delete(cls.set_key(feed_id, action))
+                if members:
+                    pipe.sadd(cls.set_key(feed_id, action), *members)
+                pipe.set(ready_key, 1)
+                pipe.execute()
+            except WatchError:
+                pass
+
+    @staticmethod
+    def _feed_exists(feed_id):
+        try:
+            return CommunityFeed.objects(id=feed_id).count() > 0
+        except ValidationError:
+            return False
+
+    @classmethod
+    def toggle(cls, user_id, feed_id, action, add):
+        """Apply a like/save change; returns ``(count, member)``, or None without Redis.
+
+        Raises CommunityFeed.DoesNotExist for an unknown feed on a cold set.
+        """
+        r = get_redis()
+        if r is None:
+            return None
+        feed_id = str(feed_id)
+        key = cls.set_key(feed_id, action)
+        try:
+            cls._recover(r)
+            if (feed_id, action) not in cls._ready:
+                if not r.exists(cls._ready_key(feed_id, action)):
+                    if not cls._feed_exists(feed_id):
+                        raise CommunityFeed.DoesNotExist
+                    cls._seed(r, feed_id, action)
+                if len(cls._ready) >= cls.READY_CACHE_SIZE:
+                    cls._ready.clear()
+                cls._ready.add((feed_id, action))
+
+            op = json.dumps([feed_id, action, int(user_id)])
+            pipe = r.pipeline(transaction=True)
+            pipe.exists(cls._ready_key(feed_id, action))
+            if add:
+                pipe.sadd(key, user_id)
+            else:
+                pipe.srem(key, user_id)
+            pipe.scard(key)
+            pipe.rpush(cls.OPS_KEY, op)
+            ready, _, count, _ = pipe.execute()
+            if not ready:
+                # Redis 被清空后本地的 ready 记录失效：补种子后重放本次操作
+                cls._ready.discard((feed_id, action))
+                cls._seed(r, feed_id, action)
+                if add:
+                    r.sadd(key, user_id)
+                else:
+                    r.srem(key, user_id)
+                count = r.scard(key)
+        except CommunityFeed.DoesNotExist:
+            raise
+        except Exception as exc:
+            logger.warning("Feed counter write failed, falling back to MySQL: %s", exc)
+            with cls._fallback_lock:
+                cls._fallback.append((feed_id, action, int(user_id), add))
+            return None
+        cls.ensure_worker()
+        return int(count), add
+
+    @classmethod
+    def _recover(cls, r):
+        """Replay taps that went to MySQL while Redis was failing, so the sets stay authoritative."""
+        if not cls._fallback:
+            return
+        with cls._fallback_lock:
+            pending, cls._fallback = cls._fallback, []
+        try:
+            pipe = r.pipeline(transaction=False)
+            for feed_id, action, user_id, add in pending:
+                if add:
+                    pipe.sadd(cls.set_key(feed_id, action), user_id)
+                else:
+                    pipe.srem(cls.set_key(feed_id, action), user_id)
+                pipe.rpush(cls.OPS_KEY, json.dumps([feed_id, action, user_id]))
+            pipe.execute()
+        except Exception:
+            with cls._fallback_lock:
+                cls._fallback[:0] = pending
+            raise
+
+    @classmethod
+    def states(cls, feed_ids, user_id=None):
+        """Live counts and membership of seeded feeds, in one round trip.
+
+        Returns ``{feed_id: {"likes_count", "save_count", "is_liked", "is_saved"}}``
+        with an entry per feed and action whose set is seeded; callers fall
+        back to the stored values for the rest.
+        """
+        r = get_redis()
+        feed_ids = [str(feed_id) for feed_id in feed_ids]
+        if r is None or not feed_ids:
+            return {}
+        try:
+            cls._recover(r)
+        except Exception as exc:
+            logger.warning("Feed counter read failed: %s", exc)
+            return {}
+        pipe = r.pipeline(transaction=False)
+        for feed_id in feed_ids:
+            for action in cls.ACTIONS:
+                key = cls.set_key(feed_id, action)
+                pipe.exists(cls._ready_key(feed_id, action))
+                pipe.scard(key)
+                pipe.sismember(key, user_id or 0)
+        try:
+            replies = iter(pipe.execute())
+        except Exception as exc:
+            logger.warning("Feed counter read failed: %s", exc)
+            return {}
+        result = {}
+        for feed_id in feed_ids:
+            for action, count_field in cls.ACTIONS.items():
+                ready, count, member = next(replies), next(replies), next(replies)
+                if ready:
+                    state = result.setdefault(feed_id, {})
+                    state[count_field] = int(count)
+                    state["is_liked" if action == "like" else "is_saved"] = bool(member) and bool(user_id)
+        return result
+
+    @classmethod
+    def ensure_worker(cls):
+        """Start the per-process flush thread (again after a fork)."""
+        if cls._worker_pid == os.getpid() or not getattr(settings, "COMMUNITY_COUNTER_WORKER", True):
+            return
+        with cls._worker_lock:
+            if cls._worker_pid == os.getpid():
+                return
+
+            def run():
+                while True:
+                    time.sleep(cls._flush_interval())
+                    try:
+                        cls.flush()
+                    except Exception as exc:
+                        logger.warning("Feed counter flush failed: %s", exc)
+
+            threading.Thread(target=run, name="feed-counter-flush", daemon=True).start()
+            cls._worker_pid = os.getpid()
+
+    @classmethod
+    def flush(cls, batch_size=None):
+        """Drain up to ``batch_size`` pending ops to MySQL and Mongo; returns the number drained."""
+        r = get_redis()
+        if r is None:
+            return 0
+        batch_size = batch_size or cls._flush_batch()
+        cls._recover(r)
+        pipe = r.pipeline(transaction=True)
+        pipe.lrange(cls.OPS_KEY, 0, batch_size - 1)
+        pipe.ltrim(cls.OPS_KEY, batch_size, -1)
+        raw_ops = pipe.execute()[0]
+        if not raw_ops:
+            return 0
+
+        pairs = sorted({tuple(json.loads(raw)) for raw in raw_ops})
+        feeds = sorted({(feed_id, action) for feed_id, action, _ in pairs})
+        try:
+            # 以 Redis 当前集合为准回读，重复或乱序的操作不影响结果
+            pipe = r.pipeline(transaction=False)
+            for feed_id, action in feeds:
+                pipe.exists(cls._ready_key(feed_id, action))
+            for feed_id, action, user_id in pairs:
+                pipe.sismember(cls.set_key(feed_id, action), user_id)
+            for feed_id, action in feeds:
+                pipe.scard(cls.set_key(feed_id, action))
+            replies = pipe.execute()
+            # 未播种 (或因故障回退被作废) 的集合不代表真实状态，其操作以 MySQL 为准直接丢弃
+            ready = {pair for pair, flag in zip(feeds, replies[:len(feeds)]) if flag}
+            replies = replies[len(feeds):]
+            members = {pair: member for pair, member in zip(pairs, replies[:len(pairs)]) if pair[:2] in ready}
+            counts = {pair: count for pair, count in zip(feeds, replies[len(pairs):]) if pair in ready}
+
+            added = [pair for pair, member in members.items() if member]
+            removed = defaultdict(list)
+            for (feed_id, action, user_id), member in members.items():
+                if not member:
+                    removed[(feed_id, action)].append(user_id)
+            cls._write_preferences(added, removed)
+            cls._write_counts(counts)
+        except Exception:
+            # 写库失败时把操作放回队列，下轮重试
+            r.rpush(cls.OPS_KEY, *raw_ops)
+            raise
+        return len(raw_ops)
+
+    @staticmethod
+    def _write_preferences(added, removed):
+        if added:
+            UserPreference.objects.bulk_create(
+                [
+                    UserPreference(user_id=user_id, target_id=feed_id, target_type="feed", action=action)
+                    for feed_id, action, user_id in added
+                ],
+                ignore_conflicts=True,
+            )
+        for (feed_id, action), user_ids in removed.items():
+            UserPreference.objects.filter(
+                target_type="feed", target_id=feed_id, action=action, user_id__in=user_ids
+            ).delete()
+
+    @classmethod
+    def _write_counts(cls, counts):
+        operations = []
+        for (feed_id, action), count in counts.items():
+            try:
+                operations.append(UpdateOne({"_id": ObjectId(feed_id)}, {"$set": {cls.ACTIONS[action]: int(count)}}))
+            except InvalidId:
+                continue
+        if operations:
+            CommunityFeed._get_collection().bulk_write(operations, ordered=False)
+
+    @classmethod
+    def drain(cls):
+        total = 0
+        while True:
+            drained = cls.flush()
+            total += drained
+            if not drained:
+                return total
+
+    @classmethod
+    def reconcile(cls, batch_size=500):
+        """Repair drift between Redis sets, MySQL preference rows and Mongo counts.
+
+        Seeded Redis sets are the truth; feeds without one are judged by their
+        MySQL rows. Returns repair statistics.
+        """
+        stats = {"feeds": 0, "counts_fixed": 0, "rows_added": 0, "rows_removed": 0}
+        try:
+            cls.drain()
+        except Exception as exc:
+            logger.warning("Feed counter drain before reconcile failed: %s", exc)
+        r = get_redis()
+        batch = []
+        for doc in CommunityFeed.objects.only("id", "likes_count", "save_count").as_pymongo().batch_size(batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                cls._reconcile_batch(r, batch, stats)
+                batch = []
+        if batch:
+            cls._reconcile_batch(r, batch, stats)
+        return stats
+
+    @classmethod
+    def _reconcile_batch(cls, r, docs, stats):
+        feed_ids = [str(doc["_id"]) for doc in docs]
+        stored = defaultdict(set)
+        for feed_id, action, user_id in UserPreference.objects.filter(
+            target_type="feed", action__in=list(cls.ACTIONS), target_id__in=feed_ids
+        ).values_list("target_id", "action", "user_id"):
+            stored[(feed_id, action)].add(int(user_id))
+
+        truth = {key: set(users) for key, users in stored.items()}
+        if r is not None:
+            pipe = r.pipeline(transaction=False)
+            keys = [(feed_id, action) for feed_id in feed_ids for action in cls.ACTIONS]
+            for feed_id, action in keys:
+                pipe.exists(cls._ready_key(feed_id, action))
+                pipe.smembers(cls.set_key(feed_id, action))
+            replies = pipe.execute()
+            for index, key in enumerate(keys):
+                if replies[index * 2]:
+                    truth[key] = {int(member) for member in replies[index * 2 + 1]}
+
+        added, removed, counts = [], defaultdict(list), {}
+        for doc, feed_id in zip(docs, feed_ids):
+            stats["feeds"] += 1
+            for action, count_field in cls.ACTIONS.items():
+                users = truth.get((feed_id, action), set())
+                current = stored.get((feed_id, action), set())
+                added.extend((feed_id, action, user_id) for user_id in users - current)
+                if current - users:
+                    removed[(feed_id, action)].extend(current - users)
+                if doc.get(count_field, 0) != len(users):
+                    counts[(feed_id, action)] = len(users)
+        stats["rows_added"] += len(added)
+        stats["rows_removed"] += sum(len(users) for users in removed.values())
+        stats["counts_fixed"] += len(counts)
+        cls._write_preferences(added, removed)
+        cls._write_counts(counts)
+
+
+def _flush_at_exit():
+    if FeedCounters._worker_pid != os.getpid():
+        return
+    try:
+        FeedCounters.flush()
+    except Exception as exc:
+        logger.warning("Feed counter flush at exit failed: %s", exc)
+
+
+atexit.register(_flush_at_exit)
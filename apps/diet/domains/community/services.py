@@ -1,6 +1,10 @@
 # [新增] 整个文件: apps/diet/domains/community/services.py
-from django.core.cache import cache
-from apps.diet.models.mongo.community import CommunityFeed, Comment
+from apps.common.pagination import keyset_paginate
+from apps.diet.domains.community.comments import FeedComments
+from apps.diet.domains.community.counters import FeedCounters
+from apps.diet.domains.community.timeline import FollowTimeline
+from apps.diet.domains.community.user_cards import UserCards
+from apps.diet.models.mongo.community import CommunityFeed
 
 class CommunityService:
     @staticmethod
@@ -15,11 +19,18 @@ class CommunityService:
             sport_info=data.get('sport_info', {}) # [新增]
         )
         feed.save()
+        FollowTimeline.fan_out(feed)
         return str(feed.id)
 
-    @staticmethod
-    def get_feed_list(page=1, page_size=10, feed_type=None, current_user_id=None, query_user_id=None):
-        skip = (page - 1) * page_size
+    @classmethod
+    def get_feed_list(cls, page=1, page_size=10, feed_type=None, current_user_id=None, query_user_id=None, cursor=None,
+                      preview_comments=0):
+        return cls.get_feed_page(page, page_size, feed_type, current_user_id, query_user_id, cursor, preview_comments)["list"]
+
+    @classmethod
+    def get_feed_page(cls, page=1, page_size=10, feed_type=None, current_user_id=None, query_user_id=None, cursor=None,
+                      preview_comments=0):
+        """动态分页：传 cursor 走 (created_at, _id) 游标，否则兼容 page 跳页；preview_comments>0 时内嵌最新评论"""
         query = CommunityFeed.objects
         
         if query_user_id:
@@ -28,23 +39,31 @@ class CommunityService:
         if feed_type:
             query = query.filter(feed_type=feed_type)
             
-        feeds = list(query.order_by('-created_at').skip(skip).limit(page_size))
-        
-        user_ids = list(set([feed.user_id for feed in feeds]))
-        
-        from apps.users.models import User, UserFollow
-        from apps.diet.domains.gamification.services import GamificationService
-        
-        users_qs = User.objects.filter(id__in=user_ids).select_related('profile')
-        user_dict = {}
-        for u in users_qs:
-            avatar = u.profile.avatar.url if (hasattr(u, 'profile') and u.profile and u.profile.avatar) else getattr(u, 'avatar', '')
-            user_dict[u.id] = {
-                "id": u.id,
-                "nickname": u.nickname or "未知用户",
-                "avatar": avatar or "",
-                "featured_badges": GamificationService.get_user_featured_badges(u.id)
-            }
+        result = keyset_paginate(query, cursor=cursor, page_size=page_size, page=page)
+        return {
+            "list": cls._format_feeds(result.items, current_user_id, preview_comments),
+            "next_cursor": result.next_cursor,
+            "has_more": result.has_more,
+        }
+
+    @classmethod
+    def get_following_feed(cls, user_id, cursor=None, page_size=10, preview_comments=0):
+        """关注流：写扩散时间线 + 大 V 读时拉取，游标分页"""
+        feeds, next_cursor = FollowTimeline.page(user_id, cursor=cursor, page_size=page_size)
+        return {
+            "list": cls._format_feeds(feeds, user_id, preview_comments),
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+        }
+
+    @staticmethod
+    def _format_feeds(feeds, current_user_id=None, preview_comments=0):
+        # 评论预览取自帖子内嵌快照，不额外查询 Mongo
+        previews = FeedComments.previews(feeds, preview_comments)
+        # 作者与预览评论者的名片一次批量水合：命中缓存时零查询，未命中时固定 3 次查询
+        user_dict = UserCards.get_many(
+            [feed.user_id for feed in feeds] + [entry["user_id"] for entries in previews.values() for entry in entries]
+        )
 
         saved_feed_ids = set()
         liked_feed_ids = set()
@@ -62,33 +81,47 @@ class CommunityService:
             except ImportError:
                 pass 
 
+        # 已进入 Redis 计数的帖子以集合为准，MySQL/Mongo 可能尚未回写
+        live = FeedCounters.states([f.id for f in feeds], current_user_id)
+
         result = []
         for feed in feeds:
+            state = live.get(str(feed.id), {})
             result.append({
                 "id": str(feed.id),
                 "content": feed.content,
                 "images": feed.images,
                 "type": feed.feed_type,
                 "target_id": feed.target_id,
-                "likes_count": feed.likes_count,
+                "likes_count": state.get("likes_count", feed.likes_count),
                 "comments_count": feed.comments_count,
                 "created_at": feed.created_at.strftime('%Y-%m-%d %H:%M:%S'),
                 "sport_info": feed.sport_info, 
-                "is_saved": str(feed.id) in saved_feed_ids, 
-                "is_liked": str(feed.id) in liked_feed_ids,
-                "user": user_dict.get(feed.user_id, {"id": feed.user_id, "nickname": "未知用户", "avatar": "", "featured_badges": []})
+                "is_saved": state.get("is_saved", str(feed.id) in saved_feed_ids),
+                "is_liked": state.get("is_liked", str(feed.id) in liked_feed_ids),
+                "user": user_dict[feed.user_id]
             })
+            if previews:
+                result[-1]["comments_preview"] = FeedComments.format(previews.get(str(feed.id), []), user_dict)
         return result
 
     @staticmethod
     def toggle_like(user_id, feed_id, action='like'):
+        if action not in ['like', 'unlike']:
+            return {"error": "Invalid action"}
+
+        # Redis 可用时集合为准，一次往返完成；MySQL/Mongo 由后台批量回写
         try:
-            feed = CommunityFeed.objects.get(id=feed_id)
+            state = FeedCounters.toggle(user_id, feed_id, 'like', add=action == 'like')
         except CommunityFeed.DoesNotExist:
             return {"error": "动态不存在"}
+        if state is not None:
+            return {"likes_count": state[0], "is_liked": state[1]}
 
-        if action not in ['like', 'unlike']:
-            return {"error": "Invalid action"}
+        try:
+            feed = CommunityFeed.objects.get(id=feed_id)
+        except CommunityFeed.DoesNotExist:
+            return {"error": "动态不存在"}
 
         from apps.diet.models.mysql.preference import UserPreference
 
@@ -114,31 +147,18 @@ class CommunityService:
                 feed.update(dec__likes_count=1)
             is_liked = False
 
-        redis_client = getattr(cache, 'client', None)
-        key = f"diet_feed_like:{feed_id_str}"
-        if redis_client:
-            try:
-                r = redis_client.get_client()
-                if action == 'like':
-                    r.sadd(key, user_id)
-                else:
-                    r.srem(key, user_id)
-            except Exception:
-                pass
-        
         feed.reload()
         return {"likes_count": feed.likes_count, "is_liked": is_liked}
 
     @staticmethod
     def add_comment(user_id, feed_id, content):
         try:
-            feed = CommunityFeed.objects.get(id=feed_id)
+            feed = CommunityFeed.objects.only('id').get(id=feed_id)
         except CommunityFeed.DoesNotExist:
             return {"error": "动态不存在"}
         
-        comment = Comment(feed_id=feed, user_id=user_id, content=content)
-        comment.save()
-        feed.update(inc__comments_count=1)
+        # 评论数与预览在同一次原子更新中维护，偏差由 FeedComments 后台对账修复
+        comment = FeedComments.add(user_id, feed, content)
         
         return {
             "id": str(comment.id),
@@ -147,19 +167,14 @@ class CommunityService:
         }
 
     @staticmethod
-    def get_comments(feed_id):
+    def get_comments(feed_id, cursor=None, page_size=20, page=None):
+        """评论分页，返回 {"list", "next_cursor", "has_more"}"""
         try:
-            feed = CommunityFeed.objects.get(id=feed_id)
+            feed = CommunityFeed.objects.only('id').get(id=feed_id)
         except CommunityFeed.DoesNotExist:
-            return []
+            return {"list": [], "next_cursor": None, "has_more": False}
         
-        comments = Comment.objects.filter(feed_id=feed).order_by('-created_at')
-        return [{
-            "id": str(c.id),
-            "user_id": c.user_id,
-            "content": c.content,
-            "created_at": c.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        } for c in comments]
+        return FeedComments.page(feed, cursor=cursor, page_size=page_size, page=page)
     
 
     @staticmethod
@@ -167,10 +182,14 @@ class CommunityService:
         """关注或取消关注系统"""
         from apps.users.models import UserFollow
         if action == 'follow':
-            UserFollow.objects.get_or_create(follower_id=follower_id, followed_id=following_id)
+            _, created = UserFollow.objects.get_or_create(follower_id=follower_id, followed_id=following_id)
+            if created:
+                FollowTimeline.on_follow(follower_id, following_id)
             return {"status": "followed"}
         elif action == 'unfollow':
-            UserFollow.objects.filter(follower_id=follower_id, followed_id=following_id).delete()
+            deleted, _ = UserFollow.objects.filter(follower_id=follower_id, followed_id=following_id).delete()
+            if deleted:
+                FollowTimeline.on_unfollow(follower_id, following_id)
             return {"status": "unfollowed"}
         return {"error": "Invalid action"}    
     
@@ -178,10 +197,9 @@ class CommunityService:
     def get_user_profile(target_user_id, current_user_id=None):
         """获取社交维度的用户公共主页全景视图"""
         from apps.users.models import User, UserFollow
-        try:
-            target_user = User.objects.select_related('profile').get(id=target_user_id)
-        except User.DoesNotExist:
+        if not User.objects.filter(id=target_user_id).exists():
             return None
+        card = UserCards.get(target_user_id)
 
         # 统计数据：粉丝数、关注数
         follow_count = UserFollow.objects.filter(follower_id=target_user_id).count()
@@ -198,14 +216,11 @@ class CommunityService:
         if current_user_id:
             is_followed = UserFollow.objects.filter(follower_id=current_user_id, followed_id=target_user_id).exists()
 
-        avatar = target_user.profile.avatar.url if (hasattr(target_user, 'profile') and target_user.profile and target_user.profile.avatar) else getattr(target_user, 'avatar', '')
-        signature = target_user.profile.signature if hasattr(target_user, 'profile') else ""
-
         return {
-            "id": target_user.id,
-            "nickname": target_user.nickname,
-            "avatar": avatar or "",
-            "signature": signature or "",
+            "id": card["id"],
+            "nickname": card["nickname"],
+            "avatar": card["avatar"],
+            "signature": card["signature"],
             "follow_count": follow_count,
             "fans_count": fans_count,
             "like_count": like_count,
@@ -239,26 +254,13 @@ class CommunityService:
                 target_type='feed', 
                 action='save'
             ).exists()
+            feed_data.update(FeedCounters.states([feed_id], current_user_id).get(str(feed_id), {}))
             
-            # 填充 user 信息，同 get_feed_list
-            from apps.users.models import User
-            from apps.diet.domains.gamification.services import GamificationService
-            try:
-                author = User.objects.select_related('profile').get(id=feed.user_id)
-                avatar = author.profile.avatar.url if (hasattr(author, 'profile') and author.profile and author.profile.avatar) else getattr(author, 'avatar', '')
-                feed_data['user'] = {
-                    "id": author.id,
-                    "nickname": author.nickname or "未知用户",
-                    "avatar": avatar or "",
-                    "featured_badges": GamificationService.get_user_featured_badges(author.id)
-                }
-            except User.DoesNotExist:
-                feed_data['user'] = {
-                    "id": feed.user_id,
-                    "nickname": "未知用户",
-                    "avatar": "",
-                    "featured_badges": []
-                }
+            # 填充 user 信息与评论预览，同 get_feed_list
+            previews = feed_data.pop('recent_comments', None) or []
+            cards = UserCards.get_many([feed.user_id] + [entry["user_id"] for entry in previews])
+            feed_data['user'] = cards[feed.user_id]
+            feed_data['comments_preview'] = FeedComments.format(previews, cards)
             
             return feed_data
         except Exception as e:
@@ -272,6 +274,13 @@ class CommunityService:
         from apps.diet.models.mysql.preference import UserPreference
         from django.utils import timezone
         
+        try:
+            state = FeedCounters.toggle(user_id, feed_id, 'save', add=action == 'save')
+        except CommunityFeed.DoesNotExist:
+            return {"error": "帖子不存在或操作失败"}
+        if state is not None:
+            return {"save_count": state[0], "is_saved": state[1]}
+
         try:
             feed = CommunityFeed.objects.get(id=feed_id)
             
@@ -0,0 +1,271 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+
+from apps.common.pagination import decode_cursor, encode_cursor
+from apps.common.redis import get_redis
+from apps.diet.models.mongo.community import CommunityFeed
+from apps.users.models import UserFollow
+
+
+logger = logging.getLogger(__name__)
+_EPOCH = datetime(1970, 1, 1)
+
+
+def feed_score(created_at):
+    """Millisecond timestamp of a (naive UTC) feed ``created_at``."""
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=dt_timezone.utc)
+    return int(created_at.timestamp() * 1000)
+
+
+def score_datetime(score):
+    """Naive UTC ``created_at`` of a millisecond score, exact to the millisecond."""
+    return _EPOCH + timedelta(milliseconds=score)
+
+
+def _cursor_position(cursor):
+    """``(score, feed_id)`` of a shared-format cursor; raises BusinessException when malformed."""
+    created_at, feed_id = decode_cursor(cursor)
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    # 整数运算换算回毫秒分值，避免浮点误差导致游标错位
+    return (created_at - _EPOCH) // timedelta(milliseconds=1), feed_id
+
+
+class FollowTimeline:
+    """Fan-out-on-write "following" timeline.
+
+    Publishing pushes the post id into a capped Redis sorted set per follower
+    (scored by ``created_at`` in ms, trimmed to TIMELINE_MAX_ITEMS) and into
+    the author's own set. Authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS
+    followers are not fanned out; they are recorded as pull authors and their
+    recent posts are merged in at read time with one indexed Mongo query.
+    Reads page with an exclusive ``(score, feed_id)`` position instead of
+    skip, carried in the same opaque cursor format as ``keyset_paginate``.
+    Without Redis the whole timeline is pulled from Mongo.
+    """
+
+    KEY_PREFIX = "diet_timeline"
+    PULL_AUTHORS_KEY = "diet_timeline:pull_authors"
+    PIPELINE_CHUNK = 500
+
+    @staticmethod
+    def _max_items():
+        return max(int(getattr(settings, "TIMELINE_MAX_ITEMS", 500)), 1)
+
+    @staticmethod
+    def _fanout_max():
+        return int(getattr(settings, "TIMELINE_FANOUT_MAX_FOLLOWERS", 5000))
+
+    @classmethod
+    def key(cls, user_id):
+        return f"{cls.KEY_PREFIX}:{user_id}"
+
+    @classmethod
+    def _ready_key(cls, user_id):
+        return f"{cls.key(user_id)}:ready"
+
+    @classmethod
+    def _push(cls, r, user_ids, entries):
+        """ZADD ``entries`` ({feed_id: score}) to each user's set and trim it, in chunked pipelines."""
+        cap = cls._max_items()
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), cls.PIPELINE_CHUNK):
+            pipe = r.pipeline(transaction=False)
+            for user_id in user_ids[start:start + cls.PIPELINE_CHUNK]:
+                pipe.zadd(cls.key(user_id), entries)
+                pipe.zremrangebyrank(cls.key(user_id), 0, -(cap + 1))
+            pipe.execute()
+
+    @classmethod
+    def fan_out(cls, feed):
+        """Deliver a new post to its author's followers (or mark the author for pull)."""
+        r = get_redis()
+        if r is None:
+            return 0
+        author_id = int(feed.user_id)
+        # 多取一个即可判断是否超过阈值，大 V 不会把全部粉丝载入内存
+        followers = list(
+            UserFollow.objects.filter(followed_id=author_id).values_list("follower_id", flat=True)[: cls._fanout_max() + 1]
+        )
+        entries = {str(feed.id): feed_score(feed.created_at)}
+        try:
+            if len(followers) > cls._fanout_max():
+                # 大 V 不做写扩散，读取时合并拉取
+                r.sadd(cls.PULL_AUTHORS_KEY, author_id)
+                followers = []
+            cls._push(r, [author_id] + followers, entries)
+        except Exception as exc:
+            logger.warning("Timeline fan-out of feed %s failed: %s", feed.id, exc)
+            return 0
+        return len(followers)
+
+    @classmethod
+    def on_follow(cls, follower_id, followed_id):
+        """Merge the newly followed author's recent posts into the follower's timeline."""
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            if r.sismember(cls.PULL_AUTHORS_KEY, followed_id):
+                return
+            recent = CommunityFeed.objects(user_id=int(followed_id), is_hidden=False).only("id", "created_at")
+            entries = {str(feed.id): feed_score(feed.created_at) for feed in recent.order_by("-created_at").limit(cls._max_items())}
+            if entries:
+                cls._push(r, [follower_id], entries)
+        except Exception as exc:
+            # 合并失败只影响时间线完整性，清除 ready 标记让下次读取重建
+            logger.warning("Timeline merge on follow %s -> %s failed: %s", follower_id, followed_id, exc)
+            cls._invalidate(r, follower_id)
+
+    @classmethod
+    def on_unfollow(cls, follower_id, followed_id):
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            recent = CommunityFeed.objects(user_id=int(followed_id)).only("id").order_by("-created_at").limit(cls._max_items())
+            feed_ids = [str(feed.id) for feed in recent]
+            if feed_ids:
+                r.zrem(cls.key(follower_id), *feed_ids)
+        except Exception as exc:
+            # 残留条目在读取时按关注关系过滤，这里仅记录
+            logger.warning("Timeline cleanup on unfollow %s -> %s failed: %s", follower_id, followed_id, exc)
+
+    @classmethod
+    def _invalidate(cls, r, user_id):
+        try:
+            r.delete(cls._ready_key(user_id))
+        except Exception:
+            pass
+
+    @classmethod
+    def rebuild(cls, user_id, followed_ids=None):
+        """Fill one user's timeline from Mongo; used for cold keys."""
+        r = get_redis()
+        if r is None:
+            return 0
+        if followed_ids is None:
+            followed_ids = list(UserFollow.objects.filter(follower_id=user_id).values_list("followed_id", flat=True))
+        pull_authors = {int(member) for member in r.smembers(cls.PULL_AUTHORS_KEY)}
+        authors = [int(user_id)] + [author for author in followed_ids if int(author) not in pull_authors]
+        recent = (
+            CommunityFeed.objects(user_id__in=authors, is_hidden=False)
+            .only("id", "created_at")
+            .order_by("-created_at")
+            .limit(cls._max_items())
+        )
+        entries = {str(feed.id): feed_score(feed.created_at) for feed in recent}
+        pipe = r.pipeline(transaction=True)
+        pipe.delete(cls.key(user_id))
+        if entries:
+            pipe.zadd(cls.key(user_id), entries)
+        pipe.set(cls._ready_key(user_id), 1)
+        pipe.execute()
+        return len(entries)
+
+    @classmethod
+    def backfill(cls, user_ids=None, stdout=None):
+        """Populate timelines from existing posts and follow edges in one pass over the posts."""
+        r = get_redis()
+        if r is None:
+            return {"users": 0, "entries": 0}
+        cap, fanout_max = cls._max_items(), cls._fanout_max()
+        followers = defaultdict(list)
+        for follower_id, followed_id in UserFollow.objects.values_list("follower_id", "followed_id").iterator():
+            followers[followed_id].append(follower_id)
+        pull_authors = {author for author, fans in followers.items() if len(fans) > fanout_max}
+        wanted = {int(user_id) for user_id in user_ids} if user_ids else None
+
+        timelines = defaultdict(dict)
+        posts = CommunityFeed.objects(is_hidden=False).only("id", "user_id", "created_at").order_by("-created_at")
+        for feed in posts.batch_size(1000):
+            author = int(feed.user_id)
+            targets = [author] if author in pull_authors else [author] + followers.get(author, [])
+            entry = (str(feed.id), feed_score(feed.created_at))
+            for user_id in targets:
+                if (wanted is None or user_id in wanted) and len(timelines[user_id]) < cap:
+                    timelines[user_id][entry[0]] = entry[1]
+
+        users = set(timelines)
+        users.update(fan for fans in followers.values() for fan in fans if wanted is None or fan in wanted)
+        users = sorted(users)
+        for start in range(0, len(users), cls.PIPELINE_CHUNK):
+            pipe = r.pipeline(transaction=False)
+            for user_id in users[start:start + cls.PIPELINE_CHUNK]:
+                pipe.delete(cls.key(user_id))
+                if timelines.get(user_id):
+                    pipe.zadd(cls.key(user_id), timelines[user_id])
+                pipe.set(cls._ready_key(user_id), 1)
+            pipe.execute()
+            if stdout is not None:
+                stdout.write(f"  {min(start + cls.PIPELINE_CHUNK, len(users))}/{len(users)} timelines written...")
+        pipe = r.pipeline(transaction=True)
+        pipe.delete(cls.PULL_AUTHORS_KEY)
+        if pull_authors:
+            pipe.sadd(cls.PULL_AUTHORS_KEY, *pull_authors)
+        pipe.execute()
+        return {"users": len(users), "entries": sum(len(items) for items in timelines.values())}
+
+    @classmethod
+    def _pushed_page(cls, r, user_id, cursor, limit):
+        key = cls.key(user_id)
+        if cursor is None:
+            rows = r.zrevrangebyscore(key, "+inf", "-inf", start=0, num=limit, withscores=True)
+            return [(int(score), member.decode() if isinstance(member, bytes) else member) for member, score in rows]
+        score, feed_id = cursor
+        # 同分值的条目按成员倒序排列，多取一些以跳过游标之前的同分条目
+        rows = r.zrevrangebyscore(key, score, "-inf", start=0, num=limit + 20, withscores=True)
+        page = []
+        for member, row_score in rows:
+            member = member.decode() if isinstance(member, bytes) else member
+            if int(row_score) == score and member >= feed_id:
+                continue
+            page.append((int(row_score), member))
+        return page[:limit]
+
+    @staticmethod
+    def _pulled_page(author_ids, cursor, limit):
+        if not author_ids:
+            return []
+        query = CommunityFeed.objects(user_id__in=list(author_ids), is_hidden=False)
+        if cursor is not None:
+            query = query.filter(created_at__lte=score_datetime(cursor[0]))
+        page = []
+        for feed in query.only("id", "created_at").order_by("-created_at", "-id").limit(limit + 20):
+            entry = (feed_score(feed.created_at), str(feed.id))
+            if cursor is None or entry < cursor:
+                page.append(entry)
+        return page[:limit]
+
+    @classmethod
+    def page(cls, user_id, cursor=None, page_size=10):
+        """Newest-first posts for ``user_id`` as ``(feeds, next_cursor)``."""
+        cursor = _cursor_position(cursor) if cursor else None
+        followed = set(UserFollow.objects.filter(follower_id=user_id).values_list("followed_id", flat=True))
+        authors = followed | {int(user_id)}
+        r = get_redis()
+        if r is None:
+            entries = cls._pulled_page(authors, cursor, page_size + 1)
+        else:
+            try:
+                if not r.exists(cls._ready_key(user_id)):
+                    cls.rebuild(user_id, followed)
+                pull_authors = {int(member) for member in r.smembers(cls.PULL_AUTHORS_KEY)} & followed
+                entries = cls._pushed_page(r, user_id, cursor, page_size + 1)
+                entries += cls._pulled_page(pull_authors, cursor, page_size + 1)
+            except Exception as exc:
+                logger.warning("Timeline read for user %s fell back to Mongo: %s", user_id, exc)
+                entries = cls._pulled_page(authors, cursor, page_size + 1)
+        entries = sorted(set(entries), reverse=True)
+        page, has_more = entries[:page_size], len(entries) > page_size
+        next_cursor = encode_cursor(score_datetime(page[-1][0]), page[-1][1]) if page and has_more else None
+
+        feed_ids = [feed_id for _, feed_id in page]
+        # 推送后被隐藏的帖子、已取消关注作者的帖子在读取时过滤
+        docs = {str(feed.id): feed for feed in CommunityFeed.objects(id__in=feed_ids, is_hidden=False)} if feed_ids else {}
+        feeds = [docs[feed_id] for feed_id in feed_ids if feed_id in docs and docs[feed_id].user_id in authors]
+        return feeds, next_cursor
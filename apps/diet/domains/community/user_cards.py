@@ -0,0 +1,119 @@
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.diet.models.mysql.gamification import UserAchievement, UserFeaturedBadge
+from apps.users.models import User
+
+
+logger = logging.getLogger(__name__)
+
+
+class UserCards:
+    """Batched "user card" (nickname, avatar, signature, featured badges) lookup.
+
+    ``get_many`` serves cached cards with one ``cache.get_many`` and loads the
+    missing ones in three queries regardless of how many users are asked for:
+    users with their profiles, featured badges, and the recently unlocked
+    achievements used as fallback badges. Cards are invalidated by the
+    profile, user and badge signal handlers and otherwise expire after
+    USER_CARD_CACHE_TTL. Feeds, comments, leaderboards and profile pages all
+    read authors through here.
+    """
+
+    KEY_PREFIX = "diet_user_card"
+    MAX_BADGES = 3
+
+    @staticmethod
+    def _timeout():
+        return int(getattr(settings, "USER_CARD_CACHE_TTL", 600))
+
+    @classmethod
+    def key(cls, user_id):
+        return f"{cls.KEY_PREFIX}:{user_id}"
+
+    @staticmethod
+    def placeholder(user_id):
+        return {"id": user_id, "nickname": "未知用户", "avatar": "", "signature": "", "featured_badges": []}
+
+    @classmethod
+    def get(cls, user_id):
+        return cls.get_many([user_id])[int(user_id)]
+
+    @classmethod
+    def get_many(cls, user_ids):
+        """``{user_id: card}`` for every id; unknown users get a placeholder card."""
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids if user_id is not None))
+        if not user_ids:
+            return {}
+        keys = {cls.key(user_id): user_id for user_id in user_ids}
+        try:
+            cached = cache.get_many(list(keys))
+        except Exception as exc:
+            logger.warning("User card cache read failed: %s", exc)
+            cached = {}
+        cards = {keys[key]: card for key, card in cached.items()}
+
+        missing = [user_id for user_id in user_ids if user_id not in cards]
+        if missing:
+            loaded = cls._load(missing)
+            try:
+                cache.set_many({cls.key(user_id): card for user_id, card in loaded.items()}, cls._timeout())
+            except Exception as exc:
+                logger.warning("User card cache write failed: %s", exc)
+            cards.update(loaded)
+        # 返回副本，调用方修改不会污染本地缓存
+        return {user_id: dict(cards[user_id]) if user_id in cards else cls.placeholder(user_id) for user_id in user_ids}
+
+    @classmethod
+    def _load(cls, user_ids):
+        cards = {}
+        for user in User.objects.filter(id__in=user_ids).select_related("profile"):
+            profile = getattr(user, "profile", None)
+            # 与个人主页一致：用户表头像优先，资料头像兜底
+            avatar = user.avatar
+            if not avatar and profile and profile.avatar:
+                avatar = profile.avatar.url if hasattr(profile.avatar, "url") else str(profile.avatar)
+            cards[user.id] = {
+                "id": user.id,
+                "nickname": user.nickname or user.username,
+                "avatar": avatar or "",
+                "signature": (profile.signature if profile else "") or "",
+                "featured_badges": [],
+            }
+        for user_id, badges in cls.load_badges(list(cards)).items():
+            cards[user_id]["featured_badges"] = badges
+        return cards
+
+    @classmethod
+    def load_badges(cls, user_ids):
+        """Featured badges per user (at most MAX_BADGES), falling back to the latest unlocked ones."""
+        badges = defaultdict(list)
+        featured = UserFeaturedBadge.objects.filter(user_id__in=user_ids).select_related("achievement").order_by("user_id", "sort_order")
+        for badge in featured:
+            if len(badges[badge.user_id]) < cls.MAX_BADGES:
+                badges[badge.user_id].append(cls._badge(badge.achievement))
+
+        without = [user_id for user_id in user_ids if user_id not in badges]
+        if without:
+            unlocked = UserAchievement.objects.filter(user_id__in=without).select_related("achievement").order_by("user_id", "-unlocked_at")
+            for item in unlocked:
+                if len(badges[item.user_id]) < cls.MAX_BADGES:
+                    badges[item.user_id].append(cls._badge(item.achievement))
+        return dict(badges)
+
+    @staticmethod
+    def _badge(achievement):
+        return {"id": str(achievement.id), "name": achievement.title, "icon": achievement.icon or ""}
+
+    @classmethod
+    def invalidate(cls, user_ids):
+        keys = [cls.key(user_id) for user_id in user_ids if user_id is not None]
+        if not keys:
+            return
+        try:
+            cache.delete_many(keys)
+        except Exception as exc:
+            logger.warning("User card cache invalidation failed: %s", exc)
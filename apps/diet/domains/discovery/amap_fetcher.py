@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import math
+import random
+import time
+
+import httpx
+from django.conf import settings
+
+from apps.diet.domains.tools.ai_executor import AIExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class AMapRetryableError(RuntimeError):
+    """Transient AMap failure (5xx, 429 or a QPS-exceeded infocode)."""
+
+
+class AMapFetcher:
+    """Async AMap place-around client shared by the whole process.
+
+    Runs on the AIExecutor event loop with one pooled ``httpx.AsyncClient``,
+    so pages reuse keep-alive connections. ``fetch_pages`` reads the first page
+    to learn the total count and then requests the remaining pages in
+    parallel. Every request passes a process-wide rate limiter
+    (AMAP_RATE_LIMIT requests per second) and transient failures are retried
+    with exponential backoff and jitter. Sync callers use ``search_nearby``.
+    """
+
+    PATH = "/v3/place/around"
+    # 高德 QPS 超限类 infocode，可退避后重试
+    RETRYABLE_INFOCODES = {"10004", "10014", "10019", "10020", "10021"}
+    _client = None
+    _client_key = None
+    _next_slot = 0.0
+
+    @staticmethod
+    def _base_url():
+        return getattr(settings, "AMAP_BASE_URL", "https://restapi.amap.com").rstrip("/")
+
+    @staticmethod
+    def _rate_limit():
+        return float(getattr(settings, "AMAP_RATE_LIMIT", 10))
+
+    @staticmethod
+    def _max_retries():
+        return max(int(getattr(settings, "AMAP_MAX_RETRIES", 2)), 0)
+
+    @staticmethod
+    def _backoff():
+        return float(getattr(settings, "AMAP_RETRY_BACKOFF", 0.2))
+
+    @staticmethod
+    def _timeout():
+        return float(getattr(settings, "AMAP_TIMEOUT", 3))
+
+    @classmethod
+    def client(cls):
+        """Pooled client bound to the running loop (re-created after the loop restarts)."""
+        client_key = (asyncio.get_running_loop(), cls._base_url())
+        if cls._client is None or cls._client_key != client_key:
+            connections = max(int(getattr(settings, "AMAP_MAX_CONNECTIONS", 10)), 1)
+            cls._client = httpx.AsyncClient(
+                base_url=cls._base_url(),
+                timeout=cls._timeout(),
+                limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+            )
+            cls._client_key = client_key
+        return cls._client
+
+    @classmethod
+    async def _throttle(cls):
+        rate = cls._rate_limit()
+        if rate <= 0:
+            return
+        # 单事件循环内按固定间隔分配发送时刻，无需加锁
+        now = time.monotonic()
+        slot = max(now, cls._next_slot)
+        cls._next_slot = slot + 1 / rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    @classmethod
+    async def _request(cls, params):
+        await cls._throttle()
+        response = await cls.client().get(cls.PATH, params=params)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise AMapRetryableError(f"AMap HTTP {response.status_code}")
+        response.raise_for_status()
+        data = response.json()
+        if data.get("status") != "1":
+            if str(data.get("infocode")) in cls.RETRYABLE_INFOCODES:
+                raise AMapRetryableError(f"AMap infocode {data.get('infocode')}")
+            logger.warning("AMap place search failed: %s %s", data.get("infocode"), data.get("info"))
+            return [], 0
+        return data.get("pois") or [], int(data.get("count") or 0)
+
+    @classmethod
+    async def fetch_page(cls, lng, lat, radius=3000, page=1, offset=20):
+        """One page of nearby restaurants as ``(pois, total_count)``."""
+        key = settings.AMAP_WEB_KEY
+        if not key:
+            return [], 0
+        params = {
+            "key": key,
+            "location": f"{lng},{lat}",
+            "types": "050000",
+            "radius": radius,
+            "offset": offset,
+            "page": page,
+            "extensions": "all",
+        }
+        attempts = cls._max_retries() + 1
+        for attempt in range(attempts):
+            try:
+                return await cls._request(params)
+            except (AMapRetryableError, httpx.TransportError) as exc:
+                if attempt + 1 >= attempts:
+                    logger.warning("AMap page %s failed after %d attempts: %s", page, attempts, exc)
+                    return [], 0
+                delay = cls._backoff() * 2 ** attempt
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            except (httpx.HTTPError, ValueError) as exc:
+                logger.warning("AMap page %s failed: %s", page, exc)
+                return [], 0
+        return [], 0
+
+    @classmethod
+    async def fetch_pages(cls, lng, lat, radius=3000, pages=3, offset=20):
+        """Up to ``pages`` pages; pages after the first are fetched concurrently."""
+        first, total = await cls.fetch_page(lng, lat, radius, 1, offset)
+        needed = min(max(pages, 1), math.ceil(total / offset)) if first else 1
+        rest = await asyncio.gather(*(
+            cls.fetch_page(lng, lat, radius, page, offset) for page in range(2, needed + 1)
+        ))
+        seen, pois = set(), []
+        for batch in [first] + [page_pois for page_pois, _ in rest]:
+            for poi in batch:
+                if poi.get("id") not in seen:
+                    seen.add(poi.get("id"))
+                    pois.append(poi)
+        return pois
+
+    @classmethod
+    def search_nearby(cls, lng, lat, radius=3000, pages=None, offset=20):
+        """Blocking entry point for sync code; returns [] on any failure."""
+        if pages is None:
+            pages = int(getattr(settings, "AMAP_NEARBY_PAGES", 3))
+        budget = cls._timeout() * (cls._max_retries() + 1) * 2 + pages / max(cls._rate_limit(), 1)
+        try:
+            return AIExecutor.run(lambda: cls.fetch_pages(lng, lat, radius, pages, offset), timeout=budget)
+        except Exception as exc:
+            logger.warning("AMap nearby search failed: %s", exc)
+            return []
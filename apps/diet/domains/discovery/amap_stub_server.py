@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubAMapServer:
+    """Local stand-in for the AMap ``/v3/place/around`` endpoint.
+
+    Serves ``total`` deterministic restaurant POIs around the requested
+    location, paged by ``offset``/``page``, after ``latency_ms``. The first
+    ``fail_first`` requests answer HTTP 503 so retries can be exercised.
+    Records request count and peak concurrency; usable as a context manager.
+    """
+
+    NAMES = ("轻食沙拉", "牛肉面馆", "汉堡快餐", "川菜小馆", "粤式茶餐厅", "日式拉面")
+
+    def __init__(self, total=45, latency_ms=0, fail_first=0, host="127.0.0.1", port=0):
+        self.total = total
+        self.latency_ms = latency_ms
+        self.fail_first = fail_first
+        self.requests = 0
+        self.request_times = []
+        self.peak_concurrency = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="amap-stub", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def page(self, location, page, offset):
+        lng, lat = (float(part) for part in location.split(","))
+        start = (page - 1) * offset
+        pois = []
+        for index in range(start, min(start + offset, self.total)):
+            name = self.NAMES[index % len(self.NAMES)]
+            pois.append({
+                "id": f"STUB{index:05d}",
+                "name": f"{name}{index}号店",
+                "type": f"餐饮服务;{name}",
+                "location": f"{lng + index * 1e-4:.6f},{lat + index * 1e-4:.6f}",
+                "address": f"测试路{index}号",
+                "biz_ext": {"rating": "4.5", "cost": str(20 + index % 40)},
+                "photos": [],
+            })
+        return {"status": "1", "info": "OK", "infocode": "10000", "count": str(self.total), "pois": pois}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.rstrip("/") != "/v3/place/around":
+                    self.send_error(404)
+                    return
+                with stub._lock:
+                    stub.requests += 1
+                    stub.request_times.append(time.monotonic())
+                    failing = stub.requests <= stub.fail_first
+                    stub._active += 1
+                    stub.peak_concurrency = max(stub.peak_concurrency, stub._active)
+                try:
+                    if stub.latency_ms:
+                        time.sleep(stub.latency_ms / 1000)
+                    if failing:
+                        self._send(503, {"status": "0", "info": "SERVICE_UNAVAILABLE"})
+                        return
+                    query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                    payload = stub.page(
+                        query.get("location", "0,0"),
+                        int(query.get("page", 1)),
+                        int(query.get("offset", 20)),
+                    )
+                    self._send(200, payload)
+                finally:
+                    with stub._lock:
+                        stub._active -= 1
+
+            def _send(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
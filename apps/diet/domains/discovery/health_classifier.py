@@ -0,0 +1,116 @@
+import unicodedata
+from collections import namedtuple
+
+
+HealthRule = namedtuple("HealthRule", "tag keywords delta calories")
+
+# 规则表：命中关键词即计入该规则 (每条规则只计一次)，delta 为相对基准分的加减分，
+# calories 为命中时的单餐热量估计；新增规则只需在此追加
+HEALTH_RULES = (
+    HealthRule("light_meal", ("轻食", "沙拉", "色拉", "代餐", "减脂", "健身餐", "low fat", "salad"), 20, 400),
+    HealthRule("steamed", ("清蒸", "蒸菜", "白灼", "水煮蛋", "杂粮", "粗粮", "全麦"), 10, 450),
+    HealthRule("vegetarian", ("素食", "素菜", "斋", "蔬食", "vegan"), 10, 450),
+    HealthRule("soup_porridge", ("粥", "清汤", "汤品", "炖汤"), 5, 500),
+    HealthRule("fresh_fish", ("刺身", "寿司", "海鲜", "鱼生"), 5, 500),
+    HealthRule("fast_food", ("快餐", "汉堡", "薯条", "麦当劳", "肯德基", "burger"), -20, 800),
+    HealthRule("fried", ("炸鸡", "油炸", "炸串", "鸡排", "天妇罗"), -20, 850),
+    HealthRule("bbq", ("烧烤", "烤串", "串串", "烤肉"), -15, 800),
+    HealthRule("hotpot", ("火锅", "麻辣烫", "冒菜", "麻辣香锅"), -10, 750),
+    HealthRule("pizza", ("披萨", "比萨", "pizza"), -15, 800),
+    HealthRule("dessert", ("甜品", "蛋糕", "奶茶", "烘焙", "冰淇淋"), -10, 650),
+)
+
+# 字段权重：餐厅分类与店名最可信，菜单按菜名命中，权重减半
+FIELD_WEIGHTS = {"type": 1.0, "name": 1.0, "menu": 0.5}
+BASE_SCORE = 70
+BASE_CALORIES = 600
+GREEN_SCORE = 80
+RED_SCORE = 55
+# 规则或权重调整后递增，reclassify_restaurants --stale-only 据此找出旧结果
+CLASSIFIER_VERSION = 1
+HEALTH_FIELDS = ("health_light", "health_score", "est_calories", "health_tags", "health_version")
+
+
+def _normalize(text):
+    return unicodedata.normalize("NFKC", str(text or "")).lower()
+
+
+class KeywordTrie:
+    """Character trie returning every rule whose keyword occurs in a text."""
+
+    def __init__(self, rules=HEALTH_RULES):
+        self._root = {}
+        for index, rule in enumerate(rules):
+            for keyword in rule.keywords:
+                node = self._root
+                for char in _normalize(keyword):
+                    node = node.setdefault(char, {})
+                node.setdefault(None, set()).add(index)
+
+    def matches(self, text):
+        text = _normalize(text)
+        found = set()
+        for start in range(len(text)):
+            node = self._root
+            for char in text[start:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                found |= node.get(None, set())
+        return found
+
+
+class HealthClassifier:
+    """Restaurant health light, score and calorie estimate from the rule table.
+
+    Each rule counts once, with the largest weight among the fields (type,
+    name, menu item names) it matched. The score is BASE_SCORE plus the
+    weighted deltas, clamped to 0..100; the light follows GREEN_SCORE and
+    RED_SCORE. Results are stored on Restaurant so geo queries can filter and
+    sort by ``health_score`` in Mongo.
+    """
+
+    RULES = HEALTH_RULES
+    _trie = KeywordTrie(HEALTH_RULES)
+
+    @classmethod
+    def classify(cls, type_text="", name="", menu=None):
+        menu_text = " ".join(
+            str(item.get("name", "")) if isinstance(item, dict) else str(item)
+            for item in menu or []
+        )
+        weights = {}
+        for field, text in (("type", type_text), ("name", name), ("menu", menu_text)):
+            for index in cls._trie.matches(text):
+                weights[index] = max(weights.get(index, 0), FIELD_WEIGHTS[field])
+
+        matched = [(cls.RULES[index], weight) for index, weight in sorted(weights.items())]
+        score = BASE_SCORE + sum(rule.delta * weight for rule, weight in matched)
+        score = int(round(min(max(score, 0), 100)))
+        if matched:
+            total = sum(weight for _, weight in matched)
+            calories = int(round(sum(rule.calories * weight for rule, weight in matched) / total))
+        else:
+            calories = BASE_CALORIES
+        light = "green" if score >= GREEN_SCORE else "red" if score <= RED_SCORE else "yellow"
+        return {
+            "health_light": light,
+            "health_score": score,
+            "est_calories": calories,
+            "health_tags": [rule.tag for rule, _ in matched],
+            "health_version": CLASSIFIER_VERSION,
+        }
+
+    @classmethod
+    def summary(cls, shop):
+        """API fields for ``shop``; unclassified or outdated documents are classified on the fly."""
+        if getattr(shop, "health_version", None) != CLASSIFIER_VERSION or not shop.health_light:
+            result = cls.classify(shop.type, shop.name, shop.menu)
+        else:
+            result = {field: getattr(shop, field) for field in HEALTH_FIELDS}
+        return {
+            "estimated_calories": result["est_calories"],
+            "health_light": result["health_light"],
+            "health_score": result["health_score"],
+            "health_tags": list(result["health_tags"] or []),
+        }
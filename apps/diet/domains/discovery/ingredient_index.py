@@ -0,0 +1,175 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from apps.common.utils import normalize_ingredient_name
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
+from apps.diet.models import Recipe
+
+
+logger = logging.getLogger(__name__)
+
+
+class IngredientIndexSnapshot:
+    """Immutable postings for one catalog version.
+
+    Recipes are addressed by dense ordinals; postings map a normalised
+    ingredient name to an `array` of ordinals, and per-recipe attributes used
+    for filter pushdown are stored column-wise.
+    """
+
+    def __init__(self, docs, version=0):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.ids = []
+        self.ordinals = {}
+        self.sizes = array("H")
+        self.calories = array("i")
+        self.cooking_times = array("i")
+        self.difficulties = []
+        postings = defaultdict(lambda: array("I"))
+
+        for doc in docs:
+            names = {normalize_ingredient_name(name) for name in doc.get("ingredients_search") or [] if name}
+            names.discard("")
+            if not names:
+                continue
+            ordinal = len(self.ids)
+            recipe_id = str(doc["_id"])
+            self.ids.append(recipe_id)
+            self.ordinals[recipe_id] = ordinal
+            self.sizes.append(min(len(names), 65535))
+            self.calories.append(int(doc.get("calories") or 350))
+            self.cooking_times.append(int(doc.get("cooking_time") or 15))
+            self.difficulties.append(doc.get("difficulty") or "简单")
+            for name in names:
+                postings[name].append(ordinal)
+        self.postings = dict(postings)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def ordinals_for(self, names):
+        matched = set()
+        for name in names:
+            matched.update(self.postings.get(normalize_ingredient_name(name), ()))
+        return matched
+
+    def accepts(self, ordinal, calorie_min=None, calorie_max=None, difficulty=None):
+        if calorie_min is not None and self.calories[ordinal] < calorie_min:
+            return False
+        if calorie_max is not None and self.calories[ordinal] > calorie_max:
+            return False
+        if difficulty and self.difficulties[ordinal] != difficulty:
+            return False
+        return True
+
+
+class IngredientIndex:
+    """Fridge-to-recipe matcher over the whole approved catalog.
+
+    Scores every recipe sharing an ingredient with the fridge as
+    |fridge ∩ recipe| / |recipe| and keeps only the top K with a heap, so page
+    N is a slice of the true global ranking instead of a skip/limit window.
+    The snapshot lives in process memory and is rebuilt when the recipe
+    catalog version changes or it grows older than MAX_AGE seconds.
+    """
+
+    MAX_AGE = 600
+    PROJECTION = ("id", "ingredients_search", "calories", "cooking_time", "difficulty")
+    _snapshot = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def _load_docs(cls):
+        return Recipe.objects(status=1).only(*cls.PROJECTION).as_pymongo()
+
+    @classmethod
+    def install(cls, snapshot):
+        cls._snapshot = snapshot
+        return snapshot
+
+    @classmethod
+    def current(cls):
+        """Return a fresh snapshot, rebuilding it if stale; None when unavailable."""
+        version = RecipeCatalog.version()
+        snapshot = cls._snapshot
+        if snapshot is not None and snapshot.version == version and time.monotonic() - snapshot.built_at < cls.MAX_AGE:
+            return snapshot
+
+        # 已有旧快照时不阻塞请求，由拿到锁的线程负责重建
+        if not cls._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            if cls._snapshot is not snapshot:
+                return cls._snapshot
+            started = time.perf_counter()
+            rebuilt = IngredientIndexSnapshot(cls._load_docs(), version=version)
+            logger.info(
+                "Ingredient index rebuilt: %d recipes, %d ingredients in %.1fms",
+                len(rebuilt), len(rebuilt.postings), (time.perf_counter() - started) * 1000,
+            )
+            return cls.install(rebuilt)
+        except Exception as exc:
+            logger.warning("Ingredient index rebuild failed: %s", exc)
+            return snapshot
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def search(cls, fridge, priority=None, limit=20, filters=None, sort_by="match_score"):
+        """Global top ``limit`` matches as ``(recipe_id, score, priority_hit)``.
+
+        With ``priority`` (cleanup/scrap mode) only recipes using a priority
+        ingredient are candidates and get the +20 bonus. Exclusions,
+        allergens, calorie range and difficulty are applied inside the index;
+        returns None when the index cannot be built so callers can fall back.
+        """
+        snapshot = cls.current()
+        if snapshot is None:
+            return None
+        filters = filters or {}
+
+        hits = defaultdict(int)
+        for name in fridge:
+            for ordinal in snapshot.postings.get(name, ()):
+                hits[ordinal] += 1
+        candidates = snapshot.ordinals_for(priority) if priority else hits.keys()
+
+        blocked = snapshot.ordinals_for(filters.get("allergens") or [])
+        blocked.update(
+            snapshot.ordinals[str(rid)] for rid in filters.get("exclude_ids") or [] if str(rid) in snapshot.ordinals
+        )
+        calorie_min = cls._safe_int(filters.get("calorie_min"))
+        calorie_max = cls._safe_int(filters.get("calorie_max"))
+        difficulty = filters.get("difficulty")
+
+        scored = []
+        for ordinal in candidates:
+            if ordinal in blocked or not snapshot.accepts(ordinal, calorie_min, calorie_max, difficulty):
+                continue
+            score = int(hits.get(ordinal, 0) / snapshot.sizes[ordinal] * 100)
+            if priority:
+                score = min(100, score + 20)
+            scored.append((ordinal, score))
+
+        if sort_by == "calories":
+            sort_key = lambda entry: (snapshot.calories[entry[0]], -entry[1], entry[0])
+        elif sort_by == "time":
+            sort_key = lambda entry: (snapshot.cooking_times[entry[0]], -entry[1], entry[0])
+        else:
+            sort_key = lambda entry: (-entry[1], snapshot.sizes[entry[0]], entry[0])
+        top = heapq.nsmallest(limit, scored, key=sort_key)
+        return [(snapshot.ids[ordinal], score, bool(priority)) for ordinal, score in top]
+
+    @staticmethod
+    def _safe_int(value):
+        if value in (None, ""):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
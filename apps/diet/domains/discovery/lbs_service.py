@@ -1,65 +1,198 @@
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
 from django.core.cache import cache
 from apps.diet.models import Restaurant
-from apps.common.utils import AMapService
+from apps.common.utils import geohash_decode, geohash_encode
+from apps.diet.domains.discovery.amap_fetcher import AMapFetcher
+from apps.diet.domains.discovery.health_classifier import HealthClassifier
+from apps.diet.domains.discovery.restaurant_ingest import RestaurantIngestor
+
+
+logger = logging.getLogger(__name__)
+
 
 class LBSService:
+    """Nearby restaurant recommendations served from geohash tiles.
+
+    Results are cached per (geohash tile, radius bucket, sort, minimum health
+    score) and computed for the tile centre with the radius widened by
+    TILE_MARGIN_M, so everyone in the same building shares one entry. Each
+    caller then gets the entry re-filtered by real distance from their own
+    position against the requested radius (and re-sorted when sorting by
+    distance), so small radii stay accurate near tile edges. An entry
+    stays fresh for LBS_TILE_TTL and is then served stale for up to
+    LBS_TILE_STALE_TTL while a single background refresh runs. A cache-side
+    lock makes sure only one worker recomputes a tile; concurrent callers on a
+    cold tile wait briefly for that result instead of querying Mongo and AMap
+    themselves.
+    """
+
+    KEY_PREFIX = "lbs_v2"
+    TILE_PRECISION = 6
+    RADIUS_BUCKETS = (500, 1000, 2000, 3000, 5000, 10000)
+    WAIT_STEP = 0.05
+    LIMIT = 15
+    # 格子结果先多取一些，按调用方实际距离过滤后仍能凑满 LIMIT
+    TILE_LIMIT = 50
+    # 6 位 geohash 格子 (约 1.2km x 0.6km) 中心到角点的距离，格子内任意位置的半径圆都落在扩大后的范围内
+    TILE_MARGIN_M = 700
+    SORTS = ("distance", "health")
+    EARTH_RADIUS_M = 6378100
+
+    @staticmethod
+    def _fresh_ttl():
+        return int(getattr(settings, "LBS_TILE_TTL", 600))
+
+    @staticmethod
+    def _stale_ttl():
+        return int(getattr(settings, "LBS_TILE_STALE_TTL", 3600))
+
+    @staticmethod
+    def _lock_timeout():
+        return int(getattr(settings, "LBS_TILE_LOCK_TIMEOUT", 30))
+
     @staticmethod
-    def get_recommendations(lng, lat, radius=3000):
-        results = []
-        geo_key = f"lbs_v1:{round(lng, 2)}_{round(lat, 2)}"
-        
-        cached = cache.get(geo_key)
-        if cached: return cached
+    def _wait_timeout():
+        return float(getattr(settings, "LBS_TILE_WAIT", 3))
+
+    @classmethod
+    def radius_bucket(cls, radius):
+        for bucket in cls.RADIUS_BUCKETS:
+            if radius <= bucket:
+                return bucket
+        return cls.RADIUS_BUCKETS[-1]
+
+    @classmethod
+    def distance_m(cls, lng1, lat1, lng2, lat2):
+        """Great-circle (haversine) distance in metres."""
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        d_phi, d_lambda = phi2 - phi1, math.radians(lng2 - lng1)
+        h = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+        return 2 * cls.EARTH_RADIUS_M * math.asin(min(math.sqrt(h), 1.0))
+
+    @classmethod
+    def get_recommendations(cls, lng, lat, radius=3000, sort_by="distance", min_health_score=None):
+        sort_by = sort_by if sort_by in cls.SORTS else "distance"
+        results = cls._tile_results(lng, lat, radius, sort_by, min_health_score)
+        return cls._for_caller(results, lng, lat, radius, sort_by)
 
+    @classmethod
+    def _for_caller(cls, results, lng, lat, radius, sort_by):
+        """Keep the tile results within ``radius`` of the caller, nearest first when sorting by distance."""
+        nearby = []
+        for item in results:
+            location = item.get("_location")
+            # 无坐标的条目 (旧缓存) 原样保留
+            distance = cls.distance_m(lng, lat, *location) if location else 0
+            if distance <= radius:
+                nearby.append((distance, item))
+        if sort_by == "distance":
+            nearby.sort(key=lambda pair: pair[0])
+        return [
+            {field: value for field, value in item.items() if field != "_location"}
+            for _, item in nearby[: cls.LIMIT]
+        ]
+
+    @classmethod
+    def _tile_results(cls, lng, lat, radius, sort_by, min_health_score):
+        tile = geohash_encode(lat, lng, cls.TILE_PRECISION)
+        bucket = cls.radius_bucket(radius)
+        query = (bucket + cls.TILE_MARGIN_M, sort_by, int(min_health_score or 0))
+        key = f"{cls.KEY_PREFIX}:{tile}:{bucket}:{sort_by}:{query[2]}"
+        lock_key = f"{key}:lock"
+
+        entry = cache.get(key)
+        if entry is not None:
+            if time.time() >= entry["fresh_until"] and cache.add(lock_key, 1, timeout=cls._lock_timeout()):
+                # 过期但仍可用：立即返回旧结果，由抢到锁的请求在后台刷新
+                threading.Thread(
+                    target=cls._refresh, args=(tile, query, key, lock_key), name="lbs-tile-refresh", daemon=True
+                ).start()
+            return entry["results"]
+
+        if cache.add(lock_key, 1, timeout=cls._lock_timeout()):
+            return cls._refresh(tile, query, key, lock_key)
+
+        # 其它请求正在计算该格子：短暂等待其结果，超时后自行计算但不写缓存
+        deadline = time.monotonic() + cls._wait_timeout()
+        while time.monotonic() < deadline:
+            time.sleep(cls.WAIT_STEP)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry["results"]
+        lat_c, lng_c = geohash_decode(tile)
+        return cls._compute(lng_c, lat_c, *query)
+
+    @classmethod
+    def _refresh(cls, tile, query, key, lock_key):
+        stale = cache.get(key)
+        try:
+            lat_c, lng_c = geohash_decode(tile)
+            results = cls._compute(lng_c, lat_c, *query, raise_errors=True)
+            if not results and stale and stale["results"]:
+                # 高德失败时同样表现为空结果：保留旧条目直至其自然过期，不用空结果覆盖
+                return stale["results"]
+            # 空结果同样缓存一小段时间，避免高峰期反复请求高德
+            fresh = cls._fresh_ttl() if results else min(cls._fresh_ttl(), 60)
+            cache.set(
+                key,
+                {"results": results, "fresh_until": time.time() + fresh},
+                timeout=fresh + cls._stale_ttl(),
+            )
+            return results
+        except Exception as exc:
+            # 刷新失败保留旧条目，过期前继续提供旧结果
+            logger.warning("LBS tile %s refresh failed: %s", key, exc)
+            return stale["results"] if stale else []
+        finally:
+            cache.delete(lock_key)
+
+    @classmethod
+    def nearby_queryset(cls, lng, lat, radius, sort_by="distance", min_health_score=0):
+        """Geo query with the health filter and ordering evaluated by Mongo."""
+        filters = {"health_score__gte": min_health_score} if min_health_score else {}
+        if sort_by == "health":
+            # $near 固定按距离排序，按健康分排序改用 $geoWithin 圆形范围
+            return Restaurant.objects(
+                location__geo_within_sphere=[[lng, lat], radius / cls.EARTH_RADIUS_M], **filters
+            ).order_by("-health_score", "-rating")
+        return Restaurant.objects(location__near=[lng, lat], location__max_distance=radius, **filters)
+
+    @classmethod
+    def _compute(cls, lng, lat, radius, sort_by="distance", min_health_score=0, raise_errors=False):
         try:
             # 1. 查 Mongo 缓存
-            shops = list(Restaurant.objects(
-                location__near=[lng, lat],
-                location__max_distance=radius
-            ).limit(15))
-            
-            # 2. 如果不足，查高德 API 并入库
+            shops = list(cls.nearby_queryset(lng, lat, radius, sort_by, min_health_score).limit(cls.TILE_LIMIT))
+
+            # 2. 如果不足，查高德 API 批量 upsert 入库后重新查询
             if len(shops) < 5:
-                raw_pois = AMapService.search_nearby_restaurants(lng, lat, radius)
-                for poi in raw_pois:
-                    try:
-                        if Restaurant.objects(amap_id=poi['id']).count() > 0: continue
-                        loc_str = poi.get('location', '0,0').split(',')
-                        coords = [float(loc_str[0]), float(loc_str[1])]
-                        photos = [p.get('url') for p in poi.get('photos', []) if p.get('url')]
-                        
-                        shop = Restaurant(
-                            amap_id=poi['id'], name=poi['name'], location=coords,
-                            type=poi.get('type', ''), address=poi.get('address', ''),
-                            rating=float(poi['biz_ext'].get('rating', 4.0)) if poi.get('biz_ext') else 4.0,
-                            photos=photos
-                        )
-                        shop.save()
-                        shops.append(shop)
-                    except Exception: continue
-
-            # 3. 格式化输出
-            for s in shops:
-                est_cals = 600
-                s_type = str(s.type or "")
-                health_light = "yellow"
-                if "轻食" in s_type or "沙拉" in s_type: 
-                    est_cals = 400; health_light = "green"
-                elif "快餐" in s_type or "汉堡" in s_type: 
-                    est_cals = 800; health_light = "red"
-                elif est_cals < 600: 
-                    health_light = "green"
-                
-                score_map = {"green": 90, "yellow": 70, "red": 50}
-                results.append({
-                    "id": s.amap_id, "name": s.name, "address": s.address,
-                    "rating": s.rating, "image": s.photos[0] if s.photos else "",
-                    "estimated_calories": est_cals,
-                    "health_light": health_light,
-                    "health_score": score_map.get(health_light, 70),
-                })
-            
-            if results: cache.set(geo_key, results, timeout=3600)
-            return results
+                raw_pois = AMapFetcher.search_nearby(lng, lat, radius)
+                stats, _ = RestaurantIngestor.upsert(raw_pois)
+                if stats["inserted"] or stats["updated"]:
+                    shops = list(cls.nearby_queryset(lng, lat, radius, sort_by, min_health_score).limit(cls.TILE_LIMIT))
+
+            # 3. 格式化输出 (健康分级已在入库时计算)，附带坐标供按调用方位置二次过滤
+            return [{**cls.format_restaurant(s), "_location": cls._coordinates(s)} for s in shops]
         except Exception:
-            return []
\ No newline at end of file
+            if raise_errors:
+                raise
+            return []
+
+    @staticmethod
+    def _coordinates(shop):
+        location = shop.location
+        if isinstance(location, dict):
+            location = location.get("coordinates")
+        return list(location) if location else None
+
+    @staticmethod
+    def format_restaurant(shop):
+        return {
+            "id": shop.amap_id, "name": shop.name, "address": shop.address,
+            "rating": shop.rating, "image": shop.photos[0] if shop.photos else "",
+            **HealthClassifier.summary(shop),
+        }
@@ -3,6 +3,8 @@ from mongoengine.queryset.visitor import Q
 from bson import ObjectId
 from apps.diet.models import Recipe
 from apps.common.utils import INGREDIENT_SYNONYMS, normalize_ingredient_name
+from apps.diet.domains.discovery.ingredient_index import IngredientIndex
+from apps.diet.domains.discovery.recipe_search import RecipeSearchIndex
 # 跨域调用
 from apps.diet.domains.pantry.selectors import PantrySelector
 
@@ -16,6 +18,10 @@ class MatchingService:
         "料酒": [{"name": "白酒", "reason": "去腥"}, {"name": "姜片", "reason": "去腥"}],
     }
 
+    # 索引无法覆盖的筛选条件 (需回查 MongoDB 校验)
+    MONGO_ONLY_FILTERS = ('tags', 'keyword')
+    MAX_INDEX_ROUNDS = 4
+
     @staticmethod
     def get_cook_recommendations(user, page=1, page_size=20, sort_by='match_score', filters=None):
         if filters is None: filters = {}
@@ -27,17 +33,24 @@ class MatchingService:
         cleanup_mode = filters.get('cleanup_mode', False)
         scrap_mode = filters.get('scrap_mode', False)
         priority_ingredients = PantrySelector.get_priority_ingredients(user, cleanup_mode, scrap_mode)
+        priority = priority_ingredients if (cleanup_mode or scrap_mode) and priority_ingredients else set()
+
+        # 3. 有库存时走倒排索引做全局排序，否则退回 MongoDB 扫描
+        if priority or user_ingredients:
+            items = MatchingService._index_recommendations(
+                user_ingredients, priority, page, page_size, sort_by, filters
+            )
+            if items is not None:
+                return items
+        return MatchingService._scan_recommendations(
+            user_ingredients, priority, page, page_size, sort_by, filters
+        )
 
-        # 3. 构建 MongoDB 查询
+    @staticmethod
+    def _filter_query(filters):
         query = Q(status=1)
-        if (cleanup_mode or scrap_mode) and priority_ingredients:
-            query = Q(ingredients_search__in=list(priority_ingredients))
-        elif user_ingredients:
-            query = Q(ingredients_search__in=list(user_ingredients))
-        
-        # 基础筛选
         if filters.get('tags'): query &= Q(keywords__in=filters['tags'])
-        if filters.get('keyword'): query &= Q(name__icontains=filters['keyword'])
+        if filters.get('keyword'): query &= RecipeSearchIndex.keyword_query(filters['keyword'], filters)
         if filters.get('difficulty'): query &= Q(difficulty=filters['difficulty'])
         exclude_ids = [ObjectId(rid) for rid in filters.get('exclude_ids', []) if ObjectId.is_valid(str(rid))]
         if exclude_ids: query &= Q(id__nin=exclude_ids)
@@ -46,8 +59,45 @@ class MatchingService:
         # 热量范围
         if filters.get('calorie_min'): query &= Q(calories__gte=int(filters['calorie_min']))
         if filters.get('calorie_max'): query &= Q(calories__lte=int(filters['calorie_max']))
+        return query
+
+    @staticmethod
+    def _index_recommendations(user_ingredients, priority, page, page_size, sort_by, filters):
+        """倒排索引路径：全局 Top-K 排序后只回查当前页所需的文档"""
+        start = (page - 1) * page_size
+        needs_mongo_filter = any(filters.get(key) for key in MatchingService.MONGO_ONLY_FILTERS)
+        query = MatchingService._filter_query(filters)
+        limit = start + page_size
+
+        for _ in range(MatchingService.MAX_INDEX_ROUNDS):
+            ranked = IngredientIndex.search(user_ingredients, priority, limit=limit, filters=filters, sort_by=sort_by)
+            if ranked is None:
+                return None
+            # 仅当存在索引无法下推的条件时，才需要校验前面页的候选以保证分页正确
+            window = ranked if needs_mongo_filter else ranked[start:]
+            window_ids = [ObjectId(rid) for rid, _, _ in window if ObjectId.is_valid(rid)]
+            recipe_map = {str(r.id): r for r in Recipe.objects(query & Q(id__in=window_ids))} if window_ids else {}
+            accepted = [(recipe_map[rid], score, hit) for rid, score, hit in window if rid in recipe_map]
+            if needs_mongo_filter:
+                accepted = accepted[start:]
+            if len(accepted) >= page_size or len(ranked) < limit:
+                break
+            limit *= 2
+
+        return [
+            MatchingService._build_item(recipe, score, hit, user_ingredients)
+            for recipe, score, hit in accepted[:page_size]
+        ]
+
+    @staticmethod
+    def _scan_recommendations(user_ingredients, priority, page, page_size, sort_by, filters):
+        """兜底路径：索引不可用或冰箱为空时，按 MongoDB 窗口扫描"""
+        query = MatchingService._filter_query(filters)
+        if priority:
+            query &= Q(ingredients_search__in=list(priority))
+        elif user_ingredients:
+            query &= Q(ingredients_search__in=list(user_ingredients))
 
-        # 4. 执行查询与内存排序
         skip = (page - 1) * page_size
         fetch_limit = page_size * 5 
         raw_recipes = Recipe.objects(query).skip(skip).limit(fetch_limit)
@@ -61,54 +111,19 @@ class MatchingService:
                 # 归一化比较
                 recipe_ings_std = {normalize_ingredient_name(i) for i in raw_ings if i}
                 matched = user_ingredients & recipe_ings_std
-                missing = recipe_ings_std - user_ingredients
                 
                 # 计算分值
                 score = 0
                 if recipe_ings_std:
                     score = int((len(matched) / len(recipe_ings_std)) * 100)
                 
-                is_priority_hit = False
-                if (cleanup_mode or scrap_mode) and priority_ingredients:
-                    if priority_ingredients & recipe_ings_std:
-                        score += 20
-                        is_priority_hit = True
-                
-                score = min(100, score)
-
-                # 匹配理由
-                match_reason = "猜你喜欢"
+                is_priority_hit = bool(priority and priority & recipe_ings_std)
                 if is_priority_hit:
-                    match_reason = "消耗临期/边角料"
-                elif score >= 80: 
-                    match_reason = f"匹配度高，缺{len(missing)}样"
-
-                # 详情构建
-                ings_detail = []
-                for ing_name in raw_ings:
-                    std_name = normalize_ingredient_name(ing_name)
-                    ings_detail.append({
-                        "name": ing_name,
-                        "in_fridge": std_name in user_ingredients
-                    })
-
-                processed_list.append({
-                    "id": str(r.id),
-                    "name": r.name,
-                    "match_score": score,
-                    "score": score,
-                    "score_breakdown": {"ingredient_match": score},
-                    "missing_ingredients": list(missing),
-                    "cooking_time": getattr(r, 'cooking_time', 15),
-                    "difficulty": getattr(r, 'difficulty', "简单"),
-                    "calories": getattr(r, 'calories', 350),
-                    "image": getattr(r, 'image_url', ""),
-                    "ingredients": ings_detail,
-                    "match_reason": match_reason,
-                    "recommend_type": "content",
-                    "algorithm_label": "冰箱食材匹配",
-                    "tags": getattr(r, 'keywords', [])[:3]
-                })
+                    score += 20
+                
+                processed_list.append(
+                    MatchingService._build_item(r, min(100, score), is_priority_hit, user_ingredients)
+                )
             except Exception: continue
             
         # 内存排序
@@ -121,6 +136,46 @@ class MatchingService:
             
         return processed_list[:page_size]
 
+    @staticmethod
+    def _build_item(r, score, is_priority_hit, user_ingredients):
+        raw_ings = [i for i in getattr(r, 'ingredients_search', []) if i]
+        recipe_ings_std = {normalize_ingredient_name(i) for i in raw_ings}
+        missing = recipe_ings_std - user_ingredients
+
+        # 匹配理由
+        match_reason = "猜你喜欢"
+        if is_priority_hit:
+            match_reason = "消耗临期/边角料"
+        elif score >= 80: 
+            match_reason = f"匹配度高，缺{len(missing)}样"
+
+        # 详情构建
+        ings_detail = []
+        for ing_name in raw_ings:
+            std_name = normalize_ingredient_name(ing_name)
+            ings_detail.append({
+                "name": ing_name,
+                "in_fridge": std_name in user_ingredients
+            })
+
+        return {
+            "id": str(r.id),
+            "name": r.name,
+            "match_score": score,
+            "score": score,
+            "score_breakdown": {"ingredient_match": score},
+            "missing_ingredients": list(missing),
+            "cooking_time": getattr(r, 'cooking_time', 15),
+            "difficulty": getattr(r, 'difficulty', "简单"),
+            "calories": getattr(r, 'calories', 350),
+            "image": getattr(r, 'image_url', ""),
+            "ingredients": ings_detail,
+            "match_reason": match_reason,
+            "recommend_type": "content",
+            "algorithm_label": "冰箱食材匹配",
+            "tags": getattr(r, 'keywords', [])[:3]
+        }
+
     @staticmethod
     def get_recipe_substitutes(ingredient_name):
         std_name = normalize_ingredient_name(ingredient_name)
@@ -0,0 +1,250 @@
+import heapq
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, time as dt_time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.common.redis import get_redis
+from apps.diet.models import DailyIntake, UserPreference
+
+
+logger = logging.getLogger(__name__)
+
+
+class PopularityBoard:
+    """Materialised, time-decayed popularity score per recipe.
+
+    Uses forward decay: an event at time t adds ``weight * 2^((t - epoch) /
+    half_life)``, so older events shrink relative to newer ones without ever
+    rewriting stored scores, and the ranking can be served straight from a
+    Redis sorted set. Dividing by the factor at "now" yields the current
+    decayed value. Without Redis the same scores are kept as a summary dict in
+    the Django cache. Reads never build the board themselves: a cold board
+    returns no ranks and starts one background build. Events are applied
+    once their transaction commits; those committed while a build is running
+    are buffered, and the ones committed after its MySQL snapshot started
+    are replayed against the new epoch, so the swap neither drops nor
+    double-counts them.
+    """
+
+    ZSET_KEY = "diet_popularity:board"
+    SCORES_KEY = "diet_popularity:scores"
+    META_KEY = "diet_popularity:meta"
+    BUILD_LOCK_KEY = "diet_popularity:building"
+    BUILDING_KEY = "diet_popularity:build_running"
+    PENDING_KEY = "diet_popularity:pending"
+    BUILD_TIMEOUT = 600
+    WEIGHTS = {"like": 3, "save": 2, "intake": 4}
+    _local_lock = threading.Lock()
+
+    @staticmethod
+    def _half_life():
+        return max(float(getattr(settings, "POPULARITY_HALF_LIFE_DAYS", 14)), 0.1) * 86400
+
+    @classmethod
+    def _factor(cls, timestamp, epoch):
+        return 2 ** ((timestamp - epoch) / cls._half_life())
+
+    @staticmethod
+    def _timestamp(value):
+        # 统一折算到当天正午，使增量更新与按天聚合的全量构建得分一致
+        if value is None:
+            value = timezone.localdate()
+        elif isinstance(value, datetime):
+            value = timezone.localdate(value) if timezone.is_aware(value) else value.date()
+        return timezone.make_aware(datetime.combine(value, dt_time(12))).timestamp()
+
+    @classmethod
+    def build(cls):
+        """Recompute all scores from MySQL, then replay events committed meanwhile."""
+        epoch = time.time()
+        # 此前缓冲的事件已落库，会被本次快照包含
+        cls._drain_pending()
+        cache.set(cls.BUILDING_KEY, epoch, timeout=cls.BUILD_TIMEOUT)
+        try:
+            # 标记写入之后才开始读快照：早于该时刻提交的事件必然已被快照计入
+            snapshot_started = time.time()
+            meta = cls._install(cls._snapshot(epoch), epoch)
+        finally:
+            cache.delete(cls.BUILDING_KEY)
+        for event in cls._drain_pending():
+            if event[4] >= snapshot_started:
+                cls._apply(event[:4], epoch)
+        return meta
+
+    @classmethod
+    def _snapshot(cls, epoch):
+        """Scores per recipe from MySQL, grouped per recipe and day."""
+        scores = defaultdict(float)
+        pref_rows = (
+            UserPreference.objects.filter(target_type="recipe", action__in=["like", "save"])
+            .annotate(day=TruncDate("created_at"))
+            .values("target_id", "action", "day")
+            .annotate(total=Count("id"))
+        )
+        for row in pref_rows:
+            factor = cls._factor(cls._timestamp(row["day"]), epoch)
+            scores[str(row["target_id"])] += row["total"] * cls.WEIGHTS[row["action"]] * factor
+
+        intake_rows = (
+            DailyIntake.objects.filter(source_type=1)
+            .exclude(source_id__isnull=True)
+            .exclude(source_id="")
+            .values("source_id", "record_date")
+            .annotate(total=Count("id"))
+        )
+        for row in intake_rows:
+            factor = cls._factor(cls._timestamp(row["record_date"]), epoch)
+            scores[str(row["source_id"])] += row["total"] * cls.WEIGHTS["intake"] * factor
+
+        return scores
+
+    @classmethod
+    def _install(cls, scores, epoch):
+        r = get_redis()
+        if r is not None:
+            staging_key = f"{cls.ZSET_KEY}:staging"
+            pipe = r.pipeline()
+            pipe.delete(staging_key)
+            if scores:
+                pipe.zadd(staging_key, dict(scores))
+                pipe.rename(staging_key, cls.ZSET_KEY)
+            else:
+                pipe.delete(cls.ZSET_KEY)
+            pipe.execute()
+        else:
+            cache.set(cls.SCORES_KEY, dict(scores), timeout=None)
+
+        meta = {"epoch": epoch, "items": len(scores), "built_at": timezone.now().isoformat()}
+        cache.set(cls.META_KEY, meta, timeout=None)
+        return meta
+
+    @classmethod
+    def _epoch(cls):
+        meta = cache.get(cls.META_KEY)
+        return meta["epoch"] if meta else None
+
+    @classmethod
+    def build_in_background(cls):
+        """Start one background build unless another process is already building."""
+        if not cache.add(cls.BUILD_LOCK_KEY, 1, timeout=cls.BUILD_TIMEOUT):
+            return False
+
+        def run():
+            try:
+                cls.build()
+            except Exception as exc:
+                logger.warning("Popularity board build failed: %s", exc)
+            finally:
+                cache.delete(cls.BUILD_LOCK_KEY)
+                connection.close()
+
+        threading.Thread(target=run, name="popularity-board-build", daemon=True).start()
+        return True
+
+    @classmethod
+    def record(cls, recipe_id, kind, occurred_at=None, added=True):
+        """Apply one like/save/intake event after commit; removals subtract the same amount."""
+        event = [str(recipe_id), kind, cls._timestamp(occurred_at), added]
+        transaction.on_commit(lambda: cls._record_committed(event))
+
+    @classmethod
+    def _record_committed(cls, event):
+        try:
+            if cache.get(cls.BUILDING_KEY):
+                # 构建中：记下提交时刻，新榜单就位后只回放快照开始之后提交的事件
+                cls._push_pending(event + [time.time()])
+                return
+            epoch = cls._epoch()
+            if epoch is None:
+                # 尚未构建，首次构建会包含这条记录
+                return
+            cls._apply(event, epoch)
+        except Exception as exc:
+            logger.warning("Popularity board update failed for recipe %s: %s", event[0], exc)
+
+    @classmethod
+    def _apply(cls, event, epoch):
+        recipe_id, kind, timestamp, added = event
+        delta = cls.WEIGHTS[kind] * cls._factor(timestamp, epoch)
+        if not added:
+            delta = -delta
+        r = get_redis()
+        if r is not None:
+            if r.zincrby(cls.ZSET_KEY, delta, recipe_id) <= 1e-9:
+                r.zrem(cls.ZSET_KEY, recipe_id)
+            return
+        scores = cache.get(cls.SCORES_KEY) or {}
+        value = scores.get(recipe_id, 0.0) + delta
+        if value <= 1e-9:
+            scores.pop(recipe_id, None)
+        else:
+            scores[recipe_id] = value
+        cache.set(cls.SCORES_KEY, scores, timeout=None)
+
+    @classmethod
+    def _push_pending(cls, event):
+        r = get_redis()
+        if r is not None:
+            r.rpush(cls.PENDING_KEY, json.dumps(event))
+            return
+        with cls._local_lock:
+            pending = cache.get(cls.PENDING_KEY) or []
+            pending.append(event)
+            cache.set(cls.PENDING_KEY, pending, timeout=cls.BUILD_TIMEOUT)
+
+    @classmethod
+    def _drain_pending(cls):
+        r = get_redis()
+        if r is not None:
+            pipe = r.pipeline()
+            pipe.lrange(cls.PENDING_KEY, 0, -1)
+            pipe.delete(cls.PENDING_KEY)
+            rows, _ = pipe.execute()
+            return [json.loads(row) for row in rows]
+        with cls._local_lock:
+            pending = cache.get(cls.PENDING_KEY) or []
+            cache.delete(cls.PENDING_KEY)
+        return pending
+
+    @classmethod
+    def page(cls, offset=0, count=50):
+        """Ranks ``offset`` .. ``offset + count`` as ``[(recipe_id, decayed_score)]``."""
+        epoch = cls._epoch()
+        if epoch is None:
+            # 冷启动：本次请求降级为空榜，由后台线程构建
+            cls.build_in_background()
+            return []
+        if count <= 0:
+            return []
+        now_factor = cls._factor(time.time(), epoch)
+        try:
+            r = get_redis()
+            if r is not None:
+                rows = r.zrevrange(cls.ZSET_KEY, offset, offset + count - 1, withscores=True)
+            else:
+                scores = cache.get(cls.SCORES_KEY) or {}
+                rows = heapq.nlargest(offset + count, scores.items(), key=lambda kv: (kv[1], kv[0]))[offset:]
+        except Exception as exc:
+            logger.warning("Popularity board read failed: %s", exc)
+            return []
+
+        ranked = []
+        for recipe_id, score in rows:
+            if isinstance(recipe_id, bytes):
+                recipe_id = recipe_id.decode("utf-8")
+            ranked.append((recipe_id, score / now_factor))
+        return ranked
+
+    @classmethod
+    def score_map(cls, limit=400):
+        return dict(cls.page(0, limit))
@@ -0,0 +1,82 @@
+import json
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+from apps.common.redis import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecipeCatalog:
+    """Shared change marker for the Mongo `recipes` collection.
+
+    In-process indexes built from the catalog remember the version they were
+    built at and rebuild once it moves. Writers (audit, import, seeding) call
+    `mark_changed` after touching recipes so every worker notices within one
+    request. Writers that know which recipes they touched pass their ids; a
+    short change log lets indexes patch just those documents instead of
+    rebuilding. On Redis the log is a capped list appended with RPUSH/LTRIM,
+    so concurrent writers never drop each other's entries.
+    """
+
+    VERSION_KEY = "diet_recipe_catalog:version"
+    CHANGES_KEY = "diet_recipe_catalog:changes"
+    MAX_CHANGES = 500
+    _local_lock = threading.Lock()
+
+    @classmethod
+    def version(cls):
+        try:
+            return cache.get(cls.VERSION_KEY) or 0
+        except Exception:
+            return 0
+
+    @classmethod
+    def mark_changed(cls, recipe_ids=None):
+        """Bump the version; ``recipe_ids=None`` means an unknown/bulk change."""
+        version = time.time_ns()
+        entry = (version, [str(rid) for rid in recipe_ids] if recipe_ids is not None else None)
+        try:
+            r = get_redis()
+            if r is not None:
+                pipe = r.pipeline()
+                pipe.rpush(cls.CHANGES_KEY, json.dumps(entry))
+                pipe.ltrim(cls.CHANGES_KEY, -cls.MAX_CHANGES, -1)
+                pipe.execute()
+            else:
+                # 本地缓存仅在进程内共享，进程锁即可保证读-改-写不丢条目
+                with cls._local_lock:
+                    changes = cache.get(cls.CHANGES_KEY) or []
+                    changes.append(entry)
+                    cache.set(cls.CHANGES_KEY, changes[-cls.MAX_CHANGES:], timeout=None)
+            cache.set(cls.VERSION_KEY, version, timeout=None)
+        except Exception as exc:
+            logger.warning("Failed to bump recipe catalog version: %s", exc)
+        return version
+
+    @classmethod
+    def changes_since(cls, version):
+        """Ids changed after ``version``, or None when a full rebuild is required."""
+        try:
+            r = get_redis()
+            if r is not None:
+                changes = [tuple(json.loads(raw)) for raw in r.lrange(cls.CHANGES_KEY, 0, -1)]
+            else:
+                changes = cache.get(cls.CHANGES_KEY) or []
+        except Exception:
+            return None
+        # 日志必须仍包含调用方所处的版本，否则中间的变更可能已被截断
+        if not any(entry_version == version for entry_version, _ in changes):
+            return None
+        changed = set()
+        for entry_version, ids in changes:
+            if entry_version <= version:
+                continue
+            if ids is None:
+                return None
+            changed.update(ids)
+        return changed
@@ -0,0 +1,292 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from bson import ObjectId
+from mongoengine.queryset.visitor import Q
+
+from apps.common.utils import normalize_ingredient_name, search_tokens
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
+from apps.diet.models import Recipe
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecipeSearchSnapshot:
+    """N-gram postings with BM25 statistics for approved recipes.
+
+    Postings are parallel ``array`` pairs (ordinals, term frequencies) kept in
+    ordinal order, so intersections walk the rarest list and binary-search the
+    others. Keywords and ingredients are kept per ordinal so tag and allergen
+    filters run before ranking, like calories and difficulty. Updates append
+    a fresh ordinal and tombstone the old one; the periodic full rebuild
+    compacts them away. An installed snapshot is never mutated: incremental
+    updates go to a ``copy()`` that shares postings arrays until it first
+    appends to them.
+    """
+
+    FIELD_WEIGHTS = (("name", 3), ("dish", 2), ("keywords", 2), ("ingredients_search", 1))
+
+    def __init__(self, docs=(), version=0):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.ids = []
+        self.ordinals = {}
+        self.lengths = array("I")
+        self.calories = array("i")
+        self.difficulties = []
+        self.keywords = []
+        self.ingredients = []
+        self.postings = {}
+        self.doc_freq = Counter()
+        self.removed = set()
+        self.total_length = 0
+        # 与原快照共享、尚未复制的倒排项
+        self.shared = set()
+        for doc in docs:
+            self.add(doc)
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def copy(self, version):
+        """Clone for patching; readers of ``self`` keep a consistent view meanwhile."""
+        clone = RecipeSearchSnapshot(version=version)
+        clone.built_at = self.built_at
+        clone.ids = list(self.ids)
+        clone.ordinals = dict(self.ordinals)
+        clone.lengths = array("I", self.lengths)
+        clone.calories = array("i", self.calories)
+        clone.difficulties = list(self.difficulties)
+        clone.keywords = list(self.keywords)
+        clone.ingredients = list(self.ingredients)
+        clone.postings = dict(self.postings)
+        clone.doc_freq = Counter(self.doc_freq)
+        clone.removed = set(self.removed)
+        clone.total_length = self.total_length
+        clone.shared = set(self.postings)
+        return clone
+
+    @classmethod
+    def term_frequencies(cls, doc):
+        freqs = Counter()
+        for field, weight in cls.FIELD_WEIGHTS:
+            value = doc.get(field) or []
+            texts = [value] if isinstance(value, str) else list(value)
+            if field == "ingredients_search":
+                texts += [normalize_ingredient_name(text) for text in texts]
+            for text in texts:
+                for token in search_tokens(text):
+                    freqs[token] += weight
+        return freqs
+
+    def add(self, doc):
+        recipe_id = str(doc["_id"])
+        self.remove(recipe_id)
+        freqs = self.term_frequencies(doc)
+        if not freqs:
+            return
+        ordinal = len(self.ids)
+        self.ids.append(recipe_id)
+        self.ordinals[recipe_id] = ordinal
+        length = sum(freqs.values())
+        self.lengths.append(length)
+        self.total_length += length
+        self.calories.append(int(doc.get("calories") or 350))
+        self.difficulties.append(doc.get("difficulty") or "简单")
+        self.keywords.append(frozenset(doc.get("keywords") or ()))
+        self.ingredients.append(frozenset(doc.get("ingredients_search") or ()))
+        for token, tf in freqs.items():
+            if token in self.shared:
+                # 写时复制：原快照可能仍在被其它请求读取
+                self.shared.discard(token)
+                ordinals, tfs = self.postings[token]
+                self.postings[token] = (array("I", ordinals), array("H", tfs))
+            ordinals, tfs = self.postings.setdefault(token, (array("I"), array("H")))
+            ordinals.append(ordinal)
+            tfs.append(min(tf, 65535))
+            self.doc_freq[token] += 1
+
+    def remove(self, recipe_id):
+        ordinal = self.ordinals.pop(str(recipe_id), None)
+        if ordinal is None:
+            return
+        self.removed.add(ordinal)
+        self.total_length -= self.lengths[ordinal]
+        # 倒排项与文档频次保留为墓碑，idf 的微小偏差在下次全量重建时消除
+
+    @staticmethod
+    def _find(ordinals, ordinal):
+        index = bisect_left(ordinals, ordinal)
+        if index < len(ordinals) and ordinals[index] == ordinal:
+            return index
+        return None
+
+    def search(self, tokens, limit=20, offset=0, calorie_min=None, calorie_max=None, difficulty=None, exclude=(),
+               tags=(), allergens=()):
+        """BM25-ranked AND match; returns ``(total, [(recipe_id, score)])``."""
+        tokens = list(dict.fromkeys(tokens))
+        tags, allergens = set(tags), set(allergens)
+        if not tokens or any(token not in self.postings for token in tokens):
+            return 0, []
+        tokens.sort(key=lambda token: len(self.postings[token][0]))
+        excluded = {self.ordinals[rid] for rid in exclude if rid in self.ordinals}
+        live = max(len(self.ordinals), 1)
+        avg_length = self.total_length / live if self.total_length > 0 else 1.0
+        k1, b = 1.2, 0.75
+        idf = {
+            token: math.log(1 + (live - self.doc_freq[token] + 0.5) / (self.doc_freq[token] + 0.5))
+            for token in tokens
+        }
+
+        base_ordinals, base_tfs = self.postings[tokens[0]]
+        others = [self.postings[token] for token in tokens[1:]]
+        scored = []
+        for position, ordinal in enumerate(base_ordinals):
+            if ordinal in self.removed or ordinal in excluded:
+                continue
+            if calorie_min is not None and self.calories[ordinal] < calorie_min:
+                continue
+            if calorie_max is not None and self.calories[ordinal] > calorie_max:
+                continue
+            if difficulty and self.difficulties[ordinal] != difficulty:
+                continue
+            # 与 Mongo 的 keywords__in / ingredients_search__nin 语义一致
+            if tags and not tags & self.keywords[ordinal]:
+                continue
+            if allergens and allergens & self.ingredients[ordinal]:
+                continue
+            tfs = [base_tfs[position]]
+            for ordinals, token_tfs in others:
+                index = self._find(ordinals, ordinal)
+                if index is None:
+                    break
+                tfs.append(token_tfs[index])
+            else:
+                norm = k1 * (1 - b + b * self.lengths[ordinal] / avg_length)
+                score = sum(idf[token] * tf * (k1 + 1) / (tf + norm) for token, tf in zip(tokens, tfs))
+                scored.append((score, ordinal))
+
+        top = heapq.nlargest(offset + limit, scored, key=lambda entry: (entry[0], -entry[1]))[offset:]
+        return len(scored), [(self.ids[ordinal], round(score, 4)) for score, ordinal in top]
+
+
+class RecipeSearchIndex:
+    """Keyword search over approved recipes without regex scans.
+
+    Mirrors IngredientIndex: one snapshot per process, keyed by the recipe
+    catalog version. When the catalog change log lists the recipes that moved
+    since this snapshot, only those are re-read and patched in; otherwise, or
+    once the snapshot is older than MAX_AGE, it is rebuilt from scratch.
+    """
+
+    MAX_AGE = 6 * 3600
+    PROJECTION = ("id", "name", "dish", "keywords", "ingredients_search", "calories", "difficulty", "status")
+    _snapshot = None
+    _lock = threading.Lock()
+
+    KEYWORD_MATCH_LIMIT = 1000
+
+    @classmethod
+    def _load_docs(cls, recipe_ids=None):
+        if recipe_ids is None:
+            queryset = Recipe.objects(status=1)
+        else:
+            queryset = Recipe.objects(id__in=[ObjectId(rid) for rid in recipe_ids if ObjectId.is_valid(rid)])
+        return queryset.only(*cls.PROJECTION).as_pymongo()
+
+    @classmethod
+    def install(cls, snapshot):
+        cls._snapshot = snapshot
+        return snapshot
+
+    @classmethod
+    def current(cls):
+        version = RecipeCatalog.version()
+        snapshot = cls._snapshot
+        fresh = snapshot is not None and time.monotonic() - snapshot.built_at < cls.MAX_AGE
+        if fresh and snapshot.version == version:
+            return snapshot
+
+        if not cls._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            if cls._snapshot is not snapshot or (fresh and snapshot.version == RecipeCatalog.version()):
+                return cls._snapshot
+            changed = RecipeCatalog.changes_since(snapshot.version) if fresh else None
+            if changed is not None:
+                patched = snapshot.copy(version)
+                cls._apply_changes(patched, changed)
+                return cls.install(patched)
+            started = time.perf_counter()
+            rebuilt = RecipeSearchSnapshot(cls._load_docs(), version=version)
+            logger.info(
+                "Recipe search index rebuilt: %d recipes, %d tokens in %.1fms",
+                len(rebuilt), len(rebuilt.postings), (time.perf_counter() - started) * 1000,
+            )
+            return cls.install(rebuilt)
+        except Exception as exc:
+            logger.warning("Recipe search index refresh failed: %s", exc)
+            return snapshot
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def _apply_changes(cls, snapshot, recipe_ids):
+        docs = {str(doc["_id"]): doc for doc in cls._load_docs(recipe_ids)} if recipe_ids else {}
+        for recipe_id in recipe_ids:
+            doc = docs.get(recipe_id)
+            if doc is not None and doc.get("status") == 1:
+                snapshot.add(doc)
+            else:
+                snapshot.remove(recipe_id)
+
+    @classmethod
+    def search(cls, query, limit=20, offset=0, filters=None):
+        """Ranked ``(total, [(recipe_id, score)])`` for ``query``; None when unavailable."""
+        snapshot = cls.current()
+        if snapshot is None:
+            return None
+        filters = filters or {}
+        tags = filters.get("tags") or []
+        if isinstance(tags, str):
+            tags = [tags]
+        return snapshot.search(
+            search_tokens(query, for_query=True),
+            limit=limit,
+            offset=offset,
+            calorie_min=cls._safe_int(filters.get("calorie_min")),
+            calorie_max=cls._safe_int(filters.get("calorie_max")),
+            difficulty=filters.get("difficulty"),
+            exclude={str(rid) for rid in filters.get("exclude_ids") or []},
+            tags=[tag for tag in tags if tag],
+            allergens=[item for item in filters.get("allergens") or [] if item],
+        )
+
+    @classmethod
+    def keyword_query(cls, keyword, filters=None):
+        """Mongo filter for a keyword: the top BM25 ids, or the indexed n-gram field as fallback.
+
+        ``filters`` are applied inside the index before the ids are cut to
+        KEYWORD_MATCH_LIMIT, so matches that pass them are never truncated
+        away by higher-ranked ones that do not.
+        """
+        result = cls.search(keyword, limit=cls.KEYWORD_MATCH_LIMIT, filters=filters)
+        if result is not None:
+            return Q(id__in=[ObjectId(rid) for rid, _ in result[1]])
+        return Q(search_tokens__all=search_tokens(keyword, for_query=True))
+
+    @staticmethod
+    def _safe_int(value):
+        if value in (None, ""):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
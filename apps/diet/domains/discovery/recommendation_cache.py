@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecommendationCache:
+    """Per-user cache of ranked recommendation lists.
+
+    Each entry is keyed by user, strategy, sort order and the prepared
+    filters, and holds only recipe ids plus their ranking fields; recipe
+    payloads are re-read per page. A per-user generation marker is part of
+    the key, so fridge, preference and allergen changes drop every entry of
+    that user by bumping it, and recipe catalog changes do the same globally.
+    """
+
+    KEY_PREFIX = "diet_rec"
+    RANK_FIELDS = ("match_score", "match_reason", "recommend_type", "algorithm_label", "score", "score_breakdown")
+
+    @classmethod
+    def _generation_key(cls, user_id):
+        return f"{cls.KEY_PREFIX}:gen:{user_id}"
+
+    @staticmethod
+    def _timeout():
+        return int(getattr(settings, "RECOMMENDATION_CACHE_TTL", 600))
+
+    @classmethod
+    def generation(cls, user_id):
+        """Current generation marker of a user; None when the cache is unreachable."""
+        try:
+            return cache.get(cls._generation_key(user_id)) or 0
+        except Exception:
+            return None
+
+    @classmethod
+    def _entry_key(cls, user_id, strategy, sort_by, filters):
+        generation = cls.generation(user_id)
+        if generation is None:
+            return None
+        signature = json.dumps(
+            [strategy, sort_by, filters, RecipeCatalog.version()],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        digest = hashlib.md5(signature.encode("utf-8")).hexdigest()
+        return f"{cls.KEY_PREFIX}:{user_id}:{generation}:{digest}"
+
+    @classmethod
+    def get(cls, user_id, strategy, sort_by, filters):
+        """Return the cached ranked entries, or None on a miss."""
+        key = cls._entry_key(user_id, strategy, sort_by, filters)
+        if key is None:
+            return None
+        try:
+            return cache.get(key)
+        except Exception:
+            return None
+
+    @classmethod
+    def set(cls, user_id, strategy, sort_by, filters, items):
+        entries = [
+            {
+                "id": item["id"],
+                # 结果依赖冰箱库存时，分页水合需重新计算缺失食材
+                "fridge": bool(
+                    item.get("missing_ingredients")
+                    or any(ing.get("in_fridge") for ing in item.get("ingredients", []))
+                ),
+                **{field: item.get(field) for field in cls.RANK_FIELDS},
+            }
+            for item in items
+        ]
+        key = cls._entry_key(user_id, strategy, sort_by, filters)
+        if key is None:
+            return entries
+        try:
+            cache.set(key, entries, timeout=cls._timeout())
+        except Exception as exc:
+            logger.warning("Failed to cache recommendations for user %s: %s", user_id, exc)
+        return entries
+
+    @classmethod
+    def invalidate(cls, user_id):
+        try:
+            cache.set(cls._generation_key(user_id), time.time_ns(), timeout=None)
+        except Exception as exc:
+            logger.warning("Failed to invalidate recommendations for user %s: %s", user_id, exc)
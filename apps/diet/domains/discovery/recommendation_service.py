@@ -1,11 +1,15 @@
-from collections import defaultdict
-
 from bson import ObjectId
-from django.db.models import Count
 from mongoengine.queryset.visitor import Q
 
+from apps.common.utils import normalize_ingredient_name
 from apps.diet.domains.discovery.matching_service import MatchingService
-from apps.diet.models import DailyIntake, Recipe, UserPreference
+from apps.diet.domains.discovery.popularity_board import PopularityBoard
+from apps.diet.domains.discovery.recipe_search import RecipeSearchIndex
+from apps.diet.domains.discovery.recommendation_cache import RecommendationCache
+from apps.diet.domains.discovery.scoring_engine import HybridScoringEngine
+from apps.diet.domains.discovery.similarity_index import ItemSimilarityIndex
+from apps.diet.domains.pantry.selectors import PantrySelector
+from apps.diet.models import Recipe, UserPreference
 
 
 class RecommendationService:
@@ -21,7 +25,10 @@ class RecommendationService:
         "collaborative": "协同过滤",
         "content": "冰箱食材匹配",
         "hybrid": "混合推荐",
+        "search": "关键词搜索",
     }
+    POPULAR_SCAN_BATCH = 200
+    CACHED_RESULT_LIMIT = 200
 
     @classmethod
     def get_recommendations(
@@ -35,7 +42,24 @@ class RecommendationService:
     ):
         filters = cls._prepare_filters(user, filters or {})
         strategy = strategy if strategy in cls.STRATEGY_LABELS else "hybrid"
+        start = max(page - 1, 0) * page_size
+        user_id = getattr(user, "id", None)
+        if not user_id or start + page_size > cls.CACHED_RESULT_LIMIT:
+            return cls._compute_recommendations(user, strategy, page, page_size, sort_by, filters)
+
+        entries = RecommendationCache.get(user_id, strategy, sort_by, filters)
+        if entries is not None:
+            return cls._hydrate_entries(user, entries[start : start + page_size])
+
+        items = cls._compute_recommendations(user, strategy, 1, cls.CACHED_RESULT_LIMIT, sort_by, filters)
+        if any(str(item["id"]).startswith("demo_") for item in items):
+            # 演示兜底数据不进缓存，按原分页返回
+            return cls._compute_recommendations(user, strategy, page, page_size, sort_by, filters)
+        RecommendationCache.set(user_id, strategy, sort_by, filters, items)
+        return items[start : start + page_size]
 
+    @classmethod
+    def _compute_recommendations(cls, user, strategy, page, page_size, sort_by, filters):
         if strategy == "content":
             return cls.get_content_recommendations(user, page, page_size, sort_by, filters)
         if strategy == "popular":
@@ -43,8 +67,35 @@ class RecommendationService:
         if strategy == "collaborative":
             items = cls.get_collaborative_recommendations(user, page, page_size, filters)
             return items or cls.get_popular_recommendations(user, page, page_size, filters)
+        if strategy == "search" and filters.get("keyword"):
+            return cls.get_search_recommendations(user, page, page_size, filters)
         return cls.get_hybrid_recommendations(user, page, page_size, sort_by, filters)
 
+    @classmethod
+    def get_search_recommendations(cls, user, page=1, page_size=20, filters=None):
+        """BM25 keyword ranking; every filter is applied inside the index."""
+        filters = filters or {}
+        start = max(page - 1, 0) * page_size
+        result = RecipeSearchIndex.search(filters["keyword"], limit=page_size, offset=start, filters=filters)
+        if result is None:
+            return cls.get_hybrid_recommendations(user, page, page_size, filters=filters)
+
+        ranked = result[1]
+        score_map = dict(ranked)
+        search_filters = {key: value for key, value in filters.items() if key != "keyword"}
+        recipes = cls._fetch_recipes_by_ids([rid for rid, _ in ranked], search_filters)
+        max_score = max(score_map.values(), default=1) or 1
+        return [
+            cls._recipe_to_item(
+                recipe,
+                recommend_type="search",
+                score=round(score_map.get(str(recipe.id), 0) / max_score * 100, 1),
+                match_reason=f"与「{filters['keyword']}」相关",
+                score_breakdown={"bm25": score_map.get(str(recipe.id), 0)},
+            )
+            for recipe in recipes
+        ]
+
     @classmethod
     def get_content_recommendations(cls, user, page, page_size, sort_by, filters):
         items = MatchingService.get_cook_recommendations(
@@ -60,41 +111,20 @@ class RecommendationService:
     @classmethod
     def get_popular_recommendations(cls, user, page=1, page_size=20, filters=None):
         filters = filters or {}
-        score_map = defaultdict(float)
-
-        pref_rows = (
-            UserPreference.objects.filter(target_type="recipe", action__in=["like", "save"])
-            .values("target_id", "action")
-            .annotate(total=Count("id"))
-        )
-        for row in pref_rows:
-            weight = 3 if row["action"] == "like" else 2
-            score_map[str(row["target_id"])] += row["total"] * weight
-
-        intake_rows = (
-            DailyIntake.objects.filter(source_type=1)
-            .exclude(source_id__isnull=True)
-            .exclude(source_id="")
-            .values("source_id")
-            .annotate(total=Count("id"))
-        )
-        for row in intake_rows:
-            score_map[str(row["source_id"])] += row["total"] * 4
-
-        ranked_ids = [rid for rid, _ in sorted(score_map.items(), key=lambda kv: kv[1], reverse=True)]
-        recipes = cls._fetch_recipes_by_ids(ranked_ids, filters)
+        start = max(page - 1, 0) * page_size
+        ranked, max_score = cls._scan_popular_ranks(start + page_size, filters)
+        score_map = dict(ranked)
+        recipes = cls._fetch_recipes_by_ids([rid for rid, _ in ranked[start:]], filters) if ranked else []
 
-        if not recipes:
+        if not ranked:
             recipes = cls._fallback_recipes(filters, limit=max(page * page_size, page_size))
             for index, recipe in enumerate(recipes):
                 score_map[str(recipe.id)] = max(1, len(recipes) - index)
+            max_score = max(score_map.values(), default=1)
+            recipes = recipes[start : start + page_size]
+            if not recipes:
+                return cls._demo_recommendation_items(page, page_size, "popular", filters)
 
-        if not recipes:
-            return cls._demo_recommendation_items(page, page_size, "popular", filters)
-
-        start = max(page - 1, 0) * page_size
-        selected = recipes[start : start + page_size]
-        max_score = max(score_map.values(), default=1)
         return [
             cls._recipe_to_item(
                 recipe,
@@ -103,14 +133,40 @@ class RecommendationService:
                 match_reason="近期收藏、保存或记录较多",
                 score_breakdown={"popular": round(score_map.get(str(recipe.id), 1), 2)},
             )
-            for recipe in selected
+            for recipe in recipes
         ]
 
+    @classmethod
+    def _scan_popular_ranks(cls, needed, filters):
+        """Walk the popularity board in batches until ``needed`` recipes pass the filters.
+
+        Only ids are projected while scanning; callers fetch the page window.
+        """
+        batch_size = max(needed, cls.POPULAR_SCAN_BATCH)
+        base_query = cls._recipe_filter_query(filters)
+        ranked, offset, max_score = [], 0, 1
+        while len(ranked) < needed:
+            batch = PopularityBoard.page(offset, batch_size)
+            if not batch:
+                break
+            if not offset:
+                max_score = batch[0][1] or 1
+            offset += len(batch)
+            valid_ids = [ObjectId(rid) for rid, _ in batch if ObjectId.is_valid(rid)]
+            try:
+                allowed = {
+                    str(rid)
+                    for rid in Recipe.objects(base_query & Q(id__in=valid_ids)).scalar("id")
+                } if valid_ids else set()
+            except Exception:
+                return [], max_score
+            ranked.extend((rid, score) for rid, score in batch if rid in allowed)
+        return ranked[:needed], max_score
+
     @classmethod
     def get_collaborative_recommendations(cls, user, page=1, page_size=20, filters=None):
         filters = filters or {}
-        behavior_map = cls._build_user_recipe_behavior_map()
-        candidate_scores = cls._compute_collaborative_scores(user.id, behavior_map)
+        candidate_scores = ItemSimilarityIndex.get_user_scores(user.id)
         if not candidate_scores:
             return []
 
@@ -133,53 +189,57 @@ class RecommendationService:
     @classmethod
     def get_hybrid_recommendations(cls, user, page=1, page_size=20, sort_by="match_score", filters=None):
         filters = filters or {}
-        fetch_size = max(page * page_size * 2, 40)
-        sources = [
-            ("content", cls.get_content_recommendations(user, 1, fetch_size, sort_by, filters), 0.5),
-            ("collaborative", cls.get_collaborative_recommendations(user, 1, fetch_size, filters), 0.3),
-            ("popular", cls.get_popular_recommendations(user, 1, fetch_size, filters), 0.2),
-        ]
-
-        merged = {}
-        for source_name, items, weight in sources:
-            for item in items:
-                recipe_id = str(item.get("id"))
-                if not recipe_id:
-                    continue
-                bucket = merged.setdefault(recipe_id, dict(item))
-                score = float(item.get("score", item.get("match_score", 0)) or 0)
-                bucket.setdefault("score_breakdown", {})
-                bucket["score_breakdown"][source_name] = score
-                bucket["score"] = round(float(bucket.get("score", 0) or 0) + score * weight, 2)
-                bucket["recommend_type"] = "hybrid"
-                bucket["algorithm_label"] = cls.STRATEGY_LABELS["hybrid"]
-                if not bucket.get("match_reason"):
-                    bucket["match_reason"] = "综合热门度、相似用户行为与冰箱食材匹配"
-
-        ranked = sorted(merged.values(), key=lambda item: item.get("score", 0), reverse=True)
+        ranked = HybridScoringEngine.rank(
+            user,
+            base_query=cls._recipe_filter_query(filters),
+            filters=filters,
+            collaborative_scores=ItemSimilarityIndex.get_user_scores(user.id),
+            popular_scores=PopularityBoard.score_map(HybridScoringEngine.CANDIDATE_LIMIT),
+        )
+        if not ranked:
+            fallback = cls._fallback_recipes(filters, limit=max(page * page_size, page_size))
+            recency_scores = {str(recipe.id): len(fallback) - index for index, recipe in enumerate(fallback)}
+            ranked = HybridScoringEngine.score_candidates(fallback, set(), set(), {}, recency_scores)
         if not ranked:
             return cls._demo_recommendation_items(page, page_size, "hybrid", filters)
         start = max(page - 1, 0) * page_size
         return ranked[start : start + page_size]
 
     @classmethod
-    def _build_user_recipe_behavior_map(cls):
-        behavior_map = defaultdict(set)
-        pref_rows = UserPreference.objects.filter(
-            target_type="recipe", action__in=["like", "save"]
-        ).values_list("user_id", "target_id")
-        for user_id, target_id in pref_rows:
-            behavior_map[user_id].add(str(target_id))
-
-        intake_rows = (
-            DailyIntake.objects.filter(source_type=1)
-            .exclude(source_id__isnull=True)
-            .exclude(source_id="")
-            .values_list("user_id", "source_id")
-        )
-        for user_id, source_id in intake_rows:
-            behavior_map[user_id].add(str(source_id))
-        return behavior_map
+    def _hydrate_entries(cls, user, entries):
+        """Rebuild full items for cached ranking entries with one batched fetch."""
+        valid_ids = [ObjectId(entry["id"]) for entry in entries if ObjectId.is_valid(str(entry["id"]))]
+        if not valid_ids:
+            return []
+        try:
+            recipe_map = {str(recipe.id): recipe for recipe in Recipe.objects(id__in=valid_ids)}
+        except Exception:
+            return []
+        fridge = PantrySelector.get_user_ingredients_set(user) if any(entry["fridge"] for entry in entries) else set()
+
+        items = []
+        for entry in entries:
+            recipe = recipe_map.get(entry["id"])
+            if recipe is None:
+                continue
+            item = cls._recipe_to_item(
+                recipe,
+                recommend_type=entry["recommend_type"],
+                score=entry["score"],
+                match_reason=entry["match_reason"],
+                score_breakdown=entry["score_breakdown"],
+            )
+            item["match_score"] = entry["match_score"]
+            item["algorithm_label"] = entry["algorithm_label"]
+            if entry["fridge"]:
+                raw_ings = [name for name in getattr(recipe, "ingredients_search", None) or [] if name]
+                item["ingredients"] = [
+                    {"name": name, "in_fridge": normalize_ingredient_name(name) in fridge}
+                    for name in raw_ings
+                ]
+                item["missing_ingredients"] = list({normalize_ingredient_name(name) for name in raw_ings} - fridge)
+            items.append(item)
+        return items
 
     @staticmethod
     def _prepare_filters(user, filters):
@@ -215,26 +275,6 @@ class RecommendationService:
         prepared["exclude_ids"] = list(dict.fromkeys(str(item) for item in exclude_ids if item))
         return prepared
 
-    @staticmethod
-    def _compute_collaborative_scores(user_id, behavior_map):
-        own_items = behavior_map.get(user_id, set())
-        if not own_items:
-            return {}
-
-        scores = defaultdict(float)
-        for other_user_id, other_items in behavior_map.items():
-            if other_user_id == user_id or not other_items:
-                continue
-            union = own_items | other_items
-            if not union:
-                continue
-            similarity = len(own_items & other_items) / len(union)
-            if similarity <= 0:
-                continue
-            for recipe_id in other_items - own_items:
-                scores[recipe_id] += similarity
-        return dict(scores)
-
     @classmethod
     def _fetch_recipes_by_ids(cls, recipe_ids, filters):
         valid_ids = [ObjectId(rid) for rid in recipe_ids if ObjectId.is_valid(str(rid))]
@@ -345,7 +385,7 @@ class RecommendationService:
         if tags:
             query &= Q(keywords__in=tags)
         if filters.get("keyword"):
-            query &= Q(name__icontains=filters["keyword"])
+            query &= RecipeSearchIndex.keyword_query(filters["keyword"], filters)
         if filters.get("difficulty"):
             query &= Q(difficulty=filters["difficulty"])
         calorie_min = RecommendationService._safe_int(filters.get("calorie_min"))
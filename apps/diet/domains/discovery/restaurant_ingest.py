@@ -0,0 +1,131 @@
+import datetime
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from apps.common.utils import search_tokens
+from apps.diet.domains.discovery.health_classifier import HealthClassifier
+from apps.diet.models.mongo.restaurant import Restaurant
+
+
+logger = logging.getLogger(__name__)
+
+
+def _to_float(value, default):
+    # 高德缺省字段常返回空列表或空串
+    try:
+        return float(value) if value not in (None, "", []) else default
+    except (TypeError, ValueError):
+        return default
+
+
+def _coordinates(location):
+    if isinstance(location, dict):
+        location = location.get("coordinates")
+    if isinstance(location, str):
+        location = location.split(",")
+    lng, lat = (float(part) for part in location)
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        raise ValueError("coordinates out of range")
+    return [lng, lat]
+
+
+class RestaurantIngestor:
+    """Bulk upsert of restaurant POIs keyed by ``amap_id``.
+
+    Accepts raw AMap place POIs (``id``, ``"lng,lat"`` location, ``biz_ext``)
+    as well as already flattened dumps (``amap_id``, ``[lng, lat]`` or GeoJSON
+    location, top-level ``rating``/``cost``). A batch is normalized, de-duplicated
+    and written with one unordered ``bulk_write``; AMap-owned fields are
+    refreshed while curated ones such as ``menu`` are only set on insert.
+    The health classification is computed here as well, so bulk writes that
+    bypass ``Restaurant.clean`` still store it; POIs without a menu are
+    classified against the menu already stored for them.
+    """
+
+    @staticmethod
+    def normalize(poi):
+        """Flatten a POI into Restaurant collection fields, or None if it is unusable."""
+        amap_id = str(poi.get("amap_id") or poi.get("id") or "").strip()
+        name = str(poi.get("name") or "").strip()
+        if not amap_id or not name:
+            return None
+        try:
+            coordinates = _coordinates(poi.get("location"))
+        except (TypeError, ValueError):
+            return None
+
+        biz_ext = poi.get("biz_ext") if isinstance(poi.get("biz_ext"), dict) else {}
+        photos = [
+            item.get("url") if isinstance(item, dict) else item
+            for item in poi.get("photos") or []
+        ]
+        doc = {
+            "amap_id": amap_id,
+            "name": name,
+            "location": {"type": "Point", "coordinates": coordinates},
+            "type": str(poi.get("type") or ""),
+            "address": poi.get("address") if isinstance(poi.get("address"), str) else "",
+            "rating": _to_float(poi.get("rating", biz_ext.get("rating")), 4.0),
+            "cost": _to_float(poi.get("cost", biz_ext.get("cost")), 0.0),
+            "photos": [url for url in photos if isinstance(url, str) and url],
+            "search_tokens": sorted(set(search_tokens(name))),
+            "cached_at": datetime.datetime.now(),
+        }
+        if isinstance(poi.get("menu"), list):
+            doc["menu"] = [item for item in poi["menu"] if isinstance(item, dict)]
+        doc.update(HealthClassifier.classify(doc["type"], name, doc.get("menu")))
+        return doc
+
+    @classmethod
+    def upsert(cls, pois):
+        """Normalize and upsert a batch; returns the stats and the normalized documents."""
+        docs = {}
+        skipped = 0
+        for poi in pois:
+            doc = cls.normalize(poi) if isinstance(poi, dict) else None
+            if doc is None:
+                skipped += 1
+                continue
+            # 同批次重复的 amap_id 只保留最后一条，避免并发 upsert 触发唯一索引冲突
+            docs[doc["amap_id"]] = doc
+
+        stats = {"inserted": 0, "updated": 0, "skipped": skipped, "failed": 0}
+        if not docs:
+            return stats, []
+
+        cls._classify_with_stored_menus(docs)
+        operations = [UpdateOne({"amap_id": amap_id}, cls._update(doc), upsert=True) for amap_id, doc in docs.items()]
+        try:
+            result = Restaurant._get_collection().bulk_write(operations, ordered=False)
+            stats["inserted"] = result.upserted_count
+            stats["updated"] = result.matched_count
+        except BulkWriteError as exc:
+            details = exc.details or {}
+            stats["inserted"] = details.get("nUpserted", 0)
+            stats["updated"] = details.get("nMatched", 0)
+            stats["failed"] = len(details.get("writeErrors", []))
+            logger.warning("Restaurant bulk upsert had %d write errors", stats["failed"])
+        return stats, list(docs.values())
+
+    @staticmethod
+    def _classify_with_stored_menus(docs):
+        """Re-classify POIs without a menu against the menu already stored for them (one query per batch)."""
+        without_menu = [amap_id for amap_id, doc in docs.items() if "menu" not in doc]
+        if not without_menu:
+            return
+        stored = Restaurant._get_collection().find({"amap_id": {"$in": without_menu}}, {"amap_id": 1, "menu": 1})
+        for row in stored:
+            menu = row.get("menu") or []
+            if menu:
+                doc = docs[row["amap_id"]]
+                doc.update(HealthClassifier.classify(doc["type"], doc["name"], menu))
+
+    @staticmethod
+    def _update(doc):
+        fields = {k: v for k, v in doc.items() if k != "amap_id"}
+        if "menu" in fields:
+            return {"$set": fields}
+        # 未携带菜单时不覆盖人工维护的菜单；分级已按库中菜单重算，随店名/分类一并刷新
+        return {"$set": fields, "$setOnInsert": {"menu": []}}
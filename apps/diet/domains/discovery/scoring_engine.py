@@ -0,0 +1,138 @@
+import logging
+
+from bson import ObjectId
+from mongoengine.queryset.visitor import Q
+
+from apps.common.utils import normalize_ingredient_name
+from apps.diet.domains.discovery.ingredient_index import IngredientIndex
+from apps.diet.domains.pantry.selectors import PantrySelector
+from apps.diet.models import Recipe
+
+
+logger = logging.getLogger(__name__)
+
+
+class HybridScoringEngine:
+    """Single-pass scorer for hybrid recommendations.
+
+    The candidate pool (the global best fridge matches from the ingredient
+    index plus the top collaborative and popular ids) is loaded once with a
+    narrow projection, then the content, collaborative and popular signals and
+    their weighted blend are computed in one loop. The pool size is fixed, so
+    the cost of a request no longer grows with the requested page.
+    """
+
+    WEIGHTS = {"content": 0.5, "collaborative": 0.3, "popular": 0.2}
+    CANDIDATE_LIMIT = 400
+    SIGNAL_ID_LIMIT = 200
+    PROJECTION = (
+        "id",
+        "name",
+        "ingredients_search",
+        "keywords",
+        "calories",
+        "cooking_time",
+        "difficulty",
+        "image_url",
+    )
+
+    @classmethod
+    def rank(cls, user, base_query, filters, collaborative_scores, popular_scores):
+        """Rank the whole candidate pool for one user; callers slice pages from it."""
+        fridge = PantrySelector.get_user_ingredients_set(user)
+        priority = PantrySelector.get_priority_ingredients(
+            user, filters.get("cleanup_mode", False), filters.get("scrap_mode", False)
+        )
+        recipes = cls._load_candidates(base_query, filters, fridge, priority, collaborative_scores, popular_scores)
+        return cls.score_candidates(recipes, fridge, priority, collaborative_scores, popular_scores)
+
+    @classmethod
+    def _load_candidates(cls, base_query, filters, fridge, priority, collaborative_scores, popular_scores):
+        signal_ids = []
+        for score_map in (collaborative_scores, popular_scores):
+            ranked = sorted(score_map.items(), key=lambda kv: kv[1], reverse=True)[: cls.SIGNAL_ID_LIMIT]
+            signal_ids.extend(ObjectId(rid) for rid, _ in ranked if ObjectId.is_valid(str(rid)))
+
+        recipes = {}
+        try:
+            if signal_ids:
+                for recipe in Recipe.objects(base_query & Q(id__in=signal_ids)).only(*cls.PROJECTION):
+                    recipes[str(recipe.id)] = recipe
+            remaining = max(cls.CANDIDATE_LIMIT - len(recipes), 0)
+            if (priority or fridge) and remaining:
+                ranked = IngredientIndex.search(fridge, priority, limit=cls.CANDIDATE_LIMIT, filters=filters)
+                if ranked is not None:
+                    content_ids = [ObjectId(rid) for rid, _, _ in ranked if rid not in recipes][:remaining]
+                    content_query = base_query & Q(id__in=content_ids)
+                else:
+                    content_query = base_query & Q(ingredients_search__in=list(priority or fridge))
+                    if recipes:
+                        content_query &= Q(id__nin=[recipe.id for recipe in recipes.values()])
+                for recipe in Recipe.objects(content_query).only(*cls.PROJECTION).limit(remaining):
+                    recipes[str(recipe.id)] = recipe
+        except Exception:
+            # 降级为已加载的候选，但保留堆栈以便排查 Mongo 故障
+            logger.exception("Failed to load recommendation candidates")
+        return list(recipes.values())
+
+    @classmethod
+    def score_candidates(cls, recipes, fridge, priority, collaborative_scores, popular_scores):
+        collaborative_max = max(collaborative_scores.values(), default=0) or 1
+        popular_max = max(popular_scores.values(), default=0) or 1
+
+        items = []
+        for recipe in recipes:
+            recipe_id = str(recipe.id)
+            raw_ings = [name for name in (getattr(recipe, "ingredients_search", None) or []) if name]
+            std_ings = {normalize_ingredient_name(name) for name in raw_ings}
+            matched = fridge & std_ings
+            content = int(len(matched) / len(std_ings) * 100) if std_ings else 0
+            priority_hit = bool(priority and priority & std_ings)
+            if priority_hit:
+                content = min(100, content + 20)
+
+            signals = {
+                "content": float(content),
+                "collaborative": round(collaborative_scores.get(recipe_id, 0) / collaborative_max * 100, 1),
+                "popular": round(popular_scores.get(recipe_id, 0) / popular_max * 100, 1),
+            }
+            score = round(sum(signals[name] * weight for name, weight in cls.WEIGHTS.items()), 2)
+            if score <= 0:
+                continue
+            missing = std_ings - fridge
+            items.append({
+                "id": recipe_id,
+                "name": recipe.name,
+                "match_score": int(round(score)),
+                "missing_ingredients": list(missing),
+                "cooking_time": getattr(recipe, "cooking_time", 15),
+                "difficulty": getattr(recipe, "difficulty", "简单"),
+                "calories": getattr(recipe, "calories", 350),
+                "image": getattr(recipe, "image_url", ""),
+                "ingredients": [
+                    {"name": name, "in_fridge": normalize_ingredient_name(name) in fridge}
+                    for name in raw_ings
+                ],
+                "match_reason": cls._match_reason(signals, priority_hit, len(missing)),
+                "tags": (getattr(recipe, "keywords", None) or [])[:3],
+                "recommend_type": "hybrid",
+                "algorithm_label": "混合推荐",
+                "score": score,
+                "score_breakdown": {name: value for name, value in signals.items() if value > 0},
+            })
+
+        items.sort(key=lambda item: item["score"], reverse=True)
+        return items
+
+    @classmethod
+    def _match_reason(cls, signals, priority_hit, missing_count):
+        if priority_hit:
+            return "消耗临期/边角料"
+        if signals["content"] >= 80:
+            return f"匹配度高，缺{missing_count}样"
+        dominant = max(cls.WEIGHTS, key=lambda name: signals[name] * cls.WEIGHTS[name])
+        if dominant == "collaborative":
+            return "相似用户也喜欢"
+        if dominant == "popular":
+            return "近期收藏、保存或记录较多"
+        return "综合热门度、相似用户行为与冰箱食材匹配"
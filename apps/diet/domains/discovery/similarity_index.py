@@ -0,0 +1,370 @@
+import heapq
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from apps.common.redis import get_redis
+from apps.diet.models import DailyIntake, UserPreference
+
+
+logger = logging.getLogger(__name__)
+
+
+class ItemSimilarityIndex:
+    """Precomputed item-item co-occurrence index for collaborative filtering.
+
+    Every recipe keeps the number of users who interacted with it and its
+    co-occurrence counts with other recipes. Serving a user only reads the
+    entries of that user's own recipes, so the cost no longer grows with the
+    total number of users. Entries live in Redis (one hash of neighbour
+    counts per recipe) or, without Redis, in Django's cache, under a
+    versioned prefix so a full rebuild never mixes with a half-written
+    previous generation. Requests never build the index themselves: a cold
+    index returns no scores and starts one background build.
+
+    Interactions are queued once their transaction commits and applied by a
+    per-process worker, so likes and intake logs never wait on the index.
+    On Redis every pair is bumped with HINCRBY, so workers in different
+    processes never overwrite each other's counts.
+    """
+
+    KEY_PREFIX = "diet_cf_index"
+    META_KEY = f"{KEY_PREFIX}:meta"
+    BUILD_LOCK_KEY = f"{KEY_PREFIX}:build_lock"
+    BUILD_LOCK_TIMEOUT = 600
+    MAX_NEIGHBOURS = 200
+    NEIGHBOURS_PER_ITEM = 50
+    HISTORY_LIMIT = 50
+    WRITE_CHUNK = 500
+    _queue = queue.Queue()
+    _worker_pid = None
+    _worker_lock = threading.Lock()
+    _local_lock = threading.Lock()
+
+    @staticmethod
+    def _timeout():
+        return getattr(settings, "RECOMMENDATION_INDEX_TTL", 7 * 24 * 3600)
+
+    @classmethod
+    def _item_key(cls, version, recipe_id):
+        return f"{cls.KEY_PREFIX}:{version}:co:{recipe_id}"
+
+    @classmethod
+    def _count_key(cls, version, recipe_id):
+        return f"{cls.KEY_PREFIX}:{version}:n:{recipe_id}"
+
+    @staticmethod
+    def _text(value):
+        return value.decode() if isinstance(value, bytes) else str(value)
+
+    @classmethod
+    def load_behavior_map(cls):
+        """Full scan of recipe likes/saves and recipe intake logs, per user."""
+        behavior_map = defaultdict(set)
+        pref_rows = UserPreference.objects.filter(
+            target_type="recipe", action__in=["like", "save"]
+        ).values_list("user_id", "target_id")
+        for user_id, target_id in pref_rows:
+            behavior_map[user_id].add(str(target_id))
+
+        intake_rows = (
+            DailyIntake.objects.filter(source_type=1)
+            .exclude(source_id__isnull=True)
+            .exclude(source_id="")
+            .values_list("user_id", "source_id")
+        )
+        for user_id, source_id in intake_rows:
+            behavior_map[user_id].add(str(source_id))
+        return behavior_map
+
+    @classmethod
+    def build(cls, behavior_map=None):
+        """Rebuild the whole index and switch readers to the new generation."""
+        if behavior_map is None:
+            behavior_map = cls.load_behavior_map()
+
+        counts = Counter()
+        co_counts = defaultdict(Counter)
+        for items in behavior_map.values():
+            items = list(items)
+            counts.update(items)
+            for recipe_id in items:
+                neighbours = co_counts[recipe_id]
+                for other_id in items:
+                    if other_id != recipe_id:
+                        neighbours[other_id] += 1
+
+        version = int(time.time() * 1000)
+        timeout = cls._timeout()
+        r = get_redis()
+        if r is not None:
+            pipe = r.pipeline(transaction=False)
+            for written, (recipe_id, total) in enumerate(counts.items(), 1):
+                pipe.set(cls._count_key(version, recipe_id), total, ex=timeout)
+                neighbours = dict(co_counts[recipe_id].most_common(cls.MAX_NEIGHBOURS))
+                if neighbours:
+                    pipe.hset(cls._item_key(version, recipe_id), mapping=neighbours)
+                    pipe.expire(cls._item_key(version, recipe_id), timeout)
+                if written % cls.WRITE_CHUNK == 0:
+                    pipe.execute()
+            pipe.execute()
+        else:
+            payload = {}
+            for recipe_id, total in counts.items():
+                payload[cls._count_key(version, recipe_id)] = total
+                payload[cls._item_key(version, recipe_id)] = dict(
+                    co_counts[recipe_id].most_common(cls.MAX_NEIGHBOURS)
+                )
+                if len(payload) >= cls.WRITE_CHUNK:
+                    cache.set_many(payload, timeout=timeout)
+                    payload = {}
+            if payload:
+                cache.set_many(payload, timeout=timeout)
+
+        meta = {"version": version, "items": len(counts), "users": len(behavior_map), "built_at": time.time()}
+        cache.set(cls.META_KEY, meta, timeout=timeout)
+        return meta
+
+    @classmethod
+    def _current_version(cls):
+        meta = cache.get(cls.META_KEY)
+        return meta["version"] if meta else None
+
+    @classmethod
+    def build_in_background(cls):
+        """Start one background build unless another process is already building."""
+        if not cache.add(cls.BUILD_LOCK_KEY, 1, timeout=cls.BUILD_LOCK_TIMEOUT):
+            return False
+
+        def run():
+            try:
+                cls.build()
+            except Exception as exc:
+                logger.warning("Similarity index build failed: %s", exc)
+            finally:
+                cache.delete(cls.BUILD_LOCK_KEY)
+                connection.close()
+
+        threading.Thread(target=run, name="similarity-index-build", daemon=True).start()
+        return True
+
+    @staticmethod
+    def _user_history(user_id):
+        """The user's own recipe ids, most recent first and de-duplicated."""
+        pref_ids = UserPreference.objects.filter(
+            user_id=user_id, target_type="recipe", action__in=["like", "save"]
+        ).order_by("-created_at").values_list("target_id", flat=True)
+        intake_ids = (
+            DailyIntake.objects.filter(user_id=user_id, source_type=1)
+            .exclude(source_id__isnull=True)
+            .exclude(source_id="")
+            .order_by("-record_date", "-id")
+            .values_list("source_id", flat=True)
+        )
+        return list(dict.fromkeys(str(rid) for rid in list(pref_ids) + list(intake_ids) if rid))
+
+    @classmethod
+    def _load_entries(cls, version, recipe_ids):
+        """``{recipe_id: {neighbour_id: co_count}}`` for ``recipe_ids``."""
+        r = get_redis()
+        if r is not None:
+            pipe = r.pipeline(transaction=False)
+            for recipe_id in recipe_ids:
+                pipe.hgetall(cls._item_key(version, recipe_id))
+            return {
+                recipe_id: {cls._text(other_id): int(value) for other_id, value in (entry or {}).items()}
+                for recipe_id, entry in zip(recipe_ids, pipe.execute())
+            }
+        entries = cache.get_many([cls._item_key(version, rid) for rid in recipe_ids])
+        return {rid: entries.get(cls._item_key(version, rid)) or {} for rid in recipe_ids}
+
+    @classmethod
+    def _load_counts(cls, version, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        r = get_redis()
+        if r is not None:
+            values = r.mget([cls._count_key(version, rid) for rid in recipe_ids])
+            return {rid: int(value) for rid, value in zip(recipe_ids, values) if value is not None}
+        count_keys = {cls._count_key(version, rid): rid for rid in recipe_ids}
+        return {count_keys[key]: value for key, value in cache.get_many(list(count_keys)).items()}
+
+    @classmethod
+    def get_user_scores(cls, user_id):
+        """Score unseen recipes for one user from their own history's neighbours."""
+        version = cls._current_version()
+        if version is None:
+            # 冷启动：本次请求降级为无协同分，由后台线程构建索引
+            cls.build_in_background()
+            return {}
+        history = cls._user_history(user_id)
+        if not history:
+            return {}
+
+        lookup_ids = history[: cls.HISTORY_LIMIT]
+        entries = cls._load_entries(version, lookup_ids)
+        neighbour_map = {
+            recipe_id: heapq.nlargest(cls.NEIGHBOURS_PER_ITEM, entries[recipe_id].items(), key=lambda kv: kv[1])
+            for recipe_id in lookup_ids
+        }
+
+        owned = set(history)
+        candidate_ids = {rid for pairs in neighbour_map.values() for rid, _ in pairs} - owned
+        if not candidate_ids:
+            return {}
+        counts = cls._load_counts(version, set(lookup_ids) | candidate_ids)
+        return cls._score_neighbours(neighbour_map, counts, owned)
+
+    @staticmethod
+    def _score_neighbours(neighbour_map, counts, owned):
+        """Cosine-normalised co-occurrence: co(i, j) / sqrt(n_i * n_j)."""
+        scores = defaultdict(float)
+        for recipe_id, neighbours in neighbour_map.items():
+            own_count = counts.get(recipe_id) or 0
+            for other_id, co_count in neighbours:
+                other_count = counts.get(other_id) or 0
+                # Redis 上的增量计数可能暂时减到 0 以下，下次全量构建时清理
+                if other_id in owned or co_count <= 0 or own_count <= 0 or other_count <= 0:
+                    continue
+                scores[other_id] += co_count / math.sqrt(own_count * other_count)
+        return dict(scores)
+
+    @classmethod
+    def record_interaction(cls, user_id, recipe_id, added=True):
+        """Queue one user gaining (or losing) a recipe once the current transaction commits."""
+        recipe_id = str(recipe_id or "")
+        if not recipe_id:
+            return
+        event = (user_id, recipe_id, added)
+        transaction.on_commit(lambda: cls._enqueue(event))
+
+    @classmethod
+    def _enqueue(cls, event):
+        if not getattr(settings, "RECOMMENDATION_INDEX_WORKER", True):
+            cls._process(*event)
+            return
+        cls._queue.put(event)
+        cls.ensure_worker()
+
+    @classmethod
+    def ensure_worker(cls):
+        """Start the per-process update thread (again after a fork)."""
+        if cls._worker_pid == os.getpid():
+            return
+        with cls._worker_lock:
+            if cls._worker_pid == os.getpid():
+                return
+
+            def run():
+                while True:
+                    event = cls._queue.get()
+                    cls._process(*event)
+                    if cls._queue.empty():
+                        connection.close()
+
+            threading.Thread(target=run, name="similarity-index-update", daemon=True).start()
+            cls._worker_pid = os.getpid()
+
+    @classmethod
+    def drain(cls):
+        """Apply every queued interaction in the calling thread; returns how many were applied."""
+        applied = 0
+        while True:
+            try:
+                event = cls._queue.get_nowait()
+            except queue.Empty:
+                return applied
+            cls._process(*event)
+            applied += 1
+
+    @classmethod
+    def _process(cls, user_id, recipe_id, added):
+        """Apply one committed interaction.
+
+        Rows that are not the first (or last) evidence of the user-recipe
+        pair leave the index untouched.
+        """
+        try:
+            version = cls._current_version()
+            if version is None:
+                return
+            if added and cls._evidence_count(user_id, recipe_id) != 1:
+                return
+            history = cls._user_history(user_id)
+            if not added and recipe_id in history:
+                return
+            cls._apply_delta(version, recipe_id, [rid for rid in history if rid != recipe_id], 1 if added else -1)
+        except Exception as exc:
+            logger.warning("Similarity index update failed for user %s recipe %s: %s", user_id, recipe_id, exc)
+
+    @staticmethod
+    def _evidence_count(user_id, recipe_id):
+        return (
+            UserPreference.objects.filter(
+                user_id=user_id, target_type="recipe", action__in=["like", "save"], target_id=recipe_id
+            ).count()
+            + DailyIntake.objects.filter(user_id=user_id, source_type=1, source_id=recipe_id).count()
+        )
+
+    @classmethod
+    def _apply_delta(cls, version, recipe_id, others, delta):
+        r = get_redis()
+        if r is None:
+            # 本地缓存仅在进程内共享，进程锁即可串行化读-改-写
+            with cls._local_lock:
+                cls._write_delta(version, recipe_id, others, delta)
+            return
+        # 每个计数单独 INCRBY/HINCRBY，跨进程并发也不会互相覆盖；邻居上限在下次全量构建时收敛
+        timeout = cls._timeout()
+        count_key = cls._count_key(version, recipe_id)
+        own_key = cls._item_key(version, recipe_id)
+        pipe = r.pipeline(transaction=False)
+        pipe.incrby(count_key, delta)
+        pipe.expire(count_key, timeout)
+        for other_id in others:
+            other_key = cls._item_key(version, other_id)
+            pipe.hincrby(own_key, other_id, delta)
+            pipe.hincrby(other_key, recipe_id, delta)
+            pipe.expire(other_key, timeout)
+        if others:
+            pipe.expire(own_key, timeout)
+        pipe.execute()
+
+    @classmethod
+    def _write_delta(cls, version, recipe_id, others, delta):
+        item_keys = [cls._item_key(version, rid) for rid in [recipe_id, *others]]
+        count_key = cls._count_key(version, recipe_id)
+        current = cache.get_many(item_keys + [count_key])
+
+        updates = {count_key: max(int(current.get(count_key) or 0) + delta, 0)}
+        own_key = cls._item_key(version, recipe_id)
+        own_entry = dict(current.get(own_key) or {})
+        for other_id in others:
+            other_key = cls._item_key(version, other_id)
+            other_entry = dict(updates.get(other_key) or current.get(other_key) or {})
+            cls._bump(own_entry, other_id, delta)
+            cls._bump(other_entry, recipe_id, delta)
+            updates[other_key] = cls._trim(other_entry)
+        updates[own_key] = cls._trim(own_entry)
+        cache.set_many(updates, timeout=cls._timeout())
+
+    @staticmethod
+    def _bump(entry, recipe_id, delta):
+        value = entry.get(recipe_id, 0) + delta
+        if value > 0:
+            entry[recipe_id] = value
+        else:
+            entry.pop(recipe_id, None)
+
+    @classmethod
+    def _trim(cls, entry):
+        if len(entry) <= cls.MAX_NEIGHBOURS:
+            return entry
+        return dict(heapq.nlargest(cls.MAX_NEIGHBOURS, entry.items(), key=lambda kv: kv[1]))
@@ -1,39 +1,86 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
 from apps.diet.models import Recipe
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
+from apps.diet.domains.discovery.recommendation_cache import RecommendationCache
 from apps.diet.domains.discovery.recommendation_service import RecommendationService
 from apps.diet.domains.preferences.selectors import PreferenceSelector
 
 class WheelEngine:
+    POPULAR_CUISINES = ["川菜", "粤菜", "湘菜", "鲁菜", "日式", "西餐", "东北菜", "西北菜"]
+    FLAVOR_FACET_KEY = "diet_wheel:flavors"
+    FLAVOR_FACET_TTL = 24 * 3600
+    CANDIDATE_POOL_KEY = "diet_wheel:pool"
+    CANDIDATE_POOL_SIZE = 60
+    POOL_FIELDS = ("id", "name", "image", "calories", "difficulty", "cooking_time", "recommend_type", "algorithm_label", "score", "match_score")
+
     @staticmethod
     def get_wheel_options(step, cuisine=None, flavor=None, user=None):
-        POPULAR_CUISINES = ["川菜", "粤菜", "湘菜", "鲁菜", "日式", "西餐", "东北菜", "西北菜"]
+        POPULAR_CUISINES = WheelEngine.POPULAR_CUISINES
         
         if step == 1:
             return [{"name": c, "value": c} for c in POPULAR_CUISINES]
             
         elif step == 2:
             if not cuisine: return []
-            pipeline = [
-                {"$match": {"keywords": cuisine}},
-                {"$unwind": "$keywords"},
-                {"$group": {"_id": "$keywords", "count": {"$sum": 1}}},
-                {"$sort": {"count": -1}},
-                {"$limit": 10}
-            ]
-            try:
-                raw_flavors = list(Recipe.objects.aggregate(*pipeline))
-                flavors = []
-                for f in raw_flavors:
-                    name = f['_id']
-                    if name != cuisine and name not in POPULAR_CUISINES:
-                        flavors.append({"name": name, "value": name})
-                return flavors if len(flavors) >= 2 else [{"name": "热门", "value": "热门"}]
-            except Exception:
+            top_keywords = WheelEngine._get_flavor_facets(cuisine)
+            if top_keywords is None:
                 return [{"name": "热门", "value": "热门"}]
+            flavors = []
+            for name in top_keywords:
+                if name != cuisine and name not in POPULAR_CUISINES:
+                    flavors.append({"name": name, "value": name})
+            return flavors if len(flavors) >= 2 else [{"name": "热门", "value": "热门"}]
 
         elif step == 3:
             return WheelEngine._get_smart_candidates(user, cuisine, flavor)
         return []
 
+    @staticmethod
+    def _get_flavor_facets(cuisine):
+        """菜系 -> 共现次数前 10 的关键词；按菜谱库版本缓存，审核/导入后自动重建"""
+        key = f"{WheelEngine.FLAVOR_FACET_KEY}:{RecipeCatalog.version()}"
+        facets = cache.get(key)
+        if facets is None:
+            facets = WheelEngine._aggregate_flavor_facets(WheelEngine.POPULAR_CUISINES)
+            if facets is None:
+                return None
+            cache.set(key, facets, timeout=WheelEngine.FLAVOR_FACET_TTL)
+        if cuisine not in facets:
+            # 非预设菜系单独聚合后并入缓存
+            extra = WheelEngine._aggregate_flavor_facets([cuisine])
+            if extra is None:
+                return None
+            facets[cuisine] = extra.get(cuisine, [])
+            cache.set(key, facets, timeout=WheelEngine.FLAVOR_FACET_TTL)
+        return facets[cuisine]
+
+    @staticmethod
+    def _aggregate_flavor_facets(cuisines):
+        # 一次聚合算出所有菜系的关键词分布，替代每次转盘的 $unwind/$group
+        pipeline = [
+            {"$match": {"keywords": {"$in": cuisines}}},
+            {"$project": {"keywords": 1, "cuisines": {"$setIntersection": ["$keywords", cuisines]}}},
+            {"$unwind": "$cuisines"},
+            {"$unwind": "$keywords"},
+            {"$group": {"_id": {"cuisine": "$cuisines", "keyword": "$keywords"}, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+        ]
+        try:
+            rows = list(Recipe.objects.aggregate(*pipeline))
+        except Exception:
+            return None
+        facets = {cuisine: [] for cuisine in cuisines}
+        for row in rows:
+            top = facets[row["_id"]["cuisine"]]
+            if len(top) < 10:
+                top.append(row["_id"]["keyword"])
+        return facets
+
     @staticmethod
     def _get_smart_candidates(user, cuisine, flavor):
         candidates = []
@@ -55,11 +102,8 @@ class WheelEngine:
         if flavor and flavor not in ["热门", "家常"]:
             tags.append(flavor)
 
-        recommendations = RecommendationService.get_recommendations(
+        recommendations = WheelEngine._get_candidate_pool(
             user,
-            strategy="hybrid",
-            page=1,
-            page_size=60,
             filters={
                 "tags": tags,
                 "exclude_ids": blocked_ids,
@@ -87,6 +131,35 @@ class WheelEngine:
             
         return candidates
 
+    @staticmethod
+    def _get_candidate_pool(user, filters):
+        """同一会话窗口内连续转盘复用候选池；冰箱/偏好变化会让池随推荐缓存一起失效"""
+        user_id = getattr(user, "id", None)
+        generation = RecommendationCache.generation(user_id) if user_id else None
+        key = None
+        if generation is not None:
+            signature = json.dumps(filters, sort_keys=True, ensure_ascii=False, default=str)
+            digest = hashlib.md5(signature.encode("utf-8")).hexdigest()
+            key = f"{WheelEngine.CANDIDATE_POOL_KEY}:{user_id}:{generation}:{digest}"
+            pool = cache.get(key)
+            if pool is not None:
+                return pool
+
+        recommendations = RecommendationService.get_recommendations(
+            user,
+            strategy="hybrid",
+            page=1,
+            page_size=WheelEngine.CANDIDATE_POOL_SIZE,
+            filters=filters,
+        )
+        pool = [
+            {field: item[field] for field in WheelEngine.POOL_FIELDS if field in item}
+            for item in recommendations
+        ]
+        if key:
+            cache.set(key, pool, timeout=getattr(settings, "WHEEL_POOL_TTL", 300))
+        return pool
+
     @staticmethod
     def _pick_ranked_candidates(candidates, seen_ids, pool, count, reason):
         picked = 0
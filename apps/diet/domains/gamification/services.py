@@ -83,7 +83,7 @@ class GamificationService:
                         "score": int(score)
                     })
                 if results:
-                    return results
+                    return GamificationService._attach_user_cards(results)
             except Exception:
                 pass
 
@@ -93,14 +93,22 @@ class GamificationService:
             .annotate(score=Sum('challenge__reward_points'))
             .order_by('-score', 'user_id')[:50]
         )
-        return [
+        return GamificationService._attach_user_cards([
             {
                 "rank": index + 1,
                 "user_id": row['user_id'],
                 "score": int(row['score'] or 0),
             }
             for index, row in enumerate(rows)
-        ]
+        ])
+
+    @staticmethod
+    def _attach_user_cards(rows):
+        from apps.diet.domains.community.user_cards import UserCards
+        cards = UserCards.get_many([row["user_id"] for row in rows])
+        for row in rows:
+            row["user"] = cards[row["user_id"]]
+        return rows
 
 
     @staticmethod
@@ -140,30 +148,10 @@ class GamificationService:
         """
         供其他模块（如 Profile 和 Community）调用
         获取用户个性名片代表徽章 (最多 3 个)，若未设置则兜底最近解锁的徽章
+        读取走用户名片缓存，批量场景请直接使用 UserCards.get_many
         """
-        from apps.diet.models.mysql.gamification import UserFeaturedBadge, UserAchievement
-        
-        # 1. 尝试查询用户主动配置的代表徽章
-        featured = UserFeaturedBadge.objects.filter(user_id=user_id)\
-            .select_related('achievement').order_by('sort_order')[:3]
-        
-        if not featured.exists():
-            # 2. 兜底策略：取最近解锁的 3 个徽章
-            fallback = UserAchievement.objects.filter(user_id=user_id)\
-                .select_related('achievement').order_by('-unlocked_at')[:3]
-            
-            return [{
-                "id": str(item.achievement.id),
-                "name": item.achievement.title,
-                "icon": item.achievement.icon or ""
-            } for item in fallback]
-
-        return [{
-            "id": str(badge.achievement.id),
-            "name": badge.achievement.title,
-            "icon": badge.achievement.icon or ""
-        } for badge in featured]
-    
+        from apps.diet.domains.community.user_cards import UserCards
+        return UserCards.get(user_id)["featured_badges"]
 
     @staticmethod
     def toggle_remedy_favorite(user_id: int, remedy_id: int):
@@ -1,6 +1,7 @@
 from django.db import transaction
 from apps.diet.models import FridgeItem
 from apps.common.utils import normalize_ingredient_name
+from apps.diet.domains.discovery.recommendation_cache import RecommendationCache
 
 class PantryService:
     @staticmethod
@@ -22,6 +23,8 @@ class PantryService:
                     ) for i in items
                 ]
                 FridgeItem.objects.bulk_create(bulk)
+            # bulk_create 不触发 post_save，需手动让推荐缓存失效
+            RecommendationCache.invalidate(user.id)
             return len(bulk)
         return 0
 
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class AIQueueTimeout(RuntimeError):
+    """Raised when a provider key stays saturated longer than AI_QUEUE_TIMEOUT."""
+
+
+class AIExecutor:
+    """Process-wide asyncio runtime for model calls.
+
+    One event loop runs in a daemon thread per process. Every request to a
+    provider key goes through a per-(provider, key) semaphore, so a burst of
+    users queues in the loop instead of opening unbounded upstream
+    connections, and waiters that cannot get a slot in time fail fast.
+    Identical non-streaming requests that are already in flight share one
+    upstream call. Sync views block on ``run``; async views ``await arun``.
+    """
+
+    _loop = None
+    _pid = None
+    _start_lock = threading.Lock()
+    _limiters = {}
+    _inflight = {}
+
+    @staticmethod
+    def _slot_limit():
+        return max(int(getattr(settings, "AI_MAX_CONCURRENCY_PER_KEY", 4)), 1)
+
+    @staticmethod
+    def _queue_timeout():
+        return float(getattr(settings, "AI_QUEUE_TIMEOUT", 15))
+
+    @staticmethod
+    def _call_timeout():
+        return float(getattr(settings, "AI_CALL_TIMEOUT", 120))
+
+    @classmethod
+    def loop(cls):
+        """Start (or re-start after a fork) the background event loop."""
+        if cls._loop is not None and cls._pid == os.getpid():
+            return cls._loop
+        with cls._start_lock:
+            if cls._loop is not None and cls._pid == os.getpid():
+                return cls._loop
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def serve():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            threading.Thread(target=serve, name="ai-executor", daemon=True).start()
+            started.wait()
+            # fork 后子进程继承的信号量与在途任务属于旧事件循环，需一并丢弃
+            cls._limiters = {}
+            cls._inflight = {}
+            cls._pid = os.getpid()
+            cls._loop = loop
+            return loop
+
+    @staticmethod
+    def request_key(task_type, payload):
+        """Stable digest of a request, used to coalesce identical in-flight calls."""
+        signature = json.dumps([task_type, payload], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(signature.encode("utf-8")).hexdigest()
+
+    @classmethod
+    async def limited(cls, slot, factory):
+        """Await ``factory()`` while holding one of the slots of ``slot``."""
+        semaphore = cls._limiters.get(slot)
+        if semaphore is None:
+            semaphore = cls._limiters[slot] = asyncio.Semaphore(cls._slot_limit())
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=cls._queue_timeout())
+        except asyncio.TimeoutError:
+            raise AIQueueTimeout(f"AI slot {slot[0]} saturated") from None
+        try:
+            return await factory()
+        finally:
+            semaphore.release()
+
+    @classmethod
+    async def _coalesced(cls, key, factory):
+        if key is None:
+            return await factory()
+        task = cls._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(factory())
+            cls._inflight[key] = task
+            task.add_done_callback(lambda _: cls._inflight.pop(key, None))
+        else:
+            logger.debug("[AI] 合并相同的在途请求 %s", key[:12])
+        # shield: 单个等待方超时或取消时不影响其它共享该调用的请求
+        return await asyncio.shield(task)
+
+    @classmethod
+    def submit(cls, factory, key=None):
+        """Schedule ``factory()`` on the executor loop; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(cls._coalesced(key, factory), cls.loop())
+
+    @classmethod
+    def run(cls, factory, key=None, timeout=None):
+        """Blocking entry point for sync (WSGI) code."""
+        future = cls.submit(factory, key)
+        try:
+            return future.result(timeout or cls._call_timeout())
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+    @classmethod
+    async def arun(cls, factory, key=None):
+        """Awaitable entry point for async (ASGI) views."""
+        return await asyncio.wrap_future(cls.submit(factory, key))
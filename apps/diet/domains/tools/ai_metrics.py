@@ -0,0 +1,279 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.diet.models import AIMetricBucket
+
+
+logger = logging.getLogger(__name__)
+
+
+class AIMetrics:
+    """Persistent, cross-worker aggregates of AI call metrics.
+
+    ``record`` folds each event into an in-memory aggregate per (time bucket,
+    task, model, source); a per-process background thread flushes the buffer
+    to AIMetricBucket in one transaction every AI_METRICS_FLUSH_INTERVAL
+    seconds, or as soon as AI_METRICS_FLUSH_EVENTS events are pending, so the
+    request path never writes. Latencies are kept as fixed-edge histograms,
+    so buckets from any number of workers can be summed and percentiles
+    estimated from the merged counts. A failed flush rolls back and folds its
+    aggregates into the buffer again, keeping at most
+    AI_METRICS_MAX_BUFFERED_BUCKETS of the newest buckets while the database
+    stays unavailable.
+    """
+
+    SUM_FIELDS = ("count", "success_count", "json_checked", "json_failed", "cache_hits", "total_ms")
+    LATENCY_EDGES_MS = (100, 250, 500, 1000, 2000, 3000, 5000, 8000, 12000, 20000, 30000, 60000)
+    _source = ContextVar("ai_metric_source", default="live")
+    _buffer = {}
+    _pending = 0
+    _last_flush = time.monotonic()
+    _lock = threading.Lock()
+    _wake = threading.Event()
+    _worker_pid = None
+    _worker_lock = threading.Lock()
+
+    @staticmethod
+    def _bucket_seconds():
+        return max(int(getattr(settings, "AI_METRICS_BUCKET_SECONDS", 300)), 60)
+
+    @staticmethod
+    def _flush_events():
+        return max(int(getattr(settings, "AI_METRICS_FLUSH_EVENTS", 50)), 1)
+
+    @staticmethod
+    def _flush_interval():
+        return float(getattr(settings, "AI_METRICS_FLUSH_INTERVAL", 30))
+
+    @staticmethod
+    def _max_buffered():
+        return max(int(getattr(settings, "AI_METRICS_MAX_BUFFERED_BUCKETS", 2000)), 1)
+
+    @staticmethod
+    def _use_worker():
+        return getattr(settings, "AI_METRICS_WORKER", True)
+
+    @classmethod
+    @contextmanager
+    def tagged(cls, source):
+        """Attribute metrics recorded inside the block to ``source`` (e.g. "benchmark")."""
+        token = cls._source.set(source)
+        try:
+            yield
+        finally:
+            cls._source.reset(token)
+
+    @classmethod
+    def _bucket_start(cls, timestamp):
+        size = cls._bucket_seconds()
+        return datetime.fromtimestamp(int(timestamp // size * size), tz=dt_timezone.utc)
+
+    @classmethod
+    def _empty(cls, task_type):
+        return {
+            "task_type": task_type or "",
+            "count": 0,
+            "success_count": 0,
+            "json_checked": 0,
+            "json_failed": 0,
+            "cache_hits": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "histogram": [0] * (len(cls.LATENCY_EDGES_MS) + 1),
+        }
+
+    @classmethod
+    def record(cls, metric):
+        key = (
+            cls._bucket_start(time.time()),
+            metric["task_name"],
+            metric.get("model_name") or "",
+            cls._source.get(),
+        )
+        elapsed = float(metric.get("elapsed_ms") or 0)
+        with cls._lock:
+            agg = cls._buffer.get(key)
+            if agg is None:
+                agg = cls._buffer[key] = cls._empty(metric.get("task_type"))
+            agg["count"] += 1
+            agg["success_count"] += int(bool(metric.get("success")))
+            if metric.get("json_parsed") is not None:
+                agg["json_checked"] += 1
+                agg["json_failed"] += int(not metric["json_parsed"])
+            agg["cache_hits"] += int(bool(metric.get("cache_hit")))
+            agg["total_ms"] += elapsed
+            agg["max_ms"] = max(agg["max_ms"], elapsed)
+            agg["histogram"][bisect_left(cls.LATENCY_EDGES_MS, elapsed)] += 1
+            cls._pending += 1
+            full = cls._pending >= cls._flush_events()
+            due = full or time.monotonic() - cls._last_flush >= cls._flush_interval()
+        if cls._use_worker():
+            cls.ensure_worker()
+            if full:
+                # 缓冲已满：唤醒回写线程提前刷新，请求线程不写库
+                cls._wake.set()
+        elif due:
+            cls.flush()
+
+    @classmethod
+    def ensure_worker(cls):
+        """Start the per-process flush thread (again after a fork)."""
+        if cls._worker_pid == os.getpid():
+            return
+        with cls._worker_lock:
+            if cls._worker_pid == os.getpid():
+                return
+
+            def run():
+                while True:
+                    cls._wake.wait(cls._flush_interval())
+                    cls._wake.clear()
+                    try:
+                        cls.flush()
+                    except Exception as exc:
+                        logger.warning("AI metrics flush failed: %s", exc)
+
+            threading.Thread(target=run, name="ai-metrics-flush", daemon=True).start()
+            cls._worker_pid = os.getpid()
+
+    @classmethod
+    def flush_at_exit(cls):
+        """Flush what the worker of this process has buffered; registered in DietConfig.ready()."""
+        if cls._worker_pid != os.getpid():
+            return
+        try:
+            cls.flush()
+        except Exception as exc:
+            logger.warning("AI metrics flush at exit failed: %s", exc)
+
+    @classmethod
+    def flush(cls):
+        """Write buffered aggregates; returns the number of bucket rows touched."""
+        with cls._lock:
+            buffer, cls._buffer = cls._buffer, {}
+            cls._pending = 0
+            cls._last_flush = time.monotonic()
+        if not buffer:
+            return 0
+        try:
+            with transaction.atomic():
+                for (bucket_start, task_name, model_name, source), agg in buffer.items():
+                    row, _ = AIMetricBucket.objects.select_for_update().get_or_create(
+                        bucket_start=bucket_start,
+                        task_name=task_name,
+                        model_name=model_name,
+                        source=source,
+                        defaults={"task_type": agg["task_type"]},
+                    )
+                    for field in cls.SUM_FIELDS:
+                        setattr(row, field, getattr(row, field) + agg[field])
+                    row.max_ms = max(row.max_ms, agg["max_ms"])
+                    row.histogram = cls._merge(row.histogram, agg["histogram"])
+                    row.save()
+        except Exception as exc:
+            logger.warning("AI metrics flush failed, %d buckets kept for retry: %s", len(buffer), exc)
+            cls._restore(buffer)
+            return 0
+        return len(buffer)
+
+    @classmethod
+    def _restore(cls, buffer):
+        # 事务已整体回滚，放回缓冲区不会重复计数；不计入 _pending，按刷新间隔重试
+        with cls._lock:
+            for key, agg in buffer.items():
+                current = cls._buffer.get(key)
+                if current is None:
+                    cls._buffer[key] = agg
+                    continue
+                for field in cls.SUM_FIELDS:
+                    current[field] += agg[field]
+                current["max_ms"] = max(current["max_ms"], agg["max_ms"])
+                current["histogram"] = cls._merge(current["histogram"], agg["histogram"])
+            # 数据库持续不可用时缓冲不能无限增长：只保留最新的若干个桶
+            overflow = len(cls._buffer) - cls._max_buffered()
+            if overflow > 0:
+                for key in sorted(cls._buffer, key=lambda item: item[0])[:overflow]:
+                    del cls._buffer[key]
+        if overflow > 0:
+            logger.warning("AI metrics buffer full, dropped %d oldest buckets", overflow)
+
+    @classmethod
+    def _merge(cls, left, right):
+        size = len(cls.LATENCY_EDGES_MS) + 1
+        left = list(left or []) + [0] * (size - len(left or []))
+        return [a + b for a, b in zip(left, right)]
+
+    @classmethod
+    def percentile(cls, histogram, max_ms, q):
+        """Estimate the ``q`` quantile (0..1) by interpolating inside the histogram bucket."""
+        total = sum(histogram)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(histogram):
+            if count and seen + count >= rank:
+                lower = cls.LATENCY_EDGES_MS[index - 1] if index else 0
+                upper = cls.LATENCY_EDGES_MS[index] if index < len(cls.LATENCY_EDGES_MS) else max_ms
+                upper = min(upper, max_ms) if max_ms else upper
+                lower = min(lower, upper)
+                return round(lower + (upper - lower) * (rank - seen) / count, 1)
+            seen += count
+        return round(max_ms, 1)
+
+    @classmethod
+    def summary(cls, since, until=None, source=None, task_name=None, model_name=None):
+        """Per (task_name, model) latency percentiles, histogram and rates since ``since``."""
+        rows = AIMetricBucket.objects.filter(bucket_start__gte=cls._bucket_start(since.timestamp()))
+        if until is not None:
+            rows = rows.filter(bucket_start__lt=until)
+        if source:
+            rows = rows.filter(source=source)
+        if task_name:
+            rows = rows.filter(task_name=task_name)
+        if model_name:
+            rows = rows.filter(model_name=model_name)
+
+        grouped = {}
+        for row in rows.order_by("bucket_start"):
+            agg = grouped.get((row.task_name, row.model_name))
+            if agg is None:
+                agg = grouped[(row.task_name, row.model_name)] = cls._empty(row.task_type)
+            for field in cls.SUM_FIELDS:
+                agg[field] += getattr(row, field)
+            agg["max_ms"] = max(agg["max_ms"], row.max_ms)
+            agg["histogram"] = cls._merge(row.histogram, agg["histogram"])
+
+        result = []
+        for (task, model), agg in sorted(grouped.items()):
+            count = agg["count"]
+            result.append({
+                "task_name": task,
+                "task_type": agg["task_type"],
+                "model_name": model,
+                "count": count,
+                "success_rate": round(agg["success_count"] / count, 4) if count else None,
+                "json_parse_failure_rate": (
+                    round(agg["json_failed"] / agg["json_checked"], 4) if agg["json_checked"] else None
+                ),
+                "cache_hit_rate": round(agg["cache_hits"] / count, 4) if count else None,
+                "avg_ms": round(agg["total_ms"] / count, 1) if count else None,
+                "max_ms": round(agg["max_ms"], 1),
+                "p50_ms": cls.percentile(agg["histogram"], agg["max_ms"], 0.50),
+                "p95_ms": cls.percentile(agg["histogram"], agg["max_ms"], 0.95),
+                "p99_ms": cls.percentile(agg["histogram"], agg["max_ms"], 0.99),
+                "histogram": [
+                    {"le_ms": edge, "count": agg["histogram"][index]}
+                    for index, edge in enumerate(cls.LATENCY_EDGES_MS + (None,))
+                ],
+            })
+        return result
@@ -1,9 +1,14 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+import hashlib
 import json
 import logging
 import time
 from django.conf import settings
 from apps.common.utils import encode_image_to_base64, uploaded_image_to_data_url
+from apps.diet.domains.tools.ai_executor import AIExecutor
+from apps.diet.domains.tools.ai_metrics import AIMetrics
+from apps.diet.domains.tools.circuit_breaker import CircuitBreaker
+from apps.diet.domains.tools.recognition_cache import RecognitionCache
 
 # 让 httpx/openai 使用系统证书库，解决 certifi 证书库与系统环境不一致的问题
 try:
@@ -17,7 +22,8 @@ logger = logging.getLogger(__name__)
 class AIService:
     # [核心修改] 缓存不同任务类型的 client 实例
     _clients = {}
-    _current_key_index = {}  # 每个 task_type 的当前密钥索引
+    # 异步 client 按 (base_url, 密钥) 缓存，仅在 AIExecutor 的事件循环内使用
+    _async_clients = {}
     _last_metrics = []
 
     @classmethod
@@ -30,6 +36,7 @@ class AIService:
         success,
         json_parsed=None,
         error=None,
+        cache_hit=False,
     ):
         metric = {
             "task_name": task_name,
@@ -39,10 +46,16 @@ class AIService:
             "success": bool(success),
             "json_parsed": json_parsed,
             "error": str(error)[:300] if error else "",
+            "cache_hit": bool(cache_hit),
         }
         cls._last_metrics.append(metric)
         cls._last_metrics = cls._last_metrics[-100:]
         logger.info("[AI_METRIC] %s", json.dumps(metric, ensure_ascii=False))
+        # 跨进程持久化：先在内存中聚合，按批写入时间分桶表
+        try:
+            AIMetrics.record(metric)
+        except Exception as exc:
+            logger.warning("AI metric buffering failed: %s", exc)
         return metric
 
     @classmethod
@@ -56,96 +69,141 @@ class AIService:
         return api_keys
 
     @classmethod
-    def get_client_and_model(cls, task_type='text'):
+    def _call_completion(cls, task_type, **kwargs):
         """
-        动态路由：根据任务类型和当前密钥索引获取 OpenAI Client
+        带密钥熔断 + 供应商降级的 API 调用封装。
+        流程: 主供应商健康密钥 → fallback 供应商健康密钥 → 抛出异常
+        非流式请求交给 AIExecutor：按密钥限流，相同的在途请求合并为一次调用。
         """
-        if not getattr(settings, 'ENABLE_AI_SERVICES', True):
-            raise RuntimeError('AI services are disabled by configuration')
+        if kwargs.get('stream'):
+            return cls._call_completion_blocking(task_type, **kwargs)
+        return AIExecutor.run(
+            lambda: cls._acall_completion(task_type, **kwargs),
+            key=cls._coalesce_key(task_type, kwargs),
+        )
 
-        config = getattr(settings, 'AI_CONFIG', {}).get(task_type)
-        if not config:
-            raise RuntimeError(f'AI routing config missing for task type: {task_type}')
+    @classmethod
+    async def acall_completion(cls, task_type, **kwargs):
+        """_call_completion 的异步版本，供 ASGI 视图直接 await。"""
+        return await AIExecutor.arun(
+            lambda: cls._acall_completion(task_type, **kwargs),
+            key=cls._coalesce_key(task_type, kwargs),
+        )
 
-        api_keys = cls._get_api_keys(config)
-        if not api_keys or not config.get('base_url') or not config.get('model'):
-            raise RuntimeError(f'AI config incomplete for task type: {task_type}')
+    @staticmethod
+    def _coalesce_key(task_type, kwargs):
+        if not getattr(settings, 'AI_COALESCE_REQUESTS', True):
+            return None
+        return AIExecutor.request_key(task_type, kwargs)
 
-        # 按当前索引选取密钥
-        idx = cls._current_key_index.get(task_type, 0) % len(api_keys)
-        cache_key = f"{task_type}_{idx}"
-        if cache_key not in cls._clients:
-            cls._clients[cache_key] = OpenAI(
-                api_key=api_keys[idx],
-                base_url=config['base_url']
-            )
-        return cls._clients[cache_key], config['model']
+    @staticmethod
+    def _slot(config, api_key):
+        # 限流粒度为 (供应商地址, 密钥)，不同任务类型共用同一密钥时共享并发额度
+        return (config.get('base_url', ''), hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12])
 
     @classmethod
-    def _rotate_key(cls, task_type):
-        """轮换到下一个密钥"""
-        config = getattr(settings, 'AI_CONFIG', {}).get(task_type, {})
-        api_keys = cls._get_api_keys(config)
-        if len(api_keys) <= 1:
-            return
-        old_idx = cls._current_key_index.get(task_type, 0) % len(api_keys)
-        new_idx = (old_idx + 1) % len(api_keys)
-        cls._current_key_index[task_type] = new_idx
-        cls._clients.pop(f"{task_type}_{old_idx}", None)
-        logger.info("[AI] 密钥轮换 %s: #%d -> #%d", task_type, old_idx, new_idx)
+    def _async_client(cls, config, api_key):
+        slot = cls._slot(config, api_key)
+        if slot not in cls._async_clients:
+            cls._async_clients[slot] = AsyncOpenAI(api_key=api_key, base_url=config['base_url'])
+        return cls._async_clients[slot]
 
     @classmethod
-    def _call_completion(cls, task_type, **kwargs):
+    def _sync_client(cls, config, api_key):
+        slot = cls._slot(config, api_key)
+        if slot not in cls._clients:
+            cls._clients[slot] = OpenAI(api_key=api_key, base_url=config['base_url'])
+        return cls._clients[slot]
+
+    @classmethod
+    def _route(cls, task_type):
         """
-        带密钥失败轮换 + 供应商降级的 API 调用封装。
-        流程: 主供应商全部密钥 → fallback 供应商全部密钥 → 抛出异常
+        本次调用的候选 (阶段, 配置, 密钥, slot)：主供应商在前、fallback 在后；
+        同一供应商内按熔断器排序，健康且延迟最低的密钥优先，熔断中的密钥排在末尾。
         """
-        # ---- 阶段 1: 主供应商 ----
-        config = getattr(settings, 'AI_CONFIG', {}).get(task_type, {})
-        api_keys = cls._get_api_keys(config)
-        max_attempts = max(len(api_keys), 1)
+        if not getattr(settings, 'ENABLE_AI_SERVICES', True):
+            raise RuntimeError('AI services are disabled by configuration')
 
+        ai_config = getattr(settings, 'AI_CONFIG', {})
+        config = ai_config.get(task_type)
+        if not config:
+            raise RuntimeError(f'AI routing config missing for task type: {task_type}')
+        if not cls._get_api_keys(config) or not config.get('base_url') or not config.get('model'):
+            raise RuntimeError(f'AI config incomplete for task type: {task_type}')
+
+        route = []
+        for stage, stage_config in (('primary', config), ('fallback', ai_config.get('fallback', {}))):
+            api_keys = cls._get_api_keys(stage_config)
+            if not api_keys or not stage_config.get('base_url') or not stage_config.get('model'):
+                continue
+            slots = {cls._slot(stage_config, key): key for key in api_keys}
+            for slot in CircuitBreaker.rank(list(slots)):
+                route.append((stage, stage_config, slots[slot], slot))
+        return route
+
+    @staticmethod
+    def _log_attempt_failure(stage, slot, task_type, error):
+        if stage == 'fallback':
+            logger.warning("[AI] fallback 密钥 %s 调用失败: %s", slot[1][:6], str(error)[:200])
+        else:
+            logger.warning("[AI] 密钥 %s 调用失败(%s): %s", slot[1][:6], task_type, str(error)[:200])
+
+    @classmethod
+    async def _acall_completion(cls, task_type, **kwargs):
         last_error = None
-        for attempt in range(max_attempts):
+        for stage, config, api_key, slot in cls._route(task_type):
+            # 熔断中的密钥直接跳过，不再等待一次完整的网络超时
+            if not CircuitBreaker.allow(slot):
+                continue
+            client = cls._async_client(config, api_key)
+            request = dict(kwargs, model=config['model'])
+
+            async def attempt():
+                # 只统计上游耗时，排队等待不计入密钥延迟
+                started = time.perf_counter()
+                try:
+                    response = await client.chat.completions.create(**request)
+                except Exception:
+                    CircuitBreaker.record(slot, False, time.perf_counter() - started)
+                    raise
+                CircuitBreaker.record(slot, True, time.perf_counter() - started)
+                return response
+
             try:
-                client, model_name = cls.get_client_and_model(task_type)
-                kwargs['model'] = model_name
-                response = client.chat.completions.create(**kwargs)
-                return response, model_name
+                response = await AIExecutor.limited(slot, attempt)
             except Exception as e:
                 last_error = e
-                idx = cls._current_key_index.get(task_type, 0)
-                logger.warning(
-                    "[AI] 密钥 #%d 调用失败(%s), attempt %d/%d: %s",
-                    idx, task_type, attempt + 1, max_attempts, str(e)[:200]
-                )
-                cls._rotate_key(task_type)
+                cls._log_attempt_failure(stage, slot, task_type, e)
+                continue
+            if stage == 'fallback':
+                logger.info("[AI] fallback 调用成功 (model=%s)", config['model'])
+            return response, config['model']
 
-        # ---- 阶段 2: 降级到 fallback 供应商 ----
-        fallback_config = getattr(settings, 'AI_CONFIG', {}).get('fallback', {})
-        fb_keys = cls._get_api_keys(fallback_config)
-        fb_base_url = fallback_config.get('base_url', '')
-        fb_model = fallback_config.get('model', '')
+        raise last_error or RuntimeError(f'AI keys for {task_type} are all circuit-open')
 
-        if fb_keys and fb_base_url and fb_model:
-            logger.warning("[AI] 主供应商全部失败，降级到 fallback (%s)", fallback_config.get('provider', 'unknown'))
-            for fb_idx, fb_key in enumerate(fb_keys):
-                try:
-                    cache_key = f"fallback_{fb_idx}"
-                    if cache_key not in cls._clients:
-                        cls._clients[cache_key] = OpenAI(api_key=fb_key, base_url=fb_base_url)
-                    fb_client = cls._clients[cache_key]
-                    fb_kwargs = dict(kwargs)
-                    fb_kwargs['model'] = fb_model
-                    response = fb_client.chat.completions.create(**fb_kwargs)
-                    logger.info("[AI] fallback 密钥 #%d 调用成功 (model=%s)", fb_idx, fb_model)
-                    return response, fb_model
-                except Exception as e:
-                    last_error = e
-                    logger.warning("[AI] fallback 密钥 #%d 调用失败: %s", fb_idx, str(e)[:200])
-                    cls._clients.pop(f"fallback_{fb_idx}", None)
-
-        raise last_error
+    @classmethod
+    def _call_completion_blocking(cls, task_type, **kwargs):
+        """流式请求仍在调用线程中同步迭代，沿用同步 client，路由与熔断规则同上。"""
+        last_error = None
+        for stage, config, api_key, slot in cls._route(task_type):
+            if not CircuitBreaker.allow(slot):
+                continue
+            started = time.perf_counter()
+            try:
+                response = cls._sync_client(config, api_key).chat.completions.create(
+                    **dict(kwargs, model=config['model'])
+                )
+            except Exception as e:
+                CircuitBreaker.record(slot, False, time.perf_counter() - started)
+                last_error = e
+                cls._log_attempt_failure(stage, slot, task_type, e)
+                continue
+            CircuitBreaker.record(slot, True, time.perf_counter() - started)
+            if stage == 'fallback':
+                logger.info("[AI] fallback 调用成功 (model=%s)", config['model'])
+            return response, config['model']
+
+        raise last_error or RuntimeError(f'AI keys for {task_type} are all circuit-open')
 
     @staticmethod
     def _clean_json_response(content):
@@ -192,6 +250,13 @@ class AIService:
         started_at = time.perf_counter()
         model_name = ""
         raw_content = ""
+        # 0. 同一张图片的重复上传直接复用识别结果，不再调用模型
+        cache_keys = RecognitionCache.keys_for("recognize_food", image_file)
+        cached = RecognitionCache.get(cache_keys)
+        if cached is not None:
+            AIService.record_model_metric("recognize_food", "vision", RecognitionCache.model_name(), started_at, True, True, cache_hit=True)
+            return cached
+
         # 1. 尝试编码，获取带真实 MIME 的 Data URL
         try:
             data_url = uploaded_image_to_data_url(image_file)
@@ -243,6 +308,8 @@ class AIService:
                 required_keys=["food_name", "calories", "nutrition", "description"],
             )
             AIService.record_model_metric("recognize_food", "vision", model_name, started_at, True, True)
+            if "error" not in result:
+                RecognitionCache.set(cache_keys, result)
             return result
 
         except (json.JSONDecodeError, ValueError) as e:
@@ -360,7 +427,8 @@ class AIService:
         
     # [新增] AI 智能问答 (支持 Server-Sent Events 流式输出)
     @staticmethod
-    def chat_with_ai_stream(question, context_messages=None):
+    def chat_with_ai_stream(question, context_messages=None, on_complete=None):
+        """on_complete(answer) 在完整回答流式输出成功后调用，用于写回服务端会话上下文"""
         started_at = time.perf_counter()
         model_name = ""
         if context_messages is None:
@@ -378,18 +446,27 @@ class AIService:
                 stream=True
             )
             
+            answer_parts = []
             for chunk in response:
                 if chunk.choices and len(chunk.choices) > 0:
                     delta_content = chunk.choices[0].delta.content
                     if delta_content:
+                        answer_parts.append(delta_content)
                         # 构造前端约定的 JSON 结构并转为 SSE 格式
                         data_str = json.dumps({"delta": delta_content}, ensure_ascii=False)
                         yield f"data: {data_str}\n\n"
             
+            AIService.record_model_metric("ai_chat_stream", "text", model_name, started_at, True, None)
+            if on_complete:
+                # 先写回上下文再发结束标识：客户端收到 [DONE] 后即可断开，之后的代码可能不再执行
+                try:
+                    on_complete("".join(answer_parts))
+                except Exception as exc:
+                    logger.exception("AI chat stream on_complete failed: %s", exc)
+
             # 流式传输结束标识
             yield "data: [DONE]\n\n"
-            AIService.record_model_metric("ai_chat_stream", "text", model_name, started_at, True, None)
-            
+
         except Exception as e:
             AIService.record_model_metric("ai_chat_stream", "text", model_name, started_at, False, None, e)
             # 捕获异常也需以 SSE 格式通知前端
@@ -404,6 +481,12 @@ class AIService:
         """
         started_at = time.perf_counter()
         model_name = ""
+        cache_keys = RecognitionCache.keys_for("recognize_ingredient", image_file)
+        cached = RecognitionCache.get(cache_keys)
+        if cached is not None:
+            AIService.record_model_metric("recognize_ingredient", "vision", RecognitionCache.model_name(), started_at, True, True, cache_hit=True)
+            return cached
+
         try:
             data_url = uploaded_image_to_data_url(image_file)
         except Exception as e:
@@ -447,6 +530,8 @@ class AIService:
                 required_keys=["name", "category", "amount_unit"],
             )
             AIService.record_model_metric("recognize_ingredient", "vision", model_name, started_at, True, True)
+            if "error" not in result:
+                RecognitionCache.set(cache_keys, result)
             return result
         except (json.JSONDecodeError, ValueError) as e:
             AIService.record_model_metric("recognize_ingredient", "vision", model_name, started_at, False, False, e)
@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOpenAIServer:
+    """Local OpenAI-compatible ``/chat/completions`` endpoint.
+
+    Lets benchmark_ai_models and tests drive the real client, executor and
+    parsing pipeline offline. Replies are canned per task (detected from the
+    JSON keys the prompt asks for) after ``latency_ms``; ``stream=true``
+    requests get SSE chunks. Usable as a context manager.
+    """
+
+    FOOD_REPLY = {
+        "food_name": "番茄炒蛋",
+        "calories": 320,
+        "nutrition": {"carbohydrates": 12, "protein": 18, "fat": 22},
+        "description": "蛋白质充足，注意控油",
+    }
+    INGREDIENT_REPLY = {"name": "西红柿", "category": "vegetable", "amount_unit": "个"}
+    TEXT_REPLY = "建议多吃蔬菜，适量摄入优质蛋白，控制油盐。"
+
+    def __init__(self, latency_ms=0, host="127.0.0.1", port=0):
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ai-stub", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @classmethod
+    def reply_for(cls, messages):
+        prompt = json.dumps(messages, ensure_ascii=False)
+        if "food_name" in prompt:
+            return json.dumps(cls.FOOD_REPLY, ensure_ascii=False)
+        if "amount_unit" in prompt:
+            return json.dumps(cls.INGREDIENT_REPLY, ensure_ascii=False)
+        return cls.TEXT_REPLY
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 头部与正文分两次写出，关闭 Nagle 避免与客户端延迟 ACK 叠加出 40ms 的假延迟
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency_ms:
+                    time.sleep(stub.latency_ms / 1000)
+                content = stub.reply_for(body.get("messages", []))
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                model = body.get("model", "stub")
+                if body.get("stream"):
+                    self._stream(completion_id, model, content)
+                else:
+                    self._json({
+                        "id": completion_id,
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                    })
+
+            def _json(self, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, completion_id, model, content):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+                for piece in pieces:
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
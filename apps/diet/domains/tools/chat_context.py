@@ -0,0 +1,197 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.diet.models import AIChatContext
+
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text):
+    """Rough token count: one per CJK character, one per four other characters."""
+    text = text or ""
+    wide = sum(1 for char in text if ord(char) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+
+class ChatContextStore:
+    """Server-side conversation context for the AI nutritionist chat.
+
+    The working context of each user lives in the cache: the most recent
+    turns within AI_CHAT_CONTEXT_TOKEN_BUDGET, plus a short extractive summary
+    (capped at SUMMARY_LIMIT characters) of the questions that fell out of
+    the window. A cold cache is rebuilt from the latest AIChatContext rows in
+    one query. New turns are appended to the cache immediately and written
+    behind to AIChatContext by a per-process flush thread every
+    FLUSH_INTERVAL seconds (and at exit), or inline once FLUSH_ROWS rows are
+    buffered, so a chat turn rarely touches the history table. A reset bumps the user's
+    generation in the shared cache; buffered turns remember the generation
+    they were queued under, and every worker drops stale ones at flush.
+    """
+
+    KEY_PREFIX = "ai_chat:ctx"
+    GENERATION_PREFIX = "ai_chat:gen"
+    SUMMARY_LIMIT = 300
+    FLUSH_ROWS = 20
+    FLUSH_INTERVAL = 5
+    _pending = []
+    _lock = threading.Lock()
+    _worker_pid = None
+    _worker_lock = threading.Lock()
+
+    @staticmethod
+    def _budget():
+        return int(getattr(settings, "AI_CHAT_CONTEXT_TOKEN_BUDGET", 1500))
+
+    @staticmethod
+    def _max_messages():
+        return int(getattr(settings, "AI_CHAT_CONTEXT_MAX_MESSAGES", 20))
+
+    @staticmethod
+    def _timeout():
+        return int(getattr(settings, "AI_CHAT_CONTEXT_TTL", 24 * 3600))
+
+    @classmethod
+    def _key(cls, user_id):
+        return f"{cls.KEY_PREFIX}:{user_id}"
+
+    @classmethod
+    def _generation_key(cls, user_id):
+        return f"{cls.GENERATION_PREFIX}:{user_id}"
+
+    @classmethod
+    def _generation(cls, user_id):
+        try:
+            return cache.get(cls._generation_key(user_id)) or 0
+        except Exception:
+            return 0
+
+    @classmethod
+    def _load(cls, user_id):
+        try:
+            state = cache.get(cls._key(user_id))
+        except Exception:
+            state = None
+        if state is not None:
+            return state
+        rows = AIChatContext.objects.filter(user_id=user_id).order_by("-created_at", "-id").values_list("role", "content")
+        messages = [{"role": role, "content": content} for role, content in rows[: cls._max_messages()]][::-1]
+        return cls._trim({"summary": "", "messages": messages})
+
+    @classmethod
+    def _trim(cls, state):
+        """Drop the oldest turns until the window fits the budget, folding dropped questions into the summary."""
+        messages = state["messages"][-cls._max_messages():]
+        budget = cls._budget()
+        while messages and (sum(estimate_tokens(m["content"]) for m in messages) > budget or messages[0]["role"] != "user"):
+            dropped = messages.pop(0)
+            if dropped["role"] == "user":
+                topic = dropped["content"].strip().replace("\n", " ")[:40]
+                summary = f"{state['summary']}；{topic}" if state["summary"] else topic
+                # 摘要单独限长，只保留最近的话题，超长时从头部截断
+                state["summary"] = summary[-cls.SUMMARY_LIMIT:]
+        state["messages"] = messages
+        return state
+
+    @classmethod
+    def messages(cls, user_id):
+        """Context messages to send before the new question."""
+        state = cls._load(user_id)
+        context = []
+        if state["summary"]:
+            context.append({"role": "system", "content": f"此前对话中用户问过：{state['summary']}"})
+        return context + state["messages"]
+
+    @classmethod
+    def append(cls, user_id, question, answer):
+        state = cls._load(user_id)
+        turn = [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        state["messages"].extend(turn)
+        try:
+            cache.set(cls._key(user_id), cls._trim(state), timeout=cls._timeout())
+        except Exception as exc:
+            logger.warning("Failed to cache chat context for user %s: %s", user_id, exc)
+        generation = cls._generation(user_id)
+        with cls._lock:
+            cls._pending.extend((user_id, generation, message) for message in turn)
+            due = len(cls._pending) >= cls.FLUSH_ROWS
+        cls.ensure_worker()
+        if due:
+            cls.flush()
+
+    @classmethod
+    def ensure_worker(cls):
+        """Start the per-process flush thread (again after a fork)."""
+        if cls._worker_pid == os.getpid() or not getattr(settings, "AI_CHAT_CONTEXT_WORKER", True):
+            return
+        with cls._worker_lock:
+            if cls._worker_pid == os.getpid():
+                return
+
+            def run():
+                while True:
+                    time.sleep(cls.FLUSH_INTERVAL)
+                    try:
+                        cls.flush()
+                    except Exception as exc:
+                        logger.warning("Chat context flush failed: %s", exc)
+
+            threading.Thread(target=run, name="chat-context-flush", daemon=True).start()
+            cls._worker_pid = os.getpid()
+
+    @classmethod
+    def flush(cls):
+        """Persist buffered turns to AIChatContext; returns the number of rows written."""
+        with cls._lock:
+            pending, cls._pending = cls._pending, []
+        if not pending:
+            return 0
+        # 其它进程可能已重置对话：丢弃重置前排队的轮次
+        keys = {user_id: cls._generation_key(user_id) for user_id, _, _ in pending}
+        try:
+            current = cache.get_many(list(keys.values()))
+        except Exception:
+            current = {}
+        pending = [
+            (user_id, message) for user_id, generation, message in pending
+            if generation == (current.get(keys[user_id]) or 0)
+        ]
+        if not pending:
+            return 0
+        try:
+            AIChatContext.objects.bulk_create([
+                AIChatContext(user_id=user_id, role=message["role"], content=message["content"])
+                for user_id, message in pending
+            ])
+        except Exception as exc:
+            logger.warning("Chat context write-behind failed, %d rows dropped: %s", len(pending), exc)
+            return 0
+        return len(pending)
+
+    @classmethod
+    def reset(cls, user_id):
+        key = cls._generation_key(user_id)
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+        with cls._lock:
+            cls._pending = [entry for entry in cls._pending if entry[0] != user_id]
+        cache.delete(cls._key(user_id))
+        AIChatContext.objects.filter(user_id=user_id).delete()
+
+
+def _flush_at_exit():
+    if ChatContextStore._worker_pid != os.getpid():
+        return
+    try:
+        ChatContextStore.flush()
+    except Exception as exc:
+        logger.warning("Chat context flush at exit failed: %s", exc)
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+class _KeyHealth:
+    __slots__ = ("outcomes", "latency", "opened_at")
+
+    def __init__(self, window):
+        self.outcomes = deque(maxlen=window)
+        self.latency = None
+        self.opened_at = None
+
+
+class CircuitBreaker:
+    """Per-(provider, key) health used to route AI calls.
+
+    Every attempt reports its outcome and latency. A slot whose error rate
+    over the last AI_CIRCUIT_WINDOW attempts reaches AI_CIRCUIT_ERROR_RATE
+    opens and is skipped without a network call. After AI_CIRCUIT_COOLDOWN
+    seconds one caller is let through as a half-open probe: success closes
+    the circuit, failure re-opens it. Closed slots are ordered by recent
+    failure ratio, then latency moving average, so the fastest healthy key
+    is tried first.
+
+    State is per process, like the AI clients themselves.
+    """
+
+    LATENCY_ALPHA = 0.3
+    _states = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _window():
+        return max(int(getattr(settings, "AI_CIRCUIT_WINDOW", 20)), 1)
+
+    @staticmethod
+    def _min_calls():
+        return max(int(getattr(settings, "AI_CIRCUIT_MIN_CALLS", 4)), 1)
+
+    @staticmethod
+    def _error_rate():
+        return float(getattr(settings, "AI_CIRCUIT_ERROR_RATE", 0.5))
+
+    @staticmethod
+    def _cooldown():
+        return float(getattr(settings, "AI_CIRCUIT_COOLDOWN", 30))
+
+    @classmethod
+    def _state(cls, slot):
+        state = cls._states.get(slot)
+        if state is None:
+            state = cls._states[slot] = _KeyHealth(cls._window())
+        return state
+
+    @classmethod
+    def allow(cls, slot):
+        """Whether a call may go to ``slot`` now; claims the half-open probe when due."""
+        with cls._lock:
+            state = cls._state(slot)
+            if state.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - state.opened_at < cls._cooldown():
+                return False
+            # 放行一次探测并重新计时：探测请求未返回前其余调用仍跳过该密钥
+            state.opened_at = now
+            return True
+
+    @classmethod
+    def record(cls, slot, success, elapsed):
+        with cls._lock:
+            state = cls._state(slot)
+            if state.opened_at is not None:
+                # 半开探测结果：成功则关闭并清空窗口，失败则重新计时
+                if success:
+                    state.opened_at = None
+                    state.outcomes.clear()
+                else:
+                    state.opened_at = time.monotonic()
+                    return
+            state.outcomes.append(bool(success))
+            if success:
+                state.latency = elapsed if state.latency is None else (
+                    cls.LATENCY_ALPHA * elapsed + (1 - cls.LATENCY_ALPHA) * state.latency
+                )
+            failures = state.outcomes.count(False)
+            if len(state.outcomes) >= cls._min_calls() and failures / len(state.outcomes) >= cls._error_rate():
+                state.opened_at = time.monotonic()
+
+    @classmethod
+    def rank(cls, slots):
+        """Order ``slots`` for one call.
+
+        Slots due for a half-open probe come first (otherwise a recovered key
+        behind a healthy one would never be retried), then closed slots by
+        recent failure ratio and latency, then slots still cooling down.
+        """
+        now = time.monotonic()
+        cooldown = cls._cooldown()
+        with cls._lock:
+            def key(item):
+                position, slot = item
+                state = cls._states.get(slot)
+                if state is None:
+                    return (1, 0.0, 0.0, position)
+                if state.opened_at is not None:
+                    return (0 if now - state.opened_at >= cooldown else 2, 0.0, 0.0, position)
+                failures = state.outcomes.count(False) / len(state.outcomes) if state.outcomes else 0.0
+                return (1, failures, state.latency or 0.0, position)
+
+            return [slot for _, slot in sorted(enumerate(slots), key=key)]
+
+    @classmethod
+    def snapshot(cls):
+        with cls._lock:
+            return {
+                slot: {
+                    "open": state.opened_at is not None,
+                    "calls": len(state.outcomes),
+                    "failures": state.outcomes.count(False),
+                    "latency_ms": round(state.latency * 1000, 1) if state.latency is not None else None,
+                }
+                for slot, state in cls._states.items()
+            }
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._states = {}
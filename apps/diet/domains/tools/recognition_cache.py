@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.common.redis import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecognitionCache:
+    """Results of vision recognition tasks, keyed by image content.
+
+    The primary key is the SHA-256 of the uploaded bytes, so retries and
+    re-uploads of the same photo skip the model call. With
+    AI_RECOGNITION_PERCEPTUAL_HASH enabled, a 64-bit difference hash is stored
+    as a secondary key so re-encoded or resized copies also hit. Entries
+    expire after AI_RECOGNITION_CACHE_TTL, and an access-ordered index (Redis
+    sorted set, or a dict in the Django cache) evicts the least recently used
+    entries beyond AI_RECOGNITION_CACHE_MAX_ENTRIES.
+    """
+
+    KEY_PREFIX = "ai_recognition"
+    INDEX_KEY = "ai_recognition:index"
+
+    @staticmethod
+    def _timeout():
+        return int(getattr(settings, "AI_RECOGNITION_CACHE_TTL", 7 * 24 * 3600))
+
+    @staticmethod
+    def _max_entries():
+        return max(int(getattr(settings, "AI_RECOGNITION_CACHE_MAX_ENTRIES", 5000)), 1)
+
+    @staticmethod
+    def model_name():
+        return getattr(settings, "AI_CONFIG", {}).get("vision", {}).get("model", "")
+
+    @staticmethod
+    def content_hash(image_file):
+        """SHA-256 of the upload, read in chunks; the file is rewound afterwards."""
+        digest = hashlib.sha256()
+        if hasattr(image_file, "seek"):
+            image_file.seek(0)
+        if hasattr(image_file, "chunks"):
+            for chunk in image_file.chunks():
+                digest.update(chunk)
+        else:
+            digest.update(image_file.read())
+        if hasattr(image_file, "seek"):
+            image_file.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def perceptual_hash(image_file):
+        """64-bit difference hash of the image, or None when it cannot be decoded."""
+        try:
+            from PIL import Image, ImageOps
+
+            image_file.seek(0)
+            with Image.open(image_file) as image:
+                pixels = list(ImageOps.exif_transpose(image).convert("L").resize((9, 8)).getdata())
+        except Exception:
+            return None
+        finally:
+            if hasattr(image_file, "seek"):
+                image_file.seek(0)
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+        return f"{bits:016x}"
+
+    @classmethod
+    def keys_for(cls, task_name, image_file):
+        """Cache keys for an upload: the exact-content key first, then the perceptual one."""
+        if not getattr(settings, "AI_RECOGNITION_CACHE_ENABLED", True):
+            return []
+        # 模型名参与键，切换视觉模型后不再复用旧模型的识别结果
+        scope = f"{cls.KEY_PREFIX}:{task_name}:{hashlib.md5(cls.model_name().encode('utf-8')).hexdigest()[:8]}"
+        try:
+            keys = [f"{scope}:sha:{cls.content_hash(image_file)}"]
+        except Exception as exc:
+            logger.warning("Failed to hash upload for recognition cache: %s", exc)
+            return []
+        if getattr(settings, "AI_RECOGNITION_PERCEPTUAL_HASH", False):
+            phash = cls.perceptual_hash(image_file)
+            if phash:
+                keys.append(f"{scope}:dhash:{phash}")
+        return keys
+
+    @classmethod
+    def get(cls, keys):
+        for key in keys:
+            try:
+                result = cache.get(key)
+            except Exception:
+                return None
+            if result is not None:
+                cls._touch([key])
+                return result
+        return None
+
+    @classmethod
+    def set(cls, keys, result):
+        if not keys:
+            return
+        try:
+            cache.set_many({key: result for key in keys}, timeout=cls._timeout())
+        except Exception as exc:
+            logger.warning("Failed to cache recognition result: %s", exc)
+            return
+        cls._touch(keys)
+
+    @classmethod
+    def _touch(cls, keys):
+        """Record access time and evict the least recently used entries past the bound."""
+        now = time.time()
+        limit = cls._max_entries()
+        try:
+            r = get_redis()
+            if r is not None:
+                pipe = r.pipeline()
+                pipe.zadd(cls.INDEX_KEY, {key: now for key in keys})
+                pipe.zcard(cls.INDEX_KEY)
+                overflow = pipe.execute()[-1] - limit
+                evicted = r.zpopmin(cls.INDEX_KEY, overflow) if overflow > 0 else []
+                evicted = [key.decode("utf-8") if isinstance(key, bytes) else key for key, _ in evicted]
+            else:
+                index = cache.get(cls.INDEX_KEY) or {}
+                index.update({key: now for key in keys})
+                evicted = []
+                if len(index) > limit:
+                    evicted = sorted(index, key=index.get)[: len(index) - limit]
+                    for key in evicted:
+                        index.pop(key, None)
+                cache.set(cls.INDEX_KEY, index, timeout=None)
+            if evicted:
+                cache.delete_many(evicted)
+        except Exception as exc:
+            logger.warning("Recognition cache index update failed: %s", exc)
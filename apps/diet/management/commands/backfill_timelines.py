@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from apps.common.redis import get_redis
+from apps.diet.domains.community.timeline import FollowTimeline
+
+
+class Command(BaseCommand):
+    help = "Rebuild the Redis following timelines from existing posts and follow relations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users", help="Only rebuild this user's timeline (repeatable).")
+
+    def handle(self, *args, **options):
+        if get_redis() is None:
+            self.stdout.write(self.style.WARNING("Redis is not configured; timelines are read from Mongo directly."))
+            return
+        self.stdout.write("Backfilling following timelines...")
+        stats = FollowTimeline.backfill(user_ids=options["users"], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {stats['entries']} entries into {stats['users']} timelines."))
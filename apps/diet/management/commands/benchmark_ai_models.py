@@ -1,46 +1,132 @@
+import contextvars
 import copy
+import json
+import math
 import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
 from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 
+from apps.diet.domains.tools.ai_metrics import AIMetrics
 from apps.diet.domains.tools.ai_service import AIService
+from apps.diet.domains.tools.ai_stub_server import StubOpenAIServer
+
+
+JSON_ERRORS = {"AI返回非JSON格式", "AI返回的数据格式无法解析"}
+TEXT_QUESTIONS = [
+    "今天午餐吃了鸡胸肉和米饭，晚餐怎么搭配更适合减脂？",
+    "运动后适合补充哪些食物？",
+    "最近总是外卖，如何控制热量和盐分？",
+]
+# 压测时默认关闭，使每次请求都真正经过模型调用链路
+LOAD_OVERRIDES = {"AI_RECOGNITION_CACHE_ENABLED": False, "AI_COALESCE_REQUESTS": False}
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(q * len(sorted_values)) - 1, 0)]
 
 
 class Command(BaseCommand):
-    help = "Benchmark configured AI models for contest demo stability."
+    help = "Benchmark and load-test configured AI models: latency percentiles, throughput, error and JSON-parse rates."
 
     def add_arguments(self, parser):
         parser.add_argument("--vision-models", default="", help="Comma-separated vision model names.")
         parser.add_argument("--text-models", default="", help="Comma-separated text model names.")
         parser.add_argument("--food-images", nargs="*", default=[], help="Food image paths for calorie recognition.")
         parser.add_argument("--ingredient-images", nargs="*", default=[], help="Ingredient image paths for fridge recognition.")
+        parser.add_argument("--concurrency", default="1", help="Comma-separated concurrency levels, e.g. 1,4,16.")
+        parser.add_argument("--repeat", type=int, default=1, help="Measured requests per case and concurrency level.")
+        parser.add_argument("--warmup", type=int, default=0, help="Unmeasured requests per case before each level.")
+        parser.add_argument("--json-output", default="", help="Write the summary as JSON to this path.")
+        parser.add_argument("--stub", action="store_true", help="Serve a local OpenAI-compatible stub instead of the real providers.")
+        parser.add_argument("--stub-latency-ms", type=int, default=0, help="Artificial latency of the stub server.")
+        parser.add_argument(
+            "--keep-caches",
+            action="store_true",
+            help="Keep the recognition cache and in-flight request coalescing enabled.",
+        )
 
     def handle(self, *args, **options):
-        original_config = copy.deepcopy(getattr(settings, "AI_CONFIG", {}))
-        vision_models = self._option_models(options["vision_models"], "vision", original_config)
-        text_models = self._option_models(options["text_models"], "text", original_config)
-
-        rows = []
-        for model in vision_models:
-            rows.extend(self._run_vision_suite(model, options["food_images"], options["ingredient_images"], original_config))
-        for model in text_models:
-            rows.extend(self._run_text_suite(model, original_config))
-
-        if not rows:
+        saved_config = copy.deepcopy(getattr(settings, "AI_CONFIG", {}))
+        saved_overrides = {name: getattr(settings, name, None) for name in LOAD_OVERRIDES}
+        levels = sorted({max(int(item), 1) for item in options["concurrency"].split(",") if item.strip()}) or [1]
+        stub = None
+        try:
+            original_config = saved_config
+            if options["stub"]:
+                stub = StubOpenAIServer(latency_ms=options["stub_latency_ms"])
+                original_config = self._stub_config(saved_config, stub.start())
+                settings.AI_CONFIG = original_config
+            if not options["keep_caches"]:
+                for name, value in LOAD_OVERRIDES.items():
+                    setattr(settings, name, value)
+
+            vision_models = self._option_models(options["vision_models"], "vision", original_config)
+            text_models = self._option_models(options["text_models"], "text", original_config)
+            food_images, ingredient_images = options["food_images"], options["ingredient_images"]
+            if stub and not food_images and not ingredient_images:
+                # 离线模式下使用合成图片，覆盖图片预处理与编码开销
+                food_images = ingredient_images = [self._synthetic_image()]
+
+            results = []
+            # 基准测试产生的指标写入同一张指标表，来源标记为 benchmark
+            with AIMetrics.tagged("benchmark"):
+                for model in vision_models:
+                    self._set_model("vision", model, original_config)
+                    cases = [("recognize_food", AIService.recognize_food, path) for path in food_images]
+                    cases += [("recognize_ingredient", AIService.recognize_ingredient, path) for path in ingredient_images]
+                    for task_name, func, source in cases:
+                        run = self._image_case(func, source)
+                        results.extend(self._run_levels("vision", task_name, model, run, levels, options))
+                for model in text_models:
+                    self._set_model("text", model, original_config)
+                    run = self._text_case()
+                    results.extend(self._run_levels("text", "ai_chat", model, run, levels, options))
+            AIMetrics.flush()
+        finally:
+            settings.AI_CONFIG = saved_config
+            for name, value in saved_overrides.items():
+                setattr(settings, name, value)
+            if stub:
+                stub.stop()
+
+        if not results:
             self.stdout.write(self.style.WARNING("No AI benchmark cases ran. Provide model config and image paths."))
             return
 
-        self.stdout.write("task_type,task_name,model,success,elapsed_ms,json_parsed,error")
-        for row in rows:
-            self.stdout.write(
-                "{task_type},{task_name},{model},{success},{elapsed_ms},{json_parsed},{error}".format(**row)
-            )
+        columns = [
+            "task_type", "task_name", "model", "concurrency", "runs", "mean_ms", "p50_ms", "p90_ms", "p99_ms",
+            "throughput_rps", "error_rate", "json_parse_rate",
+        ]
+        self.stdout.write(",".join(columns))
+        for row in results:
+            self.stdout.write(",".join("" if row[column] is None else str(row[column]) for column in columns))
 
-        best = self._best_model(rows)
+        best = self._best_model(results)
         if best:
             self.stdout.write(self.style.SUCCESS(f"Recommended model by success and speed: {best}"))
 
+        if options["json_output"]:
+            report = {
+                "generated_at": timezone.now().isoformat(),
+                "stub": bool(options["stub"]),
+                "concurrency": levels,
+                "repeat": options["repeat"],
+                "warmup": options["warmup"],
+                "results": results,
+                "recommended_model": best,
+            }
+            with open(options["json_output"], "w", encoding="utf-8") as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(f"JSON report written to {options['json_output']}")
+
     def _option_models(self, raw_value, task_type, original_config):
         models = [item.strip() for item in raw_value.split(",") if item.strip()]
         if models:
@@ -48,71 +134,108 @@ class Command(BaseCommand):
         model = original_config.get(task_type, {}).get("model")
         return [model] if model else []
 
+    def _stub_config(self, config, base_url):
+        stub_config = {}
+        for task_type in ("vision", "text"):
+            stub_config[task_type] = {
+                **config.get(task_type, {}),
+                "base_url": base_url,
+                "api_key": "stub-key",
+                "api_keys": ["stub-key"],
+                "model": config.get(task_type, {}).get("model") or f"stub-{task_type}",
+            }
+        return stub_config
+
     def _set_model(self, task_type, model_name, original_config):
         config = dict(original_config.get(task_type, {}))
         config["model"] = model_name
         settings.AI_CONFIG = dict(getattr(settings, "AI_CONFIG", {}))
         settings.AI_CONFIG[task_type] = config
-        AIService._clients.pop(task_type, None)
 
-    def _run_vision_suite(self, model, food_images, ingredient_images, original_config):
-        self._set_model("vision", model, original_config)
-        rows = []
-        for path in food_images:
-            rows.append(self._run_image_case("vision", "recognize_food", model, path, AIService.recognize_food))
-        for path in ingredient_images:
-            rows.append(self._run_image_case("vision", "recognize_ingredient", model, path, AIService.recognize_ingredient))
-        return rows
+    def _synthetic_image(self):
+        from PIL import Image
 
-    def _run_text_suite(self, model, original_config):
-        self._set_model("text", model, original_config)
-        questions = [
-            "今天午餐吃了鸡胸肉和米饭，晚餐怎么搭配更适合减脂？",
-            "运动后适合补充哪些食物？",
-            "最近总是外卖，如何控制热量和盐分？",
-        ]
-        return [self._run_text_case("text", "ai_chat", model, question) for question in questions]
+        buffer = BytesIO()
+        Image.effect_noise((1600, 1200), 40).convert("RGB").save(buffer, "JPEG", quality=90)
+        return buffer.getvalue()
 
-    def _run_image_case(self, task_type, task_name, model, path, func):
-        started_at = time.perf_counter()
-        try:
-            with open(path, "rb") as image_file:
-                result = func(image_file)
-            success = "error" not in result
-            return self._row(task_type, task_name, model, started_at, success, True, "" if success else result.get("error"))
-        except Exception as exc:
-            return self._row(task_type, task_name, model, started_at, False, False, exc)
+    def _image_case(self, func, source):
+        def run():
+            if isinstance(source, bytes):
+                result = func(SimpleUploadedFile("synthetic.jpg", source, content_type="image/jpeg"))
+            else:
+                with open(source, "rb") as image_file:
+                    result = func(image_file)
+            error = result.get("error")
+            if not error:
+                return True, True, ""
+            return False, (False if error in JSON_ERRORS else None), error
+
+        return run
 
-    def _run_text_case(self, task_type, task_name, model, question):
+    def _text_case(self):
+        counter = iter(range(10 ** 9))
+
+        def run():
+            result = AIService.chat_with_ai(TEXT_QUESTIONS[next(counter) % len(TEXT_QUESTIONS)])
+            error = result.get("error")
+            return not error, None, error or ""
+
+        return run
+
+    def _timed(self, run):
         started_at = time.perf_counter()
         try:
-            result = AIService.chat_with_ai(question)
-            success = "error" not in result
-            return self._row(task_type, task_name, model, started_at, success, None, "" if success else result.get("error"))
+            success, json_parsed, error = run()
         except Exception as exc:
-            return self._row(task_type, task_name, model, started_at, False, None, exc)
+            success, json_parsed, error = False, None, str(exc)
+        return (time.perf_counter() - started_at) * 1000, success, json_parsed, error
+
+    def _run_levels(self, task_type, task_name, model, run, levels, options):
+        rows = []
+        for concurrency in levels:
+            for _ in range(max(options["warmup"], 0)):
+                self._timed(run)
+            runs = max(options["repeat"], 1)
+            started_at = time.perf_counter()
+            # 线程池不继承 ContextVar：每个任务在调用方上下文的副本中运行，保留 benchmark 来源标记
+            contexts = [contextvars.copy_context() for _ in range(runs)]
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                samples = list(pool.map(lambda context: context.run(self._timed, run), contexts))
+            wall = time.perf_counter() - started_at
+            rows.append(self._summarize(task_type, task_name, model, concurrency, samples, wall))
+        return rows
 
-    def _row(self, task_type, task_name, model, started_at, success, json_parsed, error):
+    def _summarize(self, task_type, task_name, model, concurrency, samples, wall):
+        latencies = sorted(sample[0] for sample in samples)
+        failures = [sample for sample in samples if not sample[1]]
+        parsed = [sample[2] for sample in samples if sample[2] is not None]
         return {
             "task_type": task_type,
             "task_name": task_name,
             "model": model,
-            "success": int(bool(success)),
-            "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 2),
-            "json_parsed": "" if json_parsed is None else int(bool(json_parsed)),
-            "error": str(error).replace(",", " ")[:120] if error else "",
+            "concurrency": concurrency,
+            "runs": len(samples),
+            "p50_ms": round(percentile(latencies, 0.50), 2),
+            "p90_ms": round(percentile(latencies, 0.90), 2),
+            "p99_ms": round(percentile(latencies, 0.99), 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "throughput_rps": round(len(samples) / wall, 2) if wall > 0 else None,
+            "error_rate": round(len(failures) / len(samples), 4),
+            "json_parse_rate": round(sum(parsed) / len(parsed), 4) if parsed else None,
+            "errors": sorted({str(sample[3])[:120] for sample in failures})[:5],
         }
 
     def _best_model(self, rows):
         grouped = {}
         for row in rows:
-            bucket = grouped.setdefault(row["model"], {"success": 0, "count": 0, "elapsed": 0.0})
-            bucket["success"] += int(row["success"])
-            bucket["count"] += 1
-            bucket["elapsed"] += float(row["elapsed_ms"])
+            bucket = grouped.setdefault(row["model"], {"success": 0.0, "count": 0, "p50": 0.0})
+            bucket["success"] += (1 - row["error_rate"]) * row["runs"]
+            bucket["count"] += row["runs"]
+            bucket["p50"] += row["p50_ms"] * row["runs"]
         ranked = sorted(
             grouped.items(),
-            key=lambda item: (item[1]["success"] / item[1]["count"], -item[1]["elapsed"] / item[1]["count"]),
+            key=lambda item: (item[1]["success"] / item[1]["count"], -item[1]["p50"] / item[1]["count"]),
             reverse=True,
         )
         return ranked[0][0] if ranked else None
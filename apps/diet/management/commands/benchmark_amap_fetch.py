@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from apps.diet.domains.discovery.amap_fetcher import AMapFetcher
+from apps.diet.domains.discovery.amap_stub_server import StubAMapServer
+from apps.diet.domains.tools.ai_executor import AIExecutor
+
+
+class Command(BaseCommand):
+    help = "Compare sequential and parallel AMap nearby paging, optionally against a local stub server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lng", type=float, default=116.3975)
+        parser.add_argument("--lat", type=float, default=39.9087)
+        parser.add_argument("--radius", type=int, default=3000)
+        parser.add_argument("--pages", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=3, help="Timed runs per mode.")
+        parser.add_argument("--stub", action="store_true", help="Serve a local AMap stand-in instead of the real API.")
+        parser.add_argument("--stub-latency-ms", type=int, default=150, help="Artificial latency of the stub server.")
+        parser.add_argument("--stub-total", type=int, default=60, help="POIs served by the stub server.")
+
+    def handle(self, *args, **options):
+        if not options["stub"]:
+            self._run(options)
+            return
+        with StubAMapServer(total=options["stub_total"], latency_ms=options["stub_latency_ms"]) as stub:
+            with override_settings(AMAP_BASE_URL=stub.base_url, AMAP_WEB_KEY=settings.AMAP_WEB_KEY or "stub-key"):
+                self._run(options)
+            self.stdout.write(f"Stub served {stub.requests} requests, peak concurrency {stub.peak_concurrency}.")
+
+    def _run(self, options):
+        args = (options["lng"], options["lat"], options["radius"])
+        pages = max(options["pages"], 1)
+        self.stdout.write(f"Rate limit {AMapFetcher._rate_limit():g} req/s, up to {pages} pages.")
+
+        async def sequential():
+            pois = []
+            for page in range(1, pages + 1):
+                page_pois, _ = await AMapFetcher.fetch_page(*args, page=page)
+                if not page_pois:
+                    break
+                pois.extend(page_pois)
+            return pois
+
+        async def parallel():
+            return await AMapFetcher.fetch_pages(*args, pages=pages)
+
+        for label, factory in (("sequential", sequential), ("parallel", parallel)):
+            timings, count = [], 0
+            for _ in range(max(options["repeat"], 1)):
+                started_at = time.perf_counter()
+                count = len(AIExecutor.run(factory, timeout=60))
+                timings.append((time.perf_counter() - started_at) * 1000)
+                # 每轮之间清空限速窗口，避免上一轮的排队影响下一轮耗时
+                AMapFetcher._next_slot = 0.0
+            timings.sort()
+            self.stdout.write(
+                f"{label}: {count} POIs, p50 {timings[len(timings) // 2]:.1f} ms, "
+                f"min {timings[0]:.1f} ms, max {timings[-1]:.1f} ms"
+            )
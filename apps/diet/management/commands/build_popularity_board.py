@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from apps.diet.domains.discovery.popularity_board import PopularityBoard
+
+
+class Command(BaseCommand):
+    help = "Rebuild the time-decayed recipe popularity board from likes, saves and intake logs."
+
+    def handle(self, *args, **options):
+        self.stdout.write("Aggregating recipe likes, saves and intake logs...")
+        meta = PopularityBoard.build()
+        self.stdout.write(self.style.SUCCESS(f"Popularity board rebuilt: {meta['items']} recipes."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from apps.diet.domains.discovery.similarity_index import ItemSimilarityIndex
+
+
+class Command(BaseCommand):
+    help = "Rebuild the item-item similarity index used by collaborative recommendations."
+
+    def handle(self, *args, **options):
+        self.stdout.write("Loading recipe likes, saves and intake logs...")
+        meta = ItemSimilarityIndex.build()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Similarity index v{meta['version']} built: {meta['items']} recipes from {meta['users']} users."
+            )
+        )
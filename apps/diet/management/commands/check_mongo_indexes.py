@@ -0,0 +1,135 @@
+from django.core.management.base import BaseCommand
+from mongoengine.queryset.visitor import Q
+from pymongo.errors import PyMongoError
+
+from apps.common.utils import search_tokens
+from apps.diet.domains.discovery.lbs_service import LBSService
+from apps.diet.domains.discovery.matching_service import MatchingService
+from apps.diet.domains.discovery.recommendation_service import RecommendationService
+from apps.diet.models.mongo.community import Comment, CommunityFeed
+from apps.diet.models.mongo.recipe import Recipe
+from apps.diet.models.mongo.restaurant import Restaurant
+
+
+DOCUMENTS = (Recipe, Restaurant, CommunityFeed, Comment)
+SAMPLE_INGREDIENTS = ["鸡蛋", "西红柿", "土豆"]
+SAMPLE_LOCATION = (116.3975, 39.9087)
+
+
+def hot_queries():
+    """Queries issued by the recommendation and audit paths, as (label, queryset)."""
+    return [
+        (
+            "MatchingService scan: fridge ingredients",
+            Recipe.objects(
+                MatchingService._filter_query({}) & Q(ingredients_search__in=SAMPLE_INGREDIENTS)
+            ).limit(100),
+        ),
+        (
+            "MatchingService: tag + calorie filters",
+            Recipe.objects(MatchingService._filter_query({"tags": ["川菜"], "calorie_max": 600})).limit(100),
+        ),
+        (
+            "RecommendationService._recipe_filter_query: difficulty + calories",
+            Recipe.objects(
+                RecommendationService._recipe_filter_query(
+                    {"difficulty": "简单", "calorie_min": 200, "calorie_max": 600, "allergens": ["花生"]}
+                )
+            ).limit(100),
+        ),
+        (
+            "RecommendationService._fallback_recipes: newest approved",
+            Recipe.objects(RecommendationService._recipe_filter_query({})).order_by("-created_at").limit(20),
+        ),
+        (
+            "RecipeAuditViewSet.list: all, newest first",
+            Recipe.objects.all().order_by("-created_at").limit(20),
+        ),
+        (
+            "RecipeAuditViewSet.list: pending, newest first",
+            Recipe.objects(status=0).order_by("-created_at").limit(20),
+        ),
+        (
+            "RecipeAuditViewSet.list: keyword search",
+            Recipe.objects(search_tokens__all=search_tokens("番茄炒蛋", for_query=True)).order_by("-created_at").limit(20),
+        ),
+        (
+            "LBSService.nearby_queryset: health score sort",
+            LBSService.nearby_queryset(*SAMPLE_LOCATION, 3000, "health", 70).limit(LBSService.LIMIT),
+        ),
+    ]
+
+
+def missing_indexes(document):
+    """Declared index specs of ``document`` that do not exist on its collection."""
+    existing = [[tuple(field) for field in info["key"]] for info in document._get_collection().index_information().values()]
+    missing = []
+    for spec in document._meta.get("index_specs", []):
+        fields = [tuple(field) for field in spec["fields"]]
+        if fields not in existing:
+            missing.append(fields)
+    return missing
+
+
+def summarize_plan(explain):
+    """Flatten a winning plan into ``(stages, index_names)``."""
+    stages, indexes = [], []
+    pending = [explain.get("queryPlanner", {}).get("winningPlan", {})]
+    while pending:
+        node = pending.pop(0)
+        if not node:
+            continue
+        # 新版本 MongoDB 可能把执行计划包在 queryPlan 中
+        node = node.get("queryPlan", node)
+        stages.append(node.get("stage", "?"))
+        if node.get("indexName"):
+            indexes.append(node["indexName"])
+        pending.extend(filter(None, [node.get("inputStage")]))
+        pending.extend(node.get("inputStages", []))
+    return stages, indexes
+
+
+class Command(BaseCommand):
+    help = "Verify declared MongoDB indexes and print explain() plans for hot recipe queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--create", action="store_true", help="Create missing indexes before checking plans.")
+        parser.add_argument("--skip-explain", action="store_true", help="Only check index presence.")
+
+    def handle(self, *args, **options):
+        missing_count, scan_count = 0, 0
+        try:
+            for document in DOCUMENTS:
+                if options["create"]:
+                    document.ensure_indexes()
+                name = document._get_collection_name()
+                missing = missing_indexes(document)
+                if missing:
+                    missing_count += len(missing)
+                    for fields in missing:
+                        self.stdout.write(self.style.ERROR(f"[missing] {name}: {fields}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"[ok] {name}: all declared indexes present"))
+
+            if not options["skip_explain"]:
+                self.stdout.write("")
+                for label, queryset in hot_queries():
+                    stages, indexes = summarize_plan(queryset.explain())
+                    line = f"{label}: {' <- '.join(stages)}"
+                    if indexes:
+                        line += f" (index: {', '.join(indexes)})"
+                    if "COLLSCAN" in stages:
+                        scan_count += 1
+                        self.stdout.write(self.style.WARNING(f"[scan] {line}"))
+                    else:
+                        self.stdout.write(f"[plan] {line}")
+        except PyMongoError as exc:
+            self.stdout.write(self.style.ERROR(f"MongoDB unavailable: {exc}"))
+            return
+
+        if missing_count:
+            self.stdout.write(self.style.WARNING(f"{missing_count} declared index(es) missing; run with --create to build them."))
+        if scan_count:
+            self.stdout.write(self.style.WARNING(f"{scan_count} hot query(ies) fall back to a collection scan."))
+        if not missing_count and not scan_count:
+            self.stdout.write(self.style.SUCCESS("All declared indexes exist and hot queries are index-backed."))
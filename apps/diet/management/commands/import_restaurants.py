@@ -0,0 +1,70 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.diet.domains.discovery.restaurant_ingest import RestaurantIngestor
+
+
+class Command(BaseCommand):
+    help = "Stream a JSONL dump of restaurant POIs into MongoDB with batched upserts keyed by amap_id."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSONL file with one POI per line, or '-' for stdin.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="POIs per bulk write.")
+        parser.add_argument("--progress-every", type=int, default=10, help="Report progress every N batches.")
+
+    def handle(self, *args, **options):
+        batch_size = max(options["batch_size"], 1)
+        progress_every = max(options["progress_every"], 1)
+        totals = {"lines": 0, "inserted": 0, "updated": 0, "skipped": 0, "failed": 0}
+        batches = 0
+        started_at = time.monotonic()
+
+        try:
+            stream = sys.stdin if options["path"] == "-" else open(options["path"], encoding="utf-8")
+        except OSError as exc:
+            raise CommandError(f"Cannot open {options['path']}: {exc}")
+
+        def write(batch):
+            stats, _ = RestaurantIngestor.upsert(batch)
+            for field, value in stats.items():
+                totals[field] += value
+
+        try:
+            batch = []
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                totals["lines"] += 1
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    totals["skipped"] += 1
+                    continue
+                if len(batch) >= batch_size:
+                    write(batch)
+                    batch = []
+                    batches += 1
+                    if batches % progress_every == 0:
+                        self._progress(totals, started_at)
+            if batch:
+                write(batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self._progress(totals, started_at)
+        self.stdout.write(self.style.SUCCESS(
+            f"Restaurant import finished: {totals['inserted']} inserted, {totals['updated']} updated, "
+            f"{totals['skipped']} skipped, {totals['failed']} failed."
+        ))
+
+    def _progress(self, totals, started_at):
+        elapsed = max(time.monotonic() - started_at, 1e-6)
+        self.stdout.write(
+            f"  {totals['lines']} lines read, {totals['inserted'] + totals['updated']} upserted "
+            f"({totals['lines'] / elapsed:.0f} lines/s)"
+        )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from apps.common.utils import search_tokens
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
+from apps.diet.models.mongo.recipe import Recipe, build_recipe_search_tokens
+from apps.diet.models.mongo.restaurant import Restaurant
+
+
+class Command(BaseCommand):
+    help = "Backfill the n-gram search_tokens field on recipes and restaurants."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Documents per bulk write.")
+
+    def handle(self, *args, **options):
+        batch_size = max(options["batch_size"], 1)
+        recipes = self._backfill(
+            Recipe,
+            ("id", "name", "dish", "keywords", "ingredients_search"),
+            lambda doc: build_recipe_search_tokens(
+                doc.get("name"), doc.get("dish"), doc.get("keywords"), doc.get("ingredients_search")
+            ),
+            batch_size,
+        )
+        restaurants = self._backfill(
+            Restaurant,
+            ("id", "name"),
+            lambda doc: sorted(set(search_tokens(doc.get("name")))),
+            batch_size,
+        )
+        RecipeCatalog.mark_changed()
+        self.stdout.write(self.style.SUCCESS(f"Search tokens rebuilt: {recipes} recipes, {restaurants} restaurants."))
+
+    def _backfill(self, document, fields, build_tokens, batch_size):
+        collection = document._get_collection()
+        updated, operations = 0, []
+        for doc in document.objects.only(*fields).as_pymongo().batch_size(batch_size):
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"search_tokens": build_tokens(doc)}}))
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                updated += len(operations)
+                operations = []
+                self.stdout.write(f"  {document._get_collection_name()}: {updated} updated...")
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+        return updated
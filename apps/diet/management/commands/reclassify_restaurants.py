@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from apps.diet.domains.discovery.health_classifier import CLASSIFIER_VERSION, HealthClassifier
+from apps.diet.models.mongo.restaurant import Restaurant
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored health light, score and calorie estimate of restaurants."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Documents per bulk write.")
+        parser.add_argument(
+            "--stale-only",
+            action="store_true",
+            help="Only restaurants never classified or classified by an older rule table version.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options["batch_size"], 1)
+        queryset = Restaurant.objects(health_version__ne=CLASSIFIER_VERSION) if options["stale_only"] else Restaurant.objects
+        collection = Restaurant._get_collection()
+        updated, operations = 0, []
+        for doc in queryset.only("id", "name", "type", "menu").as_pymongo().batch_size(batch_size):
+            fields = HealthClassifier.classify(doc.get("type"), doc.get("name"), doc.get("menu"))
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                updated += len(operations)
+                operations = []
+                self.stdout.write(f"  {updated} restaurants reclassified...")
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+        self.stdout.write(self.style.SUCCESS(f"Restaurant health classification rebuilt: {updated} restaurants."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from apps.diet.domains.community.comments import FeedComments
+
+
+class Command(BaseCommand):
+    help = "Repair feed comments_count and embedded comment previews from the comment collection."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Feeds per reconciliation batch.")
+        parser.add_argument("--dirty-only", action="store_true", help="Only re-check feeds marked dirty in Redis.")
+
+    def handle(self, *args, **options):
+        batch_size = max(options["batch_size"], 1)
+        if options["dirty_only"]:
+            self.stdout.write("Reconciling comment counts of dirty feeds...")
+            stats = FeedComments.reconcile_dirty(batch_size=batch_size)
+        else:
+            self.stdout.write("Reconciling comment counts of all feeds...")
+            stats = FeedComments.reconcile(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Checked {stats['feeds']} feeds: {stats['fixed']} fixed."))
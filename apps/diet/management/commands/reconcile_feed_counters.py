@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.diet.domains.community.counters import FeedCounters
+
+
+class Command(BaseCommand):
+    help = "Flush pending feed like/save ops and repair drift between Redis, MySQL preferences and Mongo counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Feeds per reconciliation batch.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Reconciling community like/save counters...")
+        stats = FeedCounters.reconcile(batch_size=max(options["batch_size"], 1))
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {stats['feeds']} feeds: {stats['counts_fixed']} counts fixed, "
+            f"{stats['rows_added']} preference rows added, {stats['rows_removed']} removed."
+        ))
@@ -6,6 +6,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from mongoengine.errors import MongoEngineException
 
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
 from apps.diet.models.mongo.community import Comment, CommunityFeed
 from apps.diet.models.mongo.recipe import Recipe
 from apps.diet.models.mongo.restaurant import Restaurant
@@ -227,6 +228,7 @@ class Command(BaseCommand):
                 recipe.status = 1
                 recipe.save()
                 recipes.append(recipe)
+            RecipeCatalog.mark_changed()
         except MongoEngineException as exc:
             self.stdout.write(self.style.WARNING(f"Mongo recipe seed skipped: {exc}"))
         return recipes
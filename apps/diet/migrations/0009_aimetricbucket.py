@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diet', '0008_alter_userfeaturedbadge_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIMetricBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField(verbose_name='时间桶起点')),
+                ('task_name', models.CharField(max_length=64, verbose_name='任务')),
+                ('task_type', models.CharField(default='', max_length=20, verbose_name='路由类型')),
+                ('model_name', models.CharField(default='', max_length=128, verbose_name='模型')),
+                ('source', models.CharField(choices=[('live', '线上调用'), ('benchmark', '基准测试')], default='live', max_length=20, verbose_name='来源')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='调用次数')),
+                ('success_count', models.PositiveIntegerField(default=0, verbose_name='成功次数')),
+                ('json_checked', models.PositiveIntegerField(default=0, verbose_name='需解析 JSON 次数')),
+                ('json_failed', models.PositiveIntegerField(default=0, verbose_name='JSON 解析失败次数')),
+                ('cache_hits', models.PositiveIntegerField(default=0, verbose_name='缓存命中次数')),
+                ('total_ms', models.FloatField(default=0, verbose_name='累计耗时(ms)')),
+                ('max_ms', models.FloatField(default=0, verbose_name='最大耗时(ms)')),
+                ('histogram', models.JSONField(default=list, verbose_name='耗时直方图')),
+            ],
+            options={
+                'verbose_name': 'AI 调用指标',
+                'db_table': 'diet_aimetricbucket',
+                'indexes': [models.Index(fields=['source', 'bucket_start'], name='diet_aimetr_source_15b77c_idx')],
+                'unique_together': {('bucket_start', 'task_name', 'model_name', 'source')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('diet', '0009_aimetricbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIChatContext',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('user', '用户'), ('assistant', 'AI')], max_length=20, verbose_name='角色')),
+                ('content', models.TextField(verbose_name='对话内容')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_chats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'AI 对话历史',
+                'db_table': 'diet_aichatcontext',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='diet_aichat_user_id_30f83d_idx')],
+            },
+        ),
+    ]
@@ -3,6 +3,8 @@ from .mysql.journal import DailyIntake, WorkoutRecord, WeightRecord
 from .mysql.preference import UserPreference
 # [新增]
 from .mysql.gamification import ChallengeTask, Remedy
+from .mysql.ai_metrics import AIMetricBucket
+from .mysql.ai_context import AIChatContext
 
 from .mongo.recipe import Recipe
 from .mongo.restaurant import Restaurant
\ No newline at end of file
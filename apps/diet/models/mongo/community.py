@@ -8,7 +8,8 @@ class CommunityFeed(Document):
     """
     meta = {
         'collection': 'community_feed',
-        'indexes': ['-created_at', 'feed_type']
+        # (user_id, -created_at) 支撑个人主页与关注流读时拉取的按作者倒序查询
+        'indexes': ['-created_at', 'feed_type', ('user_id', '-created_at')]
     }
     user_id = IntField(required=True) # 关联 MySQL 中的 User ID
     content = StringField(required=True)
@@ -23,6 +24,8 @@ class CommunityFeed(Document):
     
     likes_count = IntField(default=0)
     comments_count = IntField(default=0)
+    # 最新几条评论的冗余快照 {id, user_id, content, created_at}，供动态流内嵌预览
+    recent_comments = ListField(DictField())
     save_count = IntField(default=0)
     report_count = IntField(default=0)
     created_at = DateTimeField(default=datetime.datetime.utcnow)
@@ -36,7 +39,8 @@ class Comment(Document):
     """
     meta = {
         'collection': 'community_comment',
-        'indexes': ['feed_id', '-created_at']
+        # (feed_id, -created_at, -id) 支撑单帖评论的游标分页
+        'indexes': ['feed_id', '-created_at', ('feed_id', '-created_at', '-id')]
     }
     feed_id = ReferenceField(CommunityFeed, reverse_delete_rule=CASCADE) # 级联删除
     user_id = IntField(required=True)
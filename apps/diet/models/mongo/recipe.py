@@ -1,6 +1,8 @@
 from mongoengine import Document, StringField, ListField, IntField, DictField, DateTimeField
 from datetime import datetime
 
+from apps.common.utils import normalize_ingredient_name, search_tokens
+
 class Recipe(Document):
     """菜谱集合 (MongoDB)"""
     name = StringField(required=True, max_length=128)
@@ -23,4 +25,36 @@ class Recipe(Document):
     status = IntField(default=0, verbose_name="审核状态") 
     created_at = DateTimeField(default=datetime.now)
 
-    meta = {'collection': 'recipes'}
\ No newline at end of file
+    # 名称/菜名/标签/食材的 n-gram 分词，供无正则扫描的关键词检索使用
+    search_tokens = ListField(StringField())
+
+    meta = {
+        'collection': 'recipes',
+        'indexes': [
+            ('status', '-created_at'),              # 审核列表 / 最新菜谱兜底
+            '-created_at',                          # 后台全量列表按时间倒序
+            ('status', 'ingredients_search'),       # 冰箱食材匹配 (多键索引)
+            ('keywords', 'status'),                 # 标签筛选 / 转盘菜系聚合 (多键索引)
+            ('status', 'difficulty', 'calories'),   # 难度 + 热量区间筛选
+            ('status', 'calories'),                 # 仅热量区间筛选
+            ('search_tokens', 'status'),            # 关键词 n-gram 检索 (多键索引)
+        ]
+    }
+
+    def clean(self):
+        self.search_tokens = build_recipe_search_tokens(
+            self.name, self.dish, self.keywords, self.ingredients_search
+        )
+
+
+def build_recipe_search_tokens(name, dish=None, keywords=None, ingredients=None):
+    """菜谱检索分词：食材同时收录原名与归一化名，便于 "番茄" 搜到 "西红柿" """
+    texts = [name or "", dish or ""]
+    texts.extend(keywords or [])
+    for ingredient in ingredients or []:
+        texts.append(ingredient)
+        texts.append(normalize_ingredient_name(ingredient))
+    tokens = set()
+    for text in texts:
+        tokens.update(search_tokens(text))
+    return sorted(tokens)
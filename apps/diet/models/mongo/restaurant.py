@@ -1,6 +1,9 @@
-from mongoengine import Document, StringField, FloatField, ListField, PointField, DateTimeField, DictField
+from mongoengine import Document, StringField, FloatField, IntField, ListField, PointField, DateTimeField, DictField
 import datetime
 
+from apps.common.utils import search_tokens
+from apps.diet.domains.discovery.health_classifier import HealthClassifier
+
 class Restaurant(Document):
     """周边餐饮缓存 (MongoDB)"""
     amap_id = StringField(unique=True)
@@ -17,11 +20,28 @@ class Restaurant(Document):
     menu = ListField(DictField()) 
     
     cached_at = DateTimeField(default=datetime.datetime.now)
+
+    # 店名 n-gram 分词，后台检索走多键索引而非正则扫描
+    search_tokens = ListField(StringField())
+
+    # 入库/更新时按规则表预计算的健康分级，地理查询可直接按分数过滤排序
+    health_light = StringField()
+    health_score = IntField()
+    est_calories = IntField()
+    health_tags = ListField(StringField())
+    health_version = IntField()
     
     meta = {
         'collection': 'restaurant_cache',
         'indexes': [
             'location',     # 地理位置索引
-            'amap_id'
+            'amap_id',
+            'search_tokens',
+            {'fields': ['(location', '-health_score']},
         ]
-    }
\ No newline at end of file
+    }
+
+    def clean(self):
+        self.search_tokens = sorted(set(search_tokens(self.name)))
+        for field, value in HealthClassifier.classify(self.type, self.name, self.menu).items():
+            setattr(self, field, value)
\ No newline at end of file
@@ -11,4 +11,7 @@ class AIChatContext(models.Model):
     class Meta:
         db_table = 'diet_aichatcontext'
         verbose_name = "AI 对话历史"
-        ordering = ['created_at']  # 保证按时间顺序拼接
\ No newline at end of file
+        ordering = ['created_at']  # 保证按时间顺序拼接
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
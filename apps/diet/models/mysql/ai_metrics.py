@@ -0,0 +1,31 @@
+from django.db import models
+
+
+class AIMetricBucket(models.Model):
+    """AI 调用指标的时间分桶聚合 (按 任务 × 模型 × 来源 × 时间桶)"""
+    SOURCE_CHOICES = (
+        ('live', '线上调用'),
+        ('benchmark', '基准测试'),
+    )
+
+    bucket_start = models.DateTimeField(verbose_name="时间桶起点")
+    task_name = models.CharField(max_length=64, verbose_name="任务")
+    task_type = models.CharField(max_length=20, default='', verbose_name="路由类型")
+    model_name = models.CharField(max_length=128, default='', verbose_name="模型")
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='live', verbose_name="来源")
+    count = models.PositiveIntegerField(default=0, verbose_name="调用次数")
+    success_count = models.PositiveIntegerField(default=0, verbose_name="成功次数")
+    json_checked = models.PositiveIntegerField(default=0, verbose_name="需解析 JSON 次数")
+    json_failed = models.PositiveIntegerField(default=0, verbose_name="JSON 解析失败次数")
+    cache_hits = models.PositiveIntegerField(default=0, verbose_name="缓存命中次数")
+    total_ms = models.FloatField(default=0, verbose_name="累计耗时(ms)")
+    max_ms = models.FloatField(default=0, verbose_name="最大耗时(ms)")
+    histogram = models.JSONField(default=list, verbose_name="耗时直方图")
+
+    class Meta:
+        db_table = 'diet_aimetricbucket'
+        verbose_name = "AI 调用指标"
+        unique_together = ('bucket_start', 'task_name', 'model_name', 'source')
+        indexes = [
+            models.Index(fields=['source', 'bucket_start']),
+        ]
@@ -26,8 +26,7 @@ class FeedResponseEnhancer:
         if not feed_list:
             return []
             
-        from apps.users.models import User
-        from apps.diet.models.mysql.gamification import UserFeaturedBadge
+        from apps.diet.domains.community.user_cards import UserCards
         
         # 1. 批量收集 User ID
         user_ids = set()
@@ -36,41 +35,17 @@ class FeedResponseEnhancer:
             if uid:
                 user_ids.add(int(uid))
                 
-        user_ids = list(user_ids)
         if not user_ids:
             return feed_list
             
-        # 2. 批量查询 MySQL 组装用户信息与徽章
-        users = User.objects.filter(id__in=user_ids).select_related('profile')
-        user_map = {}
-        for u in users:
-            avatar_url = u.avatar
-            if not avatar_url and hasattr(u, 'profile') and u.profile.avatar:
-                avatar_url = u.profile.avatar.url if hasattr(u.profile.avatar, 'url') else str(u.profile.avatar)
-                
-            user_map[u.id] = {
-                "id": u.id,
-                "nickname": u.nickname or u.username,
-                "avatar": avatar_url,
-                "signature": u.profile.signature if hasattr(u, 'profile') else ""
-            }
-            
-        badges = UserFeaturedBadge.objects.filter(user_id__in=user_ids).select_related('achievement')
-        badges_map = {uid: [] for uid in user_ids}
-        for b in badges:
-            badges_map[b.user_id].append({
-                "id": str(b.achievement.id),
-                "name": b.achievement.title,
-                "icon": b.achievement.icon or "🏅"
-            })
+        # 2. 批量读取用户名片 (昵称、头像、签名、代表徽章)
+        user_map = UserCards.get_many(user_ids)
             
         # 3. 数据回填与兼容格式化
         for item in feed_list:
             uid = item.get('user_id') or item.get('user', {}).get('id')
             if uid and int(uid) in user_map:
-                u_info = user_map[int(uid)].copy()
-                u_info["featured_badges"] = badges_map.get(int(uid), [])
-                item['user'] = u_info
+                item['user'] = user_map[int(uid)]
                 
             # 状态兜底防腐
             if 'is_saved' not in item:
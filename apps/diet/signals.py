@@ -0,0 +1,78 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.diet.domains.community.user_cards import UserCards
+from apps.diet.domains.discovery.popularity_board import PopularityBoard
+from apps.diet.domains.discovery.recommendation_cache import RecommendationCache
+from apps.diet.domains.discovery.similarity_index import ItemSimilarityIndex
+from apps.diet.models import DailyIntake, FridgeItem, UserPreference
+from apps.diet.models.mysql.gamification import UserAchievement, UserFeaturedBadge
+from apps.users.models import Profile, User
+
+
+def _is_recipe_preference(instance):
+    return instance.target_type == "recipe" and instance.action in ("like", "save")
+
+
+def _is_recipe_intake(instance):
+    return instance.source_type == 1 and bool(instance.source_id)
+
+
+@receiver(post_save, sender=UserPreference)
+def preference_saved(sender, instance, created, **kwargs):
+    if instance.target_type == "recipe":
+        RecommendationCache.invalidate(instance.user_id)
+    if created and _is_recipe_preference(instance):
+        ItemSimilarityIndex.record_interaction(instance.user_id, instance.target_id, added=True)
+        PopularityBoard.record(instance.target_id, instance.action, instance.created_at, added=True)
+
+
+@receiver(post_delete, sender=UserPreference)
+def preference_deleted(sender, instance, **kwargs):
+    if instance.target_type == "recipe":
+        RecommendationCache.invalidate(instance.user_id)
+    if _is_recipe_preference(instance):
+        ItemSimilarityIndex.record_interaction(instance.user_id, instance.target_id, added=False)
+        PopularityBoard.record(instance.target_id, instance.action, instance.created_at, added=False)
+
+
+@receiver(post_save, sender=DailyIntake)
+def intake_saved(sender, instance, created, **kwargs):
+    if created and _is_recipe_intake(instance):
+        ItemSimilarityIndex.record_interaction(instance.user_id, instance.source_id, added=True)
+        PopularityBoard.record(instance.source_id, "intake", instance.record_date, added=True)
+
+
+@receiver(post_delete, sender=DailyIntake)
+def intake_deleted(sender, instance, **kwargs):
+    if _is_recipe_intake(instance):
+        ItemSimilarityIndex.record_interaction(instance.user_id, instance.source_id, added=False)
+        PopularityBoard.record(instance.source_id, "intake", instance.record_date, added=False)
+
+
+@receiver(post_save, sender=FridgeItem)
+@receiver(post_delete, sender=FridgeItem)
+def fridge_changed(sender, instance, **kwargs):
+    RecommendationCache.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or "allergens" in update_fields:
+        RecommendationCache.invalidate(instance.user_id)
+    if update_fields is None or {"avatar", "signature"} & set(update_fields):
+        UserCards.invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or {"nickname", "username", "avatar"} & set(update_fields)):
+        UserCards.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=UserFeaturedBadge)
+@receiver(post_delete, sender=UserFeaturedBadge)
+@receiver(post_save, sender=UserAchievement)
+@receiver(post_delete, sender=UserAchievement)
+def badges_changed(sender, instance, **kwargs):
+    UserCards.invalidate([instance.user_id])
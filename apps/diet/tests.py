@@ -1,28 +1,69 @@
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
 from types import SimpleNamespace
 from unittest.mock import patch
 
+from bson import ObjectId
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, override_settings
 from django.urls import resolve
 from django.utils import timezone
+from PIL import Image
 from rest_framework.test import APIClient
 
 from apps.admin_management.models import AuditLog
+from apps.common.exceptions import BusinessException
+from apps.common.pagination import decode_cursor, keyset_paginate
+from apps.common.uploads import SizeLimitUploadHandler
+from apps.common.utils import geohash_encode, search_tokens, stream_to_data_url, uploaded_image_to_data_url
+from apps.diet.domains.community.comments import FeedComments
+from apps.diet.domains.community.counters import FeedCounters
 from apps.diet.domains.community.services import CommunityService
+from apps.diet.domains.community.timeline import FollowTimeline
+from apps.diet.domains.community.user_cards import UserCards
+from apps.diet.domains.discovery.amap_fetcher import AMapFetcher
+from apps.diet.domains.discovery.amap_stub_server import StubAMapServer
+from apps.diet.domains.discovery.health_classifier import CLASSIFIER_VERSION, HealthClassifier
+from apps.diet.domains.discovery.ingredient_index import IngredientIndex, IngredientIndexSnapshot
+from apps.diet.domains.discovery.lbs_service import LBSService
+from apps.diet.domains.discovery.popularity_board import PopularityBoard
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
+from apps.diet.domains.discovery.recipe_search import RecipeSearchIndex, RecipeSearchSnapshot
 from apps.diet.domains.discovery.recommendation_service import RecommendationService
+from apps.diet.domains.discovery.scoring_engine import HybridScoringEngine
+from apps.diet.domains.discovery.similarity_index import ItemSimilarityIndex
 from apps.diet.domains.discovery.wheel_engine import WheelEngine
 from apps.diet.domains.gamification.services import GamificationService
+from apps.diet.domains.tools.ai_executor import AIExecutor, AIQueueTimeout
+from apps.diet.domains.tools.circuit_breaker import CircuitBreaker
 from apps.diet.domains.tools.ai_service import AIService
+from apps.diet.domains.tools.chat_context import ChatContextStore
 from apps.diet.models.mysql.gamification import (
     Achievement,
     ChallengeTask,
     Remedy,
+    UserAchievement,
     UserChallengeProgress,
     UserFeaturedBadge,
 )
+from apps.diet.models.mongo.community import Comment, CommunityFeed
+from apps.diet.models.mongo.recipe import Recipe
+from apps.diet.models.mongo.restaurant import Restaurant
+from apps.diet.models.mysql.ai_context import AIChatContext
+from apps.diet.models.mysql.ai_metrics import AIMetricBucket
 from apps.diet.models.mysql.journal import DailyIntake, WaterIntake
+from apps.diet.models.mysql.pantry import FridgeItem
 from apps.diet.models.mysql.preference import UserPreference
-from apps.users.models import Profile
+from apps.users.models import Profile, UserFollow
 
 
 User = get_user_model()
@@ -42,6 +83,198 @@ class FakeCommunityFeed:
         return None
 
 
+class FakeRedis:
+    """In-memory subset of the redis-py client used by the counter and timeline code."""
+
+    def __init__(self):
+        self.data = {}
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def set(self, key, value, **kwargs):
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def sadd(self, key, *values):
+        members = self.data.setdefault(key, set())
+        before = len(members)
+        members.update(str(value) for value in values)
+        return len(members) - before
+
+    def srem(self, key, *values):
+        members = self.data.get(key, set())
+        before = len(members)
+        members.difference_update(str(value) for value in values)
+        return before - len(members)
+
+    def spop(self, key, count=None):
+        members = self.data.get(key, set())
+        popped = [members.pop().encode() for _ in range(min(count or 1, len(members)))]
+        return popped if count is not None else (popped[0] if popped else None)
+
+    def scard(self, key):
+        return len(self.data.get(key, ()))
+
+    def sismember(self, key, value):
+        return int(str(value) in self.data.get(key, ()))
+
+    def smembers(self, key):
+        return {member.encode() for member in self.data.get(key, ())}
+
+    def rpush(self, key, *values):
+        items = self.data.setdefault(key, [])
+        items.extend(values)
+        return len(items)
+
+    def lrange(self, key, start, end):
+        return list(self.data.get(key, [])[start:None if end == -1 else end + 1])
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.data.get(key, [])[start:None if end == -1 else end + 1]
+        return True
+
+    def get(self, key):
+        value = self.data.get(key)
+        return None if value is None else str(value).encode()
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def incrby(self, key, amount=1):
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    def expire(self, key, seconds):
+        return int(key in self.data)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        entry = self.data.setdefault(key, {})
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = sum(1 for name in items if str(name) not in entry)
+        entry.update({str(name): int(item) for name, item in items.items()})
+        return added
+
+    def hincrby(self, key, field, amount=1):
+        entry = self.data.setdefault(key, {})
+        entry[str(field)] = entry.get(str(field), 0) + amount
+        return entry[str(field)]
+
+    def hgetall(self, key):
+        return {name.encode(): str(value).encode() for name, value in self.data.get(key, {}).items()}
+
+    def zadd(self, key, mapping):
+        members = self.data.setdefault(key, {})
+        added = sum(1 for member in mapping if str(member) not in members)
+        members.update({str(member): float(score) for member, score in mapping.items()})
+        return added
+
+    def zrem(self, key, *values):
+        members = self.data.get(key, {})
+        return sum(1 for value in values if members.pop(str(value), None) is not None)
+
+    def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def _zsorted(self, key):
+        return sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    def zremrangebyrank(self, key, start, end):
+        ordered = self._zsorted(key)
+        doomed = ordered[start:None if end == -1 else end + 1]
+        for member, _ in doomed:
+            del self.data[key][member]
+        return len(doomed)
+
+    def zrevrangebyscore(self, key, max, min, start=None, num=None, withscores=False):
+        high = float(max)
+        low = float(min)
+        rows = [(member.encode(), score) for member, score in reversed(self._zsorted(key)) if low <= score <= high]
+        if start is not None:
+            rows = rows[start:start + num]
+        return rows if withscores else [member for member, _ in rows]
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self)
+
+
+class FakeFeedQuerySet:
+    """Callable stand-in for ``CommunityFeed.objects`` over in-memory feeds."""
+
+    def __init__(self, feeds):
+        self.feeds = feeds
+
+    def __call__(self, **filters):
+        return self.filter(**filters)
+
+    def filter(self, **filters):
+        feeds = self.feeds
+        for name, value in filters.items():
+            field, _, op = name.partition("__")
+            if op == "in":
+                feeds = [feed for feed in feeds if getattr(feed, field) in value]
+            elif op == "lte":
+                feeds = [feed for feed in feeds if getattr(feed, field) <= value]
+            else:
+                feeds = [feed for feed in feeds if getattr(feed, field) == value]
+        return FakeFeedQuerySet(feeds)
+
+    def only(self, *fields):
+        return self
+
+    def order_by(self, *fields):
+        return FakeFeedQuerySet(sorted(self.feeds, key=lambda feed: (feed.created_at, feed.id), reverse=True))
+
+    def limit(self, count):
+        return FakeFeedQuerySet(self.feeds[:count])
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return iter(self.feeds)
+
+
+class FakeRedisPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+        self.buffering = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def watch(self, *keys):
+        self.buffering = False
+
+    def multi(self):
+        self.buffering = True
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+
+        def call(*args, **kwargs):
+            if not self.buffering:
+                return method(*args, **kwargs)
+            self.calls.append((name, args, kwargs))
+            return self
+
+        return call
+
+
+@override_settings(AI_METRICS_WORKER=False)
 class DietFeatureTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -165,21 +398,179 @@ class DietFeatureTests(TestCase):
         self.assertEqual(delete_response.status_code, 200)
         self.assertFalse(DailyIntake.objects.filter(id=record.id).exists())
 
-    def test_collaborative_scores_exclude_current_user_items(self):
-        behavior_map = {
-            1: {"recipe_a", "recipe_b"},
-            2: {"recipe_a", "recipe_c"},
-            3: {"recipe_b", "recipe_d"},
-            4: {"recipe_x"},
-        }
+    def test_similarity_index_scores_exclude_current_user_items(self):
+        cache.clear()
+        other = User.objects.create_user(username="diet-other", password="pass123456")
+        third = User.objects.create_user(username="diet-third", password="pass123456")
+        for owner, recipe_ids in [
+            (self.user, ["recipe_a", "recipe_b"]),
+            (other, ["recipe_a", "recipe_c"]),
+            (third, ["recipe_b", "recipe_d"]),
+        ]:
+            for recipe_id in recipe_ids:
+                UserPreference.objects.create(user=owner, target_id=recipe_id, target_type="recipe", action="like")
+
+        with patch("apps.diet.domains.discovery.similarity_index.threading.Thread") as thread:
+            # 冷启动请求不在请求线程内构建，只启动一次后台构建
+            self.assertEqual(ItemSimilarityIndex.get_user_scores(self.user.id), {})
+            self.assertEqual(ItemSimilarityIndex.get_user_scores(self.user.id), {})
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
 
-        scores = RecommendationService._compute_collaborative_scores(1, behavior_map)
+        ItemSimilarityIndex.build()
+        scores = ItemSimilarityIndex.get_user_scores(self.user.id)
 
         self.assertNotIn("recipe_a", scores)
         self.assertNotIn("recipe_b", scores)
         self.assertGreater(scores["recipe_c"], 0)
         self.assertGreater(scores["recipe_d"], 0)
 
+    def test_similarity_index_applies_incremental_preference_writes(self):
+        cache.clear()
+        other = User.objects.create_user(username="diet-other", password="pass123456")
+        UserPreference.objects.create(user=self.user, target_id="recipe_a", target_type="recipe", action="like")
+        UserPreference.objects.create(user=other, target_id="recipe_a", target_type="recipe", action="like")
+        ItemSimilarityIndex.build()
+
+        # 增量更新在事务提交后入队，由后台线程应用，不占用写请求
+        with patch.object(ItemSimilarityIndex, "ensure_worker") as ensure_worker, \
+                self.captureOnCommitCallbacks(execute=True):
+            pref = UserPreference.objects.create(user=other, target_id="recipe_e", target_type="recipe", action="save")
+        ensure_worker.assert_called_once()
+        self.assertNotIn("recipe_e", ItemSimilarityIndex.get_user_scores(self.user.id))
+        self.assertEqual(ItemSimilarityIndex.drain(), 1)
+        self.assertIn("recipe_e", ItemSimilarityIndex.get_user_scores(self.user.id))
+
+        with override_settings(RECOMMENDATION_INDEX_WORKER=False), self.captureOnCommitCallbacks(execute=True):
+            pref.delete()
+        self.assertNotIn("recipe_e", ItemSimilarityIndex.get_user_scores(self.user.id))
+
+    @override_settings(RECOMMENDATION_INDEX_WORKER=False)
+    def test_similarity_index_counts_pairs_with_redis_increments(self):
+        cache.clear()
+        fake = FakeRedis()
+        other = User.objects.create_user(username="diet-other", password="pass123456")
+        with patch("apps.diet.domains.discovery.similarity_index.get_redis", return_value=fake):
+            UserPreference.objects.create(user=self.user, target_id="recipe_a", target_type="recipe", action="like")
+            UserPreference.objects.create(user=other, target_id="recipe_a", target_type="recipe", action="like")
+            version = ItemSimilarityIndex.build()["version"]
+            self.assertEqual(fake.data[ItemSimilarityIndex._count_key(version, "recipe_a")], 2)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                pref = UserPreference.objects.create(user=other, target_id="recipe_e", target_type="recipe", action="save")
+            self.assertEqual(fake.data[ItemSimilarityIndex._item_key(version, "recipe_a")], {"recipe_e": 1})
+            self.assertEqual(fake.data[ItemSimilarityIndex._item_key(version, "recipe_e")], {"recipe_a": 1})
+            self.assertIn("recipe_e", ItemSimilarityIndex.get_user_scores(self.user.id))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                pref.delete()
+            self.assertEqual(fake.data[ItemSimilarityIndex._item_key(version, "recipe_a")], {"recipe_e": 0})
+            self.assertNotIn("recipe_e", ItemSimilarityIndex.get_user_scores(self.user.id))
+
+    def test_hybrid_engine_blends_all_signals_in_one_pass(self):
+        recipes = [
+            SimpleNamespace(id="recipe_fridge", name="番茄炒蛋", ingredients_search=["番茄", "鸡蛋"], keywords=[]),
+            SimpleNamespace(id="recipe_social", name="清蒸鱼", ingredients_search=["鲈鱼"], keywords=[]),
+            SimpleNamespace(id="recipe_cold", name="冷门菜", ingredients_search=["芥蓝"], keywords=[]),
+        ]
+
+        items = HybridScoringEngine.score_candidates(
+            recipes,
+            fridge={"西红柿", "鸡蛋"},
+            priority=set(),
+            collaborative_scores={"recipe_social": 2.0},
+            popular_scores={"recipe_social": 10, "recipe_fridge": 5},
+        )
+
+        self.assertEqual([item["id"] for item in items], ["recipe_fridge", "recipe_social"])
+        self.assertEqual(items[0]["score_breakdown"], {"content": 100.0, "popular": 50.0})
+        self.assertEqual(items[0]["score"], 60.0)
+        self.assertEqual(items[1]["score"], 50.0)
+        self.assertEqual(items[1]["match_reason"], "相似用户也喜欢")
+        self.assertTrue(all(item["recommend_type"] == "hybrid" for item in items))
+
+    def test_ingredient_index_ranks_globally_with_filter_pushdown(self):
+        cache.clear()
+        IngredientIndex.install(IngredientIndexSnapshot([
+            {"_id": "r_full", "ingredients_search": ["番茄", "鸡蛋"], "calories": 300},
+            {"_id": "r_half", "ingredients_search": ["鸡蛋", "韭菜"], "calories": 200},
+            {"_id": "r_peanut", "ingredients_search": ["鸡蛋", "花生"], "calories": 250},
+            {"_id": "r_heavy", "ingredients_search": ["鸡蛋"], "calories": 900},
+            {"_id": "r_none", "ingredients_search": ["鲈鱼"], "calories": 150},
+        ], version=RecipeCatalog.version()))
+
+        ranked = IngredientIndex.search({"西红柿", "鸡蛋"}, limit=10)
+        self.assertEqual(ranked[:2], [("r_heavy", 100, False), ("r_full", 100, False)])
+        self.assertNotIn("r_none", [rid for rid, _, _ in ranked])
+
+        filtered = IngredientIndex.search(
+            {"西红柿", "鸡蛋"},
+            limit=10,
+            filters={"exclude_ids": ["r_full"], "allergens": ["花生"], "calorie_max": 500},
+        )
+        self.assertEqual(filtered, [("r_half", 50, False)])
+
+        RecipeCatalog.mark_changed()
+        with patch.object(IngredientIndex, "_load_docs", return_value=[]):
+            self.assertEqual(IngredientIndex.search({"鸡蛋"}), [])
+
+    def test_popularity_board_decays_old_events_and_updates_incrementally(self):
+        cache.clear()
+        other = User.objects.create_user(username="popular_peer", password="pass")
+        UserPreference.objects.create(user=self.user, target_id="recipe_old", target_type="recipe", action="like")
+        UserPreference.objects.create(user=other, target_id="recipe_old", target_type="recipe", action="like")
+        UserPreference.objects.create(user=self.user, target_id="recipe_new", target_type="recipe", action="save")
+        UserPreference.objects.filter(target_id="recipe_old").update(
+            created_at=timezone.now() - timezone.timedelta(days=56)
+        )
+
+        with override_settings(POPULARITY_HALF_LIFE_DAYS=14, RECOMMENDATION_INDEX_WORKER=False):
+            # 冷启动不在请求内构建，只启动一次后台构建并返回空榜
+            with patch("apps.diet.domains.discovery.popularity_board.threading.Thread") as mocked_thread:
+                self.assertEqual(PopularityBoard.page(0, 10), [])
+                self.assertEqual(PopularityBoard.page(0, 10), [])
+            mocked_thread.assert_called_once()
+            mocked_thread.return_value.start.assert_called_once()
+            cache.delete(PopularityBoard.BUILD_LOCK_KEY)
+
+            PopularityBoard.build()
+            ranked = PopularityBoard.page(0, 10)
+            self.assertEqual([rid for rid, _ in ranked], ["recipe_new", "recipe_old"])
+            self.assertAlmostEqual(ranked[0][1], 2, delta=0.2)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                intake = DailyIntake.objects.create(
+                    user=self.user,
+                    source_type=1,
+                    source_id="recipe_cooked",
+                    food_name="番茄炒蛋",
+                    meal_time="lunch",
+                    calories=300,
+                )
+            self.assertEqual(PopularityBoard.page(0, 1)[0][0], "recipe_cooked")
+
+            with self.captureOnCommitCallbacks(execute=True):
+                intake.delete()
+            self.assertNotIn("recipe_cooked", PopularityBoard.score_map())
+
+            # 重建期间提交的事件：快照开始后提交的回放，之前提交的已在快照中，不重复计分
+            snapshot = PopularityBoard._snapshot
+
+            def snapshot_with_concurrent_events(epoch):
+                PopularityBoard._push_pending(
+                    ["recipe_new", "save", PopularityBoard._timestamp(None), True, time.time() - 60]
+                )
+                scores = snapshot(epoch)
+                with self.captureOnCommitCallbacks(execute=True):
+                    PopularityBoard.record("recipe_late", "like")
+                return scores
+
+            with patch.object(PopularityBoard, "_snapshot", side_effect=snapshot_with_concurrent_events):
+                PopularityBoard.build()
+            scores = PopularityBoard.score_map()
+            self.assertAlmostEqual(scores["recipe_late"], 3, delta=0.3)
+            self.assertAlmostEqual(scores["recipe_new"], 2, delta=0.2)
+
     @patch("apps.diet.api.v1.discovery.RecommendationService.get_recommendations")
     def test_search_accepts_strategy_and_returns_algorithm_fields(self, mocked_recommend):
         mocked_recommend.return_value = [
@@ -244,10 +635,119 @@ class DietFeatureTests(TestCase):
         self.assertEqual(len(candidates), 2)
         self.assertEqual(candidates[0]["id"], "recipe_1")
 
-    @patch("apps.diet.domains.community.services.cache")
+    @patch("apps.diet.domains.discovery.wheel_engine.Recipe")
+    def test_wheel_flavor_facets_are_cached_per_catalog_version(self, mocked_recipe):
+        cache.clear()
+        mocked_recipe.objects.aggregate.return_value = [
+            {"_id": {"cuisine": "川菜", "keyword": "川菜"}, "count": 9},
+            {"_id": {"cuisine": "川菜", "keyword": "麻辣"}, "count": 5},
+            {"_id": {"cuisine": "川菜", "keyword": "粤菜"}, "count": 4},
+            {"_id": {"cuisine": "川菜", "keyword": "下饭"}, "count": 3},
+        ]
+
+        first = WheelEngine.get_wheel_options(2, cuisine="川菜")
+        second = WheelEngine.get_wheel_options(2, cuisine="川菜")
+        self.assertEqual([item["value"] for item in first], ["麻辣", "下饭"])
+        self.assertEqual(second, first)
+        self.assertEqual(mocked_recipe.objects.aggregate.call_count, 1)
+
+        RecipeCatalog.mark_changed()
+        WheelEngine.get_wheel_options(2, cuisine="川菜")
+        self.assertEqual(mocked_recipe.objects.aggregate.call_count, 2)
+
+    @patch("apps.diet.domains.discovery.wheel_engine.RecommendationService.get_recommendations")
+    def test_wheel_candidate_pool_is_reused_across_spins(self, mocked_recommend):
+        cache.clear()
+        mocked_recommend.return_value = [
+            {"id": "recipe_1", "name": "轻食碗", "calories": 300, "ingredients": [{"name": "鸡胸肉"}]},
+        ]
+
+        first = WheelEngine.get_wheel_options(3, cuisine="川菜", user=self.user)
+        second = WheelEngine.get_wheel_options(3, cuisine="川菜", user=self.user)
+
+        self.assertEqual(first, second)
+        self.assertEqual(mocked_recommend.call_count, 1)
+
+    def test_lbs_tiles_share_results_and_refresh_stale_entries_once(self):
+        cache.clear()
+        calls = []
+        release = threading.Event()
+
+        def compute(lng, lat, radius, sort_by, min_health_score, raise_errors=False):
+            calls.append((round(lng, 4), round(lat, 4), radius))
+            if len(calls) > 3:
+                raise RuntimeError("mongo down")
+            if len(calls) > 2:
+                release.wait(2)
+            return [{"id": f"shop_{len(calls)}"}]
+
+        with patch.object(LBSService, "_compute", side_effect=compute):
+            first = LBSService.get_recommendations(116.3975, 39.9087, radius=2500)
+            # 同一格子内的邻近坐标与同档半径命中同一条缓存
+            nearby = LBSService.get_recommendations(116.3978, 39.9089, radius=2800)
+            self.assertEqual(first, nearby)
+            self.assertEqual(len(calls), 1)
+            margin = LBSService.TILE_MARGIN_M
+            self.assertEqual(calls[0][2], 3000 + margin)
+            LBSService.get_recommendations(116.3975, 39.9087, radius=800)
+            self.assertEqual([call[2] for call in calls], [3000 + margin, 1000 + margin])
+
+            key = f"{LBSService.KEY_PREFIX}:{geohash_encode(39.9087, 116.3975, 6)}:3000:distance:0"
+            entry = cache.get(key)
+            cache.set(key, {**entry, "fresh_until": 0}, timeout=60)
+            stale = [LBSService.get_recommendations(116.3975, 39.9087, radius=2500) for _ in range(3)]
+            self.assertEqual(stale, [first] * 3)
+            release.set()
+            for _ in range(100):
+                if cache.get(key)["results"] != first:
+                    break
+                threading.Event().wait(0.02)
+            self.assertEqual(len(calls), 3)
+            self.assertEqual(cache.get(key)["results"], [{"id": "shop_3"}])
+
+            # 后台刷新失败：旧条目保留，不被空结果覆盖
+            cache.set(key, {**cache.get(key), "fresh_until": 0}, timeout=60)
+            self.assertEqual(LBSService.get_recommendations(116.3975, 39.9087, radius=2500), [{"id": "shop_3"}])
+            for _ in range(100):
+                if cache.get(f"{key}:lock") is None:
+                    break
+                threading.Event().wait(0.02)
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(cache.get(key)["results"], [{"id": "shop_3"}])
+
+        # 格子结果按调用方的实际距离重新过滤与排序，小半径在格子边缘也准确
+        cache.clear()
+        tile_results = [
+            {"id": "far", "_location": [116.4075, 39.9087]},
+            {"id": "near", "_location": [116.3995, 39.9087]},
+        ]
+        with patch.object(LBSService, "_compute", return_value=tile_results):
+            self.assertEqual(LBSService.get_recommendations(116.3975, 39.9087, radius=500), [{"id": "near"}])
+            self.assertEqual(
+                LBSService.get_recommendations(116.3975, 39.9087, radius=1000), [{"id": "near"}, {"id": "far"}]
+            )
+
+    def test_amap_fetcher_pages_in_parallel_with_retry_and_rate_limit(self):
+        with StubAMapServer(total=45, latency_ms=150, fail_first=1) as stub:
+            with override_settings(
+                AMAP_BASE_URL=stub.base_url,
+                AMAP_WEB_KEY="stub-key",
+                AMAP_RATE_LIMIT=20,
+                AMAP_RETRY_BACKOFF=0.01,
+            ):
+                pois = AMapFetcher.search_nearby(116.3975, 39.9087, radius=1000, pages=5)
+
+        # 45 条 / 每页 20 条 = 3 页；首个请求 503 后重试一次
+        self.assertEqual(len(pois), 45)
+        self.assertEqual(len({poi["id"] for poi in pois}), 45)
+        self.assertEqual(stub.requests, 4)
+        self.assertGreaterEqual(stub.peak_concurrency, 2)
+        gaps = [later - earlier for earlier, later in zip(stub.request_times, stub.request_times[1:])]
+        self.assertGreaterEqual(min(gaps), 0.04)
+
+    @patch("apps.diet.domains.community.counters.get_redis", return_value=None)
     @patch("apps.diet.domains.community.services.CommunityFeed")
-    def test_community_like_persists_without_redis(self, mocked_feed_model, mocked_cache):
-        mocked_cache.client = None
+    def test_community_like_persists_without_redis(self, mocked_feed_model, mocked_redis):
         feed = FakeCommunityFeed()
         mocked_feed_model.objects.get.return_value = feed
 
@@ -269,6 +769,269 @@ class DietFeatureTests(TestCase):
             ).exists()
         )
 
+    @override_settings(COMMUNITY_COUNTER_WORKER=False)
+    def test_feed_counters_keep_taps_in_redis_and_flush_in_batches(self):
+        fake = FakeRedis()
+        feed_id = "65f000000000000000000001"
+        other = User.objects.create_user(username="feed-fan", password="pass123456")
+        UserPreference.objects.create(user=other, target_id=feed_id, target_type="feed", action="like")
+        collection = SimpleNamespace(calls=[])
+        collection.bulk_write = lambda operations, ordered=True: collection.calls.append(operations)
+        FeedCounters._ready.clear()
+
+        with patch("apps.diet.domains.community.counters.get_redis", return_value=fake), \
+                patch.object(FeedCounters, "_feed_exists", return_value=True), \
+                patch.object(CommunityFeed, "_get_collection", return_value=collection):
+            liked = CommunityService.toggle_like(self.user.id, feed_id, action="like")
+            CommunityService.toggle_like(self.user.id, feed_id, action="like")
+            saved = CommunityService.toggle_save(self.user.id, feed_id, "save")
+            self.assertEqual(liked, {"likes_count": 2, "is_liked": True})
+            self.assertEqual(saved, {"save_count": 1, "is_saved": True})
+            # 写后回写：MySQL 尚未变化，读路径以 Redis 为准
+            self.assertFalse(UserPreference.objects.filter(user=self.user, target_id=feed_id).exists())
+            self.assertEqual(
+                FeedCounters.states([feed_id], self.user.id)[feed_id],
+                {"likes_count": 2, "save_count": 1, "is_liked": True, "is_saved": True},
+            )
+
+            self.assertEqual(FeedCounters.flush(), 3)
+            self.assertEqual(
+                set(UserPreference.objects.filter(user=self.user, target_id=feed_id).values_list("action", flat=True)),
+                {"like", "save"},
+            )
+            counts = {op._doc["$set"].popitem() for op in collection.calls[-1]}
+            self.assertEqual(counts, {("likes_count", 2), ("save_count", 1)})
+
+            unliked = CommunityService.toggle_like(other.id, feed_id, action="unlike")
+            self.assertEqual(unliked, {"likes_count": 1, "is_liked": False})
+            FeedCounters.flush()
+            self.assertFalse(UserPreference.objects.filter(user=other, target_id=feed_id).exists())
+
+            # 模拟漂移：MySQL 行丢失、Mongo 计数错误，由对账命令修复
+            UserPreference.objects.filter(user=self.user, target_id=feed_id, action="like").delete()
+            drifted = SimpleNamespace()
+            drifted.only = lambda *fields: drifted
+            drifted.as_pymongo = lambda: drifted
+            drifted.batch_size = lambda size: iter([{"_id": feed_id, "likes_count": 7, "save_count": 1}])
+            out = StringIO()
+            with patch.object(CommunityFeed, "objects", drifted):
+                call_command("reconcile_feed_counters", stdout=out)
+        self.assertTrue(UserPreference.objects.filter(user=self.user, target_id=feed_id, action="like").exists())
+        self.assertEqual(collection.calls[-1][0]._doc, {"$set": {"likes_count": 1}})
+        self.assertIn("1 counts fixed, 1 preference rows added, 0 removed", out.getvalue())
+
+    @override_settings(COMMUNITY_COMMENT_PREVIEW_SIZE=3, COMMUNITY_COMMENT_WORKER=False)
+    def test_comments_keep_preview_and_count_and_reconcile_drift(self):
+        fake = FakeRedis()
+        commenter = User.objects.create_user(username="commenter", password="pass123456", nickname="评论者")
+        feed_id = ObjectId()
+        feed_collection = SimpleNamespace(updates=[], writes=[])
+        feed_collection.update_one = lambda query, update: feed_collection.updates.append((query, update))
+        feed_collection.bulk_write = lambda operations, ordered=True: feed_collection.writes.append(operations)
+
+        def fake_save(comment):
+            comment.id = ObjectId()
+
+        with patch("apps.diet.domains.community.comments.get_redis", return_value=fake), \
+                patch.object(CommunityFeed, "_get_collection", return_value=feed_collection), \
+                patch.object(Comment, "save", autospec=True, side_effect=fake_save):
+            comment = FeedComments.add(commenter.id, SimpleNamespace(id=feed_id), "好吃")
+        query, update = feed_collection.updates[0]
+        self.assertEqual(query, {"_id": feed_id})
+        self.assertEqual(update["$inc"], {"comments_count": 1})
+        self.assertEqual(update["$push"]["recent_comments"]["$slice"], 3)
+        self.assertEqual(update["$push"]["recent_comments"]["$each"][0]["id"], str(comment.id))
+        self.assertTrue(fake.sismember(FeedComments.DIRTY_KEY, feed_id))
+
+        # 动态流按需内嵌预览，评论者名片与作者一起批量水合
+        entry = update["$push"]["recent_comments"]["$each"][0]
+        feed = SimpleNamespace(
+            id=feed_id, user_id=self.user.id, content="晚餐", images=[], feed_type="post", target_id=None,
+            likes_count=0, comments_count=1, created_at=timezone.now(), sport_info={}, recent_comments=[entry],
+        )
+        plain = CommunityService._format_feeds([feed])
+        self.assertNotIn("comments_preview", plain[0])
+        preview = CommunityService._format_feeds([feed], preview_comments=5)[0]["comments_preview"]
+        self.assertEqual(len(preview), 1)
+        self.assertEqual((preview[0]["content"], preview[0]["user"]["nickname"]), ("好吃", "评论者"))
+
+        # 计数漂移：存量 5 条、预览 1 条，实际 2 条评论
+        drifted = SimpleNamespace(only=lambda *fields: SimpleNamespace(
+            as_pymongo=lambda: [{"_id": feed_id, "comments_count": 5, "recent_comments": [entry]}]
+        ))
+        recent = [SimpleNamespace(id=ObjectId(), user_id=commenter.id, content=text, created_at=timezone.now()) for text in ("新", "旧")]
+        comments = SimpleNamespace(order_by=lambda *fields: SimpleNamespace(limit=lambda count: recent[:count]))
+        comment_collection = SimpleNamespace(aggregate=lambda pipeline: [{"_id": feed_id, "count": 2}])
+        out = StringIO()
+        with patch("apps.diet.domains.community.comments.get_redis", return_value=fake), \
+                patch.object(CommunityFeed, "_get_collection", return_value=feed_collection), \
+                patch.object(CommunityFeed, "objects", lambda **filters: drifted), \
+                patch.object(Comment, "objects", lambda **filters: comments), \
+                patch.object(Comment, "_get_collection", return_value=comment_collection):
+            call_command("reconcile_comment_counts", "--dirty-only", stdout=out)
+        self.assertIn("Checked 1 feeds: 1 fixed", out.getvalue())
+        self.assertEqual(feed_collection.writes[-1][0]._filter, {"_id": feed_id, "comments_count": 5})
+        fixed = feed_collection.writes[-1][0]._doc["$set"]
+        self.assertEqual(fixed["comments_count"], 2)
+        self.assertEqual([item["content"] for item in fixed["recent_comments"]], ["新", "旧"])
+        self.assertEqual(fake.scard(FeedComments.DIRTY_KEY), 0)
+
+    def test_user_cards_hydrate_in_constant_queries_and_invalidate_on_change(self):
+        achievements = [
+            Achievement.objects.create(code=f"card-{index}", title=f"徽章{index}", desc="desc", icon=f"i{index}")
+            for index in range(4)
+        ]
+        featured_user = User.objects.create_user(
+            username="card-featured", password="pass123456", nickname="精选", avatar="https://cdn.example.com/u.png"
+        )
+        Profile.objects.create(user=featured_user, avatar="avatars/2024/01/p.png")
+        unlocked_user = User.objects.create_user(username="card-unlocked", password="pass123456")
+        Profile.objects.create(user=unlocked_user, avatar="avatars/2024/01/p2.png")
+        bare_user = User.objects.create_user(username="card-bare", password="pass123456")
+        UserFeaturedBadge.objects.create(user=featured_user, achievement=achievements[2], sort_order=0)
+        base = timezone.now()
+        for index, achievement in enumerate(achievements):
+            unlocked = UserAchievement.objects.create(user=unlocked_user, achievement=achievement)
+            UserAchievement.objects.filter(pk=unlocked.pk).update(unlocked_at=base + timezone.timedelta(minutes=index))
+        cache.clear()
+
+        # 用户、代表徽章、兜底成就各一次查询，与用户数量无关
+        with self.assertNumQueries(3):
+            cards = UserCards.get_many([featured_user.id, unlocked_user.id, bare_user.id, 987654])
+        self.assertEqual(cards[featured_user.id]["nickname"], "精选")
+        # 用户表头像优先，资料头像仅作兜底
+        self.assertEqual(cards[featured_user.id]["avatar"], "https://cdn.example.com/u.png")
+        self.assertTrue(cards[unlocked_user.id]["avatar"].endswith("avatars/2024/01/p2.png"))
+        self.assertEqual([badge["name"] for badge in cards[featured_user.id]["featured_badges"]], ["徽章2"])
+        self.assertEqual([badge["name"] for badge in cards[unlocked_user.id]["featured_badges"]], ["徽章3", "徽章2", "徽章1"])
+        self.assertEqual(cards[bare_user.id]["nickname"], "card-bare")
+        self.assertEqual(cards[987654]["nickname"], "未知用户")
+        with self.assertNumQueries(0):
+            self.assertEqual(UserCards.get_many([featured_user.id, unlocked_user.id])[featured_user.id], cards[featured_user.id])
+
+        featured_user.nickname = "改名"
+        featured_user.save(update_fields=["nickname"])
+        UserFeaturedBadge.objects.create(user=unlocked_user, achievement=achievements[0], sort_order=0)
+        refreshed = UserCards.get_many([featured_user.id, unlocked_user.id])
+        self.assertEqual(refreshed[featured_user.id]["nickname"], "改名")
+        self.assertEqual([badge["name"] for badge in refreshed[unlocked_user.id]["featured_badges"]], ["徽章0"])
+        self.assertEqual(GamificationService.get_user_featured_badges(unlocked_user.id), refreshed[unlocked_user.id]["featured_badges"])
+
+    def test_keyset_paginate_walks_ties_and_keeps_page_param(self):
+        rows = [
+            UserPreference.objects.create(user=self.user, target_id=f"recipe-{index}", target_type="recipe", action="like")
+            for index in range(5)
+        ]
+        moment = timezone.now()
+        # 同一时间戳的多行依靠 id 决定先后，游标不能漏行或重复
+        UserPreference.objects.filter(pk__in=[row.pk for row in rows[1:4]]).update(created_at=moment)
+        UserPreference.objects.filter(pk=rows[4].pk).update(created_at=moment + timezone.timedelta(seconds=1))
+        queryset = UserPreference.objects.filter(user=self.user)
+        expected = list(queryset.order_by("-created_at", "-pk").values_list("pk", flat=True))
+
+        seen, cursor = [], None
+        while True:
+            result = keyset_paginate(queryset, cursor=cursor, page_size=2)
+            seen.extend(row.pk for row in result.items)
+            if not result.has_more:
+                break
+            cursor = result.next_cursor
+        self.assertEqual(seen, expected)
+
+        legacy = keyset_paginate(queryset, page_size=2, page=2)
+        self.assertEqual([row.pk for row in legacy.items], expected[2:4])
+        self.assertTrue(legacy.has_more)
+        resumed = keyset_paginate(queryset, cursor=legacy.next_cursor, page_size=2)
+        self.assertEqual([row.pk for row in resumed.items], expected[4:])
+        with self.assertRaises(BusinessException):
+            keyset_paginate(queryset, cursor="not-a-cursor")
+
+    @override_settings(TIMELINE_MAX_ITEMS=3, TIMELINE_FANOUT_MAX_FOLLOWERS=1)
+    def test_follow_timeline_fans_out_caps_and_pages_by_cursor(self):
+        fake = FakeRedis()
+        author = User.objects.create_user(username="timeline-author", password="pass123456")
+        star = User.objects.create_user(username="timeline-star", password="pass123456")
+        fan = User.objects.create_user(username="timeline-fan", password="pass123456")
+        for follower in (self.user, fan):
+            UserFollow.objects.create(follower=follower, followed=star)
+        UserFollow.objects.create(follower=self.user, followed=author)
+
+        base = timezone.now().replace(tzinfo=None, microsecond=0)
+        feeds = [
+            SimpleNamespace(id=f"65f00000000000000000000{index}", user_id=author.id, is_hidden=False,
+                            created_at=base + timezone.timedelta(minutes=index))
+            for index in range(1, 5)
+        ]
+        # 大 V 的帖子介于作者第 2、3 条之间
+        feeds.append(SimpleNamespace(id="65f000000000000000000009", user_id=star.id, is_hidden=False,
+                                     created_at=base + timezone.timedelta(minutes=2, seconds=30)))
+        mocked_feed = SimpleNamespace(objects=FakeFeedQuerySet(feeds))
+
+        with patch("apps.diet.domains.community.timeline.get_redis", return_value=fake), \
+                patch("apps.diet.management.commands.backfill_timelines.get_redis", return_value=fake), \
+                patch("apps.diet.domains.community.timeline.CommunityFeed", mocked_feed):
+            for feed in feeds:
+                FollowTimeline.fan_out(feed)
+            # 写扩散裁剪到上限；大 V 只记入拉取集合
+            self.assertEqual(fake.zcard(FollowTimeline.key(self.user.id)), 3)
+            self.assertEqual(fake.zcard(FollowTimeline.key(fan.id)), 0)
+            self.assertTrue(fake.sismember(FollowTimeline.PULL_AUTHORS_KEY, star.id))
+
+            fake.set(f"{FollowTimeline.key(self.user.id)}:ready", 1)
+            first, cursor = FollowTimeline.page(self.user.id, page_size=2)
+            self.assertEqual([feed.id for feed in first], [feeds[3].id, feeds[2].id])
+            # 与 keyset_paginate 共用不透明游标格式，格式错误时报参数错误
+            self.assertEqual(decode_cursor(cursor), (feeds[2].created_at, feeds[2].id))
+            with self.assertRaises(BusinessException):
+                FollowTimeline.page(self.user.id, cursor="1700000000000:abc", page_size=2)
+            second, cursor = FollowTimeline.page(self.user.id, cursor=cursor, page_size=2)
+            self.assertEqual([feed.id for feed in second], [feeds[4].id, feeds[1].id])
+            self.assertIsNone(cursor)
+
+            CommunityService.toggle_follow(self.user.id, author.id, "unfollow")
+            self.assertEqual(fake.zcard(FollowTimeline.key(self.user.id)), 0)
+            only_star, _ = FollowTimeline.page(self.user.id)
+            self.assertEqual([feed.id for feed in only_star], [feeds[4].id])
+
+            fake.data.clear()
+            out = StringIO()
+            call_command("backfill_timelines", stdout=out)
+            self.assertIn("Wrote 4 entries into 4 timelines", out.getvalue())
+            self.assertTrue(fake.exists(f"{FollowTimeline.key(fan.id)}:ready"))
+
+    @override_settings(COMMUNITY_COUNTER_WORKER=False)
+    @patch("apps.diet.domains.community.services.CommunityFeed")
+    def test_feed_counters_reseed_legacy_sets_and_replay_outage_taps(self, mocked_feed_model):
+        fake = FakeRedis()
+        feed_id = "65f000000000000000000002"
+        other = User.objects.create_user(username="outage-fan", password="pass123456")
+        mocked_feed_model.objects.get.return_value = FakeCommunityFeed(likes_count=1)
+        collection = SimpleNamespace(bulk_write=lambda operations, ordered=True: None)
+        # 旧版本遗留的同名集合：取消点赞时 srem 失败留下的成员
+        fake.sadd(FeedCounters.set_key(feed_id, "like"), 999)
+        FeedCounters._ready.clear()
+
+        with patch("apps.diet.domains.community.counters.get_redis", return_value=fake), \
+                patch.object(FeedCounters, "_feed_exists", return_value=True), \
+                patch.object(CommunityFeed, "_get_collection", return_value=collection):
+            liked = CommunityService.toggle_like(self.user.id, feed_id, action="like")
+            self.assertEqual(liked["likes_count"], 1)
+
+            with patch.object(fake, "pipeline", side_effect=ConnectionError("redis down")):
+                fallback = CommunityService.toggle_like(other.id, feed_id, action="like")
+            self.assertEqual(fallback["likes_count"], 2)
+            self.assertFalse(fake.sismember(FeedCounters.set_key(feed_id, "like"), other.id))
+
+            # Redis 恢复后回放故障期间的操作，回写不会撤销它
+            FeedCounters.drain()
+            self.assertTrue(fake.sismember(FeedCounters.set_key(feed_id, "like"), other.id))
+            self.assertEqual(FeedCounters.states([feed_id], other.id)[feed_id]["likes_count"], 2)
+        self.assertEqual(
+            set(UserPreference.objects.filter(target_id=feed_id, action="like").values_list("user_id", flat=True)),
+            {self.user.id, other.id},
+        )
+        self.assertEqual(FeedCounters._fallback, [])
+
     @patch("apps.diet.domains.community.services.CommunityFeed")
     def test_community_report_writes_real_audit_log_fields(self, mocked_feed_model):
         feed = FakeCommunityFeed()
@@ -332,6 +1095,250 @@ class DietFeatureTests(TestCase):
 
         self.assertEqual(parsed["food_name"], "apple")
 
+    @override_settings(
+        AI_CONFIG={"text": {"base_url": "http://ai.local/v1", "api_keys": ["k1"], "model": "m1"}},
+        AI_MAX_CONCURRENCY_PER_KEY=4,
+    )
+    def test_ai_executor_coalesces_identical_inflight_completions(self):
+        calls = []
+        release = threading.Event()
+
+        async def create(**kwargs):
+            calls.append(kwargs)
+            await asyncio.get_running_loop().run_in_executor(None, release.wait, 5)
+            return SimpleNamespace(model=kwargs["model"])
+
+        fake_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        messages = [{"role": "user", "content": "hi"}]
+        with patch.object(AIService, "_async_client", return_value=fake_client):
+            key = AIExecutor.request_key("text", {"messages": messages})
+            futures = [
+                AIExecutor.submit(lambda: AIService._acall_completion("text", messages=messages), key=key)
+                for _ in range(3)
+            ]
+            release.set()
+            results = [future.result(5) for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0]["model"], "m1")
+        self.assertTrue(all(result[1] == "m1" for result in results))
+
+    @override_settings(
+        AI_CONFIG={
+            "text": {"base_url": "http://primary.local/v1", "api_keys": ["bad"], "model": "m1"},
+            "fallback": {"base_url": "http://fallback.local/v1", "api_keys": ["fb"], "model": "m2"},
+        },
+        AI_CIRCUIT_MIN_CALLS=2,
+        AI_CIRCUIT_ERROR_RATE=0.5,
+        AI_CIRCUIT_COOLDOWN=60,
+    )
+    def test_circuit_breaker_skips_failing_key_and_probes_after_cooldown(self):
+        CircuitBreaker.reset()
+        attempts = []
+
+        def client_for(config, api_key):
+            async def create(**kwargs):
+                attempts.append(api_key)
+                if api_key == "bad":
+                    raise RuntimeError("upstream down")
+                return SimpleNamespace(model=kwargs["model"])
+
+            return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+        def call(n):
+            attempts.clear()
+            return AIService._call_completion("text", messages=[{"role": "user", "content": f"q{n}"}])[1]
+
+        with patch.object(AIService, "_async_client", side_effect=client_for):
+            self.assertEqual([call(0), call(1)], ["m2", "m2"])
+            self.assertEqual(attempts, ["bad", "fb"])
+
+            # 熔断后主供应商密钥被直接跳过
+            self.assertEqual(call(2), "m2")
+            self.assertEqual(attempts, ["fb"])
+
+            bad_slot = AIService._slot({"base_url": "http://primary.local/v1"}, "bad")
+            CircuitBreaker._states[bad_slot].opened_at -= 61
+            call(3)
+            self.assertEqual(attempts, ["bad", "fb"])
+            call(4)
+            self.assertEqual(attempts, ["fb"])
+        CircuitBreaker.reset()
+
+    @override_settings(AI_MAX_CONCURRENCY_PER_KEY=1, AI_QUEUE_TIMEOUT=0.05)
+    def test_ai_executor_fails_fast_when_key_is_saturated(self):
+        release = threading.Event()
+
+        async def slow():
+            await asyncio.get_running_loop().run_in_executor(None, release.wait, 5)
+            return "done"
+
+        async def fast():
+            return "fast"
+
+        holder = AIExecutor.submit(lambda: AIExecutor.limited(("saturated", "k"), slow))
+        with self.assertRaises(AIQueueTimeout):
+            AIExecutor.run(lambda: AIExecutor.limited(("saturated", "k"), fast), timeout=5)
+        release.set()
+        self.assertEqual(holder.result(5), "done")
+        self.assertEqual(AIExecutor.run(lambda: AIExecutor.limited(("saturated", "k"), fast), timeout=5), "fast")
+
+    @override_settings(AI_RECOGNITION_CACHE_MAX_ENTRIES=2)
+    def test_recognize_food_reuses_cached_result_for_same_image(self):
+        cache.clear()
+        response = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(
+            content='{"food_name":"apple","calories":80,"nutrition":{},"description":"ok"}'
+        ))])
+        upload = lambda data: SimpleUploadedFile("meal.jpg", data, content_type="image/jpeg")
+
+        with patch.object(AIService, "_call_completion", return_value=(response, "m1")) as call:
+            first = AIService.recognize_food(upload(b"\xff\xd8same-photo"))
+            second = AIService.recognize_food(upload(b"\xff\xd8same-photo"))
+            AIService.recognize_food(upload(b"\xff\xd8other-1"))
+            AIService.recognize_food(upload(b"\xff\xd8other-2"))
+            AIService.recognize_food(upload(b"\xff\xd8same-photo"))
+
+        self.assertEqual(first, second)
+        # 第二次命中缓存；容量为 2 时最早的条目被淘汰，第五次重新调用模型
+        self.assertEqual(call.call_count, 4)
+        self.assertTrue(AIService._last_metrics[-4]["cache_hit"])
+        self.assertFalse(AIService._last_metrics[-1]["cache_hit"])
+
+    @override_settings(AI_IMAGE_MAX_EDGE=256, AI_IMAGE_FORMAT="JPEG")
+    def test_uploaded_image_is_oriented_and_downscaled_before_encoding(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # 需顺时针旋转 90°
+        raw = BytesIO()
+        Image.effect_noise((1200, 800), 40).convert("RGB").save(raw, "JPEG", quality=95, exif=exif)
+        upload = SimpleUploadedFile("photo.jpg", raw.getvalue(), content_type="image/jpeg")
+
+        data_url = uploaded_image_to_data_url(upload)
+
+        header, payload = data_url.split(",", 1)
+        self.assertEqual(header, "data:image/jpeg;base64")
+        encoded = base64.b64decode(payload)
+        self.assertLess(len(encoded), len(raw.getvalue()))
+        self.assertEqual(Image.open(BytesIO(encoded)).size, (171, 256))
+
+    @override_settings(AI_UPLOAD_MAX_BYTES=1024)
+    def test_recognition_upload_over_limit_is_rejected_before_model_call(self):
+        upload = SimpleUploadedFile("big.jpg", b"\xff\xd8" + b"0" * 4096, content_type="image/jpeg")
+
+        with patch.object(AIService, "recognize_food") as recognize:
+            response = self.client.post("/api/v1/diet/ai/food-recognition/", {"image": upload}, format="multipart")
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()["code"], 413)
+        recognize.assert_not_called()
+
+    def test_upload_size_handler_aborts_streamed_body_past_limit(self):
+        handler = SizeLimitUploadHandler(limit=10)
+        handler.receive_data_chunk(b"x" * 6, 0)
+
+        with self.assertRaises(BusinessException):
+            handler.receive_data_chunk(b"x" * 6, 6)
+
+    def test_chunked_data_url_matches_one_shot_base64(self):
+        payload = bytes(range(256)) * 41 + b"tail"
+
+        class ShortReads(BytesIO):
+            def read(self, size=-1):
+                # 模拟返回长度不是 3 的倍数的短读
+                return super().read(min(size, 1000) if size and size > 0 else size)
+
+        data_url = stream_to_data_url(ShortReads(payload), len(payload), "image/png")
+
+        self.assertEqual(data_url, "data:image/png;base64," + base64.b64encode(payload).decode("ascii"))
+
+    @override_settings(AI_CHAT_CONTEXT_TOKEN_BUDGET=15, AI_CHAT_CONTEXT_WORKER=False)
+    def test_chat_stream_keeps_context_on_server_within_budget(self):
+        cache.clear()
+        sent = []
+
+        def fake_stream(task_type, **kwargs):
+            sent.append(kwargs["messages"])
+            answer = f"回答{len(sent)}"
+            chunk = SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=answer))])
+            return iter([chunk]), "m1"
+
+        with patch.object(AIService, "_call_completion", side_effect=fake_stream):
+            for question in ["早餐吃什么比较健康", "午餐呢", "晚餐要注意什么"]:
+                response = self.client.post(
+                    "/api/v1/diet/ai-nutritionist/ask/stream/",
+                    {"question": question, "context": [{"role": "user", "content": "客户端旧上下文"}]},
+                    format="json",
+                )
+                b"".join(response.streaming_content)
+
+        self.assertEqual([m["content"] for m in sent[1]][1:], ["早餐吃什么比较健康", "回答1", "午餐呢"])
+        self.assertNotIn("客户端旧上下文", str(sent))
+        # 超出预算的最早一轮被折叠为摘要
+        self.assertIn("早餐吃什么比较健康", sent[2][1]["content"])
+        self.assertEqual([m["content"] for m in sent[2]][2:], ["午餐呢", "回答2", "晚餐要注意什么"])
+
+        ChatContextStore.flush()
+        self.assertEqual(AIChatContext.objects.filter(user=self.user).count(), 6)
+        cache.clear()
+        restored = ChatContextStore.messages(self.user.id)
+        self.assertEqual(restored[-1], {"role": "assistant", "content": "回答3"})
+
+        # 另一进程缓冲中的轮次在重置后不会被写回
+        ChatContextStore.append(self.user.id, "重置前的问题", "重置前的回答")
+        stale = list(ChatContextStore._pending)
+        ChatContextStore.reset(self.user.id)
+        ChatContextStore._pending.extend(stale)
+        ChatContextStore.append(self.user.id, "重置后的问题", "重置后的回答")
+        self.assertEqual(ChatContextStore.flush(), 2)
+        self.assertEqual(
+            list(AIChatContext.objects.filter(user=self.user).values_list("content", flat=True).order_by("id")),
+            ["重置后的问题", "重置后的回答"],
+        )
+
+        # 完成回调先于 [DONE] 执行，客户端收到结束标识即断开也不会丢失；回调异常不会变成流错误
+        completed = []
+        with patch.object(AIService, "_call_completion", side_effect=fake_stream):
+            for event in AIService.chat_with_ai_stream("加餐呢", on_complete=completed.append):
+                if event == "data: [DONE]\n\n":
+                    break
+            self.assertEqual(completed, ["回答4"])
+            events = list(AIService.chat_with_ai_stream("夜宵呢", on_complete=lambda answer: 1 / 0))
+        self.assertEqual(events[-1], "data: [DONE]\n\n")
+        self.assertNotIn("error", "".join(events))
+
+    def test_benchmark_command_reports_load_percentiles_against_stub(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            report_path = os.path.join(tmp, "bench.json")
+            call_command(
+                "benchmark_ai_models",
+                "--stub",
+                "--text-models", "stub-a",
+                "--vision-models", "stub-v",
+                "--concurrency", "1,3",
+                "--repeat", "3",
+                "--warmup", "1",
+                "--json-output", report_path,
+                stdout=out,
+            )
+            with open(report_path, encoding="utf-8") as report_file:
+                report = json.load(report_file)
+
+        rows = {(row["task_name"], row["concurrency"]): row for row in report["results"]}
+        self.assertEqual(
+            set(rows),
+            {(task, level) for task in ("recognize_food", "recognize_ingredient", "ai_chat") for level in (1, 3)},
+        )
+        self.assertIn(",mean_ms,p50_ms,", out.getvalue())
+        # 线程池内的计时调用同样记为 benchmark，不计入线上指标
+        buckets = AIMetricBucket.objects.filter(model_name__in=["stub-a", "stub-v"])
+        self.assertTrue(buckets.filter(source="benchmark").exists())
+        self.assertFalse(buckets.filter(source="live").exists())
+        food = rows[("recognize_food", 3)]
+        self.assertEqual((food["runs"], food["error_rate"], food["json_parse_rate"]), (3, 0.0, 1.0))
+        self.assertLessEqual(food["p50_ms"], food["p99_ms"])
+        self.assertIsNone(rows[("ai_chat", 1)]["json_parse_rate"])
+        self.assertIn(report["recommended_model"], {"stub-a", "stub-v"})
+
     def test_recommendation_filters_merge_user_blocks_and_allergens(self):
         self.user.profile.allergens = ["peanut"]
         self.user.profile.save(update_fields=["allergens"])
@@ -375,6 +1382,187 @@ class DietFeatureTests(TestCase):
         self.assertIn("algorithm_label", items[0])
         self.assertIn("match_reason", items[0])
 
+    def test_recommendation_pages_are_served_from_cache_until_fridge_changes(self):
+        cache.clear()
+        ranked = [
+            {"id": f"{index:024x}", "name": f"菜{index}", "match_score": 90 - index, "score": 90 - index,
+             "match_reason": "猜你喜欢", "recommend_type": "hybrid", "algorithm_label": "混合推荐",
+             "score_breakdown": {"content": 90 - index}, "missing_ingredients": [], "ingredients": []}
+            for index in range(5)
+        ]
+        hydrate = lambda user, entries: [{"id": entry["id"], "score": entry["score"]} for entry in entries]
+
+        with patch.object(RecommendationService, "_compute_recommendations", return_value=ranked) as mocked_compute, \
+                patch.object(RecommendationService, "_hydrate_entries", side_effect=hydrate):
+            first = RecommendationService.get_recommendations(self.user, page=1, page_size=2)
+            second = RecommendationService.get_recommendations(self.user, page=2, page_size=2)
+            self.assertEqual(mocked_compute.call_count, 1)
+            self.assertEqual([item["id"] for item in first + second], [item["id"] for item in ranked[:4]])
+
+            FridgeItem.objects.create(user=self.user, name="鸡蛋")
+            RecommendationService.get_recommendations(self.user, page=1, page_size=2)
+            self.assertEqual(mocked_compute.call_count, 2)
+
+    def test_recipe_search_ranks_ngram_matches_and_applies_incremental_changes(self):
+        cache.clear()
+        docs = [
+            {"_id": "r_tomato_egg", "name": "番茄炒蛋", "keywords": ["家常"], "calories": 300, "difficulty": "简单"},
+            {"_id": "r_tomato_soup", "name": "番茄牛腩汤", "ingredients_search": ["番茄", "牛腩"], "calories": 520},
+            {"_id": "r_salad", "name": "鸡胸沙拉", "ingredients_search": ["西红柿"], "calories": 250},
+            {"_id": "r_fish", "name": "清蒸鲈鱼", "calories": 200},
+        ]
+        version = RecipeCatalog.mark_changed()
+        RecipeSearchIndex.install(RecipeSearchSnapshot(docs, version=version))
+
+        total, ranked = RecipeSearchIndex.search("番茄")
+        self.assertEqual(total, 2)
+        self.assertEqual(ranked[0][0], "r_tomato_egg")
+        self.assertEqual(
+            {rid for rid, _ in RecipeSearchIndex.search("西红柿")[1]}, {"r_tomato_soup", "r_salad"}
+        )
+        self.assertEqual(RecipeSearchIndex.search("番茄", filters={"calorie_max": 400, "exclude_ids": ["r_salad"]}),
+                         (1, [("r_tomato_egg", ranked[0][1])]))
+        self.assertEqual(RecipeSearchIndex.search("炒鱼")[0], 0)
+        self.assertEqual([rid for rid, _ in RecipeSearchIndex.search("番茄", filters={"tags": "家常"})[1]], ["r_tomato_egg"])
+        self.assertEqual([rid for rid, _ in RecipeSearchIndex.search("番茄", filters={"allergens": ["牛腩"]})[1]], ["r_tomato_egg"])
+        # 过滤先于截断：排名靠后但满足条件的菜谱不会被挤出关键字结果
+        with patch.object(RecipeSearchIndex, "KEYWORD_MATCH_LIMIT", 1), \
+                patch("apps.diet.domains.discovery.recipe_search.ObjectId", str):
+            query = RecipeSearchIndex.keyword_query("番茄", {"calorie_min": 400})
+        self.assertEqual(query.query["id__in"], ["r_tomato_soup"])
+
+        # Redis 上变更日志以 RPUSH/LTRIM 追加，按条目回放
+        fake = FakeRedis()
+        with patch("apps.diet.domains.discovery.recipe_catalog.get_redis", return_value=fake):
+            base = RecipeCatalog.mark_changed(["r_a"])
+            RecipeCatalog.mark_changed(["r_b"])
+            RecipeCatalog.mark_changed(["r_c"])
+            self.assertEqual(RecipeCatalog.changes_since(base), {"r_b", "r_c"})
+            RecipeCatalog.mark_changed()
+            self.assertIsNone(RecipeCatalog.changes_since(base))
+        self.assertEqual(len(fake.lrange(RecipeCatalog.CHANGES_KEY, 0, -1)), 4)
+
+        RecipeCatalog.mark_changed(["r_fish", "r_tomato_egg"])
+        previous = RecipeSearchIndex._snapshot
+        changed = [{"_id": "r_fish", "name": "番茄鲈鱼", "status": 1}, {"_id": "r_tomato_egg", "status": 2}]
+        with patch.object(RecipeSearchIndex, "_load_docs", return_value=changed) as mocked_load:
+            ids = [rid for rid, _ in RecipeSearchIndex.search("番茄", limit=10)[1]]
+        mocked_load.assert_called_once_with({"r_fish", "r_tomato_egg"})
+        self.assertIn("r_fish", ids)
+        self.assertNotIn("r_tomato_egg", ids)
+        # 增量更新打在副本上再整体替换，正在读取旧快照的请求不受影响
+        self.assertIsNot(RecipeSearchIndex._snapshot, previous)
+        old_ids = [rid for rid, _ in previous.search(search_tokens("番茄", for_query=True), limit=10)[1]]
+        self.assertEqual(sorted(old_ids), ["r_tomato_egg", "r_tomato_soup"])
+
+    def test_restaurant_import_streams_jsonl_as_batched_upserts(self):
+        collection = SimpleNamespace(calls=[])
+
+        def bulk_write(operations, ordered=True):
+            collection.calls.append(operations)
+            return SimpleNamespace(upserted_count=len(operations) - 1, matched_count=1)
+
+        collection.bulk_write = bulk_write
+        # 已入库的 B002 带有人工维护的菜单，重新导入时按该菜单分级
+        collection.find = lambda query, projection: [
+            {"amap_id": amap_id, "menu": [{"name": "炸鸡排"}]} for amap_id in query["amap_id"]["$in"] if amap_id == "B002"
+        ]
+        lines = [
+            {"id": "B001", "name": "轻食沙拉", "location": "116.40,39.90", "biz_ext": {"rating": "4.6", "cost": []}},
+            {"id": "B002", "name": "牛肉面", "location": "116.41,39.91", "photos": [{"url": "http://img/1.jpg"}]},
+            {"id": "B001", "name": "轻食沙拉(新店)", "location": "116.40,39.90"},
+            {"amap_id": "B003", "name": "汉堡王", "location": [116.42, 39.92], "rating": 4.1},
+            {"id": "B004", "location": "116.43,39.93"},
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as dump:
+            for line in lines:
+                dump.write(json.dumps(line, ensure_ascii=False) + "\n")
+            dump.write("not json\n")
+        out = StringIO()
+        try:
+            with patch.object(Restaurant, "_get_collection", return_value=collection):
+                call_command("import_restaurants", dump.name, "--batch-size", "3", stdout=out)
+        finally:
+            os.unlink(dump.name)
+
+        # 6 行分两批写入，每批一次 bulk_write；同批重复 amap_id 合并，无效行跳过
+        self.assertEqual([len(ops) for ops in collection.calls], [2, 1])
+        first = {op._filter["amap_id"]: op._doc for op in collection.calls[0]}
+        self.assertEqual(first["B001"]["$set"]["name"], "轻食沙拉(新店)")
+        self.assertEqual(first["B001"]["$setOnInsert"]["menu"], [])
+        self.assertEqual(first["B001"]["$set"]["health_light"], "green")
+        self.assertEqual(first["B002"]["$set"]["health_tags"], ["fried"])
+        self.assertNotIn("menu", first["B002"]["$set"])
+        self.assertEqual(first["B002"]["$set"]["location"], {"type": "Point", "coordinates": [116.41, 39.91]})
+        self.assertEqual(first["B002"]["$set"]["photos"], ["http://img/1.jpg"])
+        self.assertEqual(collection.calls[1][0]._doc["$set"]["rating"], 4.1)
+        self.assertIn("6 lines read", out.getvalue())
+        self.assertIn("1 inserted, 2 updated, 2 skipped", out.getvalue())
+
+    def test_health_classifier_rule_table_scores_type_name_and_menu(self):
+        salad = HealthClassifier.classify("餐饮服务;轻食;沙拉", "绿叶轻食")
+        self.assertEqual((salad["health_light"], salad["health_score"], salad["est_calories"]), ("green", 90, 400))
+        burger = HealthClassifier.classify("餐饮服务;快餐厅", "汉堡王")
+        self.assertEqual((burger["health_light"], burger["health_score"], burger["est_calories"]), ("red", 50, 800))
+        plain = HealthClassifier.classify("餐饮服务;中餐厅", "老王家常菜")
+        self.assertEqual((plain["health_light"], plain["health_score"], plain["health_tags"]), ("yellow", 70, []))
+        # 菜单命中按半权计入，同一规则只计一次
+        menu = HealthClassifier.classify("餐饮服务;中餐厅", "老王家常菜", [{"name": "炸鸡翅"}, {"name": "香辣炸鸡"}])
+        self.assertEqual((menu["health_score"], menu["health_tags"]), (60, ["fried"]))
+
+        shop = Restaurant(amap_id="B100", name="轻食沙拉", type="餐饮服务;快餐厅", menu=[{"name": "鸡胸肉沙拉"}])
+        shop.clean()
+        self.assertEqual((shop.health_light, shop.health_score), ("yellow", 70))
+        self.assertEqual(sorted(shop.health_tags), ["fast_food", "light_meal"])
+
+        queryset = LBSService.nearby_queryset(116.3975, 39.9087, 2000, "health", 80)
+        self.assertEqual(queryset._query["health_score"], {"$gte": 80})
+        self.assertIn("$geoWithin", queryset._query["location"])
+        self.assertEqual(queryset._ordering, [("health_score", -1), ("rating", -1)])
+
+    def test_reclassify_command_bulk_writes_stale_restaurants(self):
+        collection = SimpleNamespace(calls=[])
+        collection.bulk_write = lambda operations, ordered=True: collection.calls.append(operations)
+        docs = [
+            {"_id": 1, "name": "减脂餐", "type": "餐饮服务;轻食"},
+            {"_id": 2, "name": "烧烤大排档", "type": "餐饮服务;烧烤"},
+            {"_id": 3, "name": "面馆", "type": "餐饮服务"},
+        ]
+        queryset = SimpleNamespace()
+        queryset.only = lambda *fields: queryset
+        queryset.as_pymongo = lambda: queryset
+        queryset.batch_size = lambda size: iter(docs)
+        out = StringIO()
+        with patch.object(Restaurant, "_get_collection", return_value=collection), \
+                patch.object(Restaurant, "objects", return_value=queryset) as mocked_objects:
+            call_command("reclassify_restaurants", "--stale-only", "--batch-size", "2", stdout=out)
+
+        mocked_objects.assert_called_once_with(health_version__ne=CLASSIFIER_VERSION)
+        self.assertEqual([len(ops) for ops in collection.calls], [2, 1])
+        lights = [op._doc["$set"]["health_light"] for ops in collection.calls for op in ops]
+        self.assertEqual(lights, ["green", "red", "yellow"])
+        self.assertIn("3 restaurants", out.getvalue())
+
+    def test_mongo_index_check_reports_missing_specs_and_scans(self):
+        from apps.diet.management.commands.check_mongo_indexes import missing_indexes, summarize_plan
+
+        collection = SimpleNamespace(index_information=lambda: {
+            "_id_": {"key": [("_id", 1)]},
+            "status_1_created_at_-1": {"key": [("status", 1), ("created_at", -1)]},
+        })
+        with patch.object(Recipe, "_get_collection", return_value=collection):
+            missing = missing_indexes(Recipe)
+
+        self.assertNotIn([("status", 1), ("created_at", -1)], missing)
+        self.assertIn([("status", 1), ("ingredients_search", 1)], missing)
+
+        stages, indexes = summarize_plan({"queryPlanner": {"winningPlan": {
+            "stage": "LIMIT",
+            "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "status_1_created_at_-1"}},
+        }}})
+        self.assertEqual(stages, ["LIMIT", "FETCH", "IXSCAN"])
+        self.assertEqual(indexes, ["status_1_created_at_-1"])
+
     def test_legacy_frontend_alias_routes_resolve(self):
         self.assertEqual(resolve("/api/v1/user/login/").url_name, "wechat_login")
         self.assertEqual(resolve("/api/v1/recipe/demo-id/").url_name, "legacy_recipe_detail")
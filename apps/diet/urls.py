@@ -22,7 +22,7 @@ from apps.diet.api.v1.community import (
     CommunityFeedView, CommunityShareListView, 
     CommunityLikeView, CommunityCommentView,
     CommunityFeedDetailView, CommunitySaveView, CommunityReportView,
-    UserProfileView, UserPostsView,
+    UserProfileView, UserPostsView, CommunityTimelineView,
     CommunityUploadView  # [新增补充]
 )
 from apps.diet.api.v1.gamification import (
@@ -87,6 +87,7 @@ urlpatterns = [
     # ==========================================
     path('community/upload/', CommunityUploadView.as_view(), name='community_upload'), # [新增] 图片上传
     path('community/feed/', CommunityFeedView.as_view(), name='community_feed'),
+    path('community/timeline/', CommunityTimelineView.as_view(), name='community_timeline'),
     path('community/share/', CommunityFeedView.as_view(), name='community_share'),
     path('community/recipes/', CommunityShareListView.as_view(feed_type='recipe'), name='community_recipes'),
     path('community/restaurants/', CommunityShareListView.as_view(feed_type='restaurant'), name='community_restaurants'),
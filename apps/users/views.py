@@ -191,12 +191,15 @@ class UserPostsView(APIView):
         except ValueError:
             page, size = 1, 10
 
-        posts_data = CommunityService.get_feed_list(
+        cursor = request.query_params.get("cursor")
+        feed_page = CommunityService.get_feed_page(
             page=page,
             page_size=size,
             current_user_id=request.user.id,
             query_user_id=target_user.id,
+            cursor=cursor,
         )
+        posts_data = feed_page["list"]
 
         try:
             from apps.diet.models.mongo.community import CommunityFeed
@@ -214,7 +217,8 @@ class UserPostsView(APIView):
                     "total": total,
                     "page": page,
                     "size": size,
-                    "has_next": len(posts_data) == size,
+                    "has_next": feed_page["has_more"],
+                    "next_cursor": feed_page["next_cursor"],
                 },
             }
         )
@@ -163,6 +163,48 @@ else:
         }
     }
 
+# --- 推荐系统预计算索引 ---
+# 协同过滤相似度索引在缓存中的保留时长 (秒)，过期后首个请求会触发重建
+RECOMMENDATION_INDEX_TTL = int(os.environ.get('RECOMMENDATION_INDEX_TTL', 7 * 24 * 3600))
+# 是否在各进程内启动相似度索引增量更新线程 (关闭后在事务提交时同步更新)
+RECOMMENDATION_INDEX_WORKER = env_bool('RECOMMENDATION_INDEX_WORKER', True)
+# 每个用户按策略/筛选条件缓存的推荐排序结果保留时长 (秒)
+RECOMMENDATION_CACHE_TTL = int(os.environ.get('RECOMMENDATION_CACHE_TTL', 600))
+# 美食转盘候选池在同一会话窗口内的复用时长 (秒)
+WHEEL_POOL_TTL = int(os.environ.get('WHEEL_POOL_TTL', 300))
+# 热门榜时间衰减半衰期 (天)：N 天前的收藏/记录权重减半
+POPULARITY_HALF_LIFE_DAYS = float(os.environ.get('POPULARITY_HALF_LIFE_DAYS', 14))
+
+# --- 附近餐厅 (LBS) 地理格子缓存 ---
+# 单个 geohash 格子结果的新鲜期 (秒)，过期后返回旧结果并在后台刷新
+LBS_TILE_TTL = int(os.environ.get('LBS_TILE_TTL', 600))
+# 新鲜期过后旧结果仍可返回的时长 (秒)
+LBS_TILE_STALE_TTL = int(os.environ.get('LBS_TILE_STALE_TTL', 3600))
+# 单格子重算锁的超时 (秒)，防止重算进程崩溃后锁不释放
+LBS_TILE_LOCK_TIMEOUT = int(os.environ.get('LBS_TILE_LOCK_TIMEOUT', 30))
+# 冷格子并发请求等待首个请求结果的最长时间 (秒)
+LBS_TILE_WAIT = float(os.environ.get('LBS_TILE_WAIT', 3))
+
+# --- 社区点赞/收藏计数 ---
+# Redis 集合为准，后台线程按此间隔 (秒) 批量回写 MySQL 偏好表与 Mongo 计数
+COMMUNITY_COUNTER_FLUSH_INTERVAL = float(os.environ.get('COMMUNITY_COUNTER_FLUSH_INTERVAL', 2))
+# 单次回写处理的最大操作数
+COMMUNITY_COUNTER_FLUSH_BATCH = int(os.environ.get('COMMUNITY_COUNTER_FLUSH_BATCH', 1000))
+# 是否在各进程内启动回写线程 (关闭后需依赖 reconcile_feed_counters 定时执行)
+COMMUNITY_COUNTER_WORKER = env_bool('COMMUNITY_COUNTER_WORKER', True)
+# 关注流：每个用户时间线保留的最大条数
+TIMELINE_MAX_ITEMS = int(os.environ.get('TIMELINE_MAX_ITEMS', 500))
+# 粉丝数超过该值的作者不做写扩散，改为读取时拉取
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.environ.get('TIMELINE_FANOUT_MAX_FOLLOWERS', 5000))
+# 用户名片 (昵称、头像、代表徽章) 缓存时长 (秒)，资料或徽章变更时主动失效
+USER_CARD_CACHE_TTL = int(os.environ.get('USER_CARD_CACHE_TTL', 600))
+# 动态内嵌的最新评论快照条数 (动态流 preview_comments 参数的上限)
+COMMUNITY_COMMENT_PREVIEW_SIZE = int(os.environ.get('COMMUNITY_COMMENT_PREVIEW_SIZE', 3))
+# 评论数后台对账间隔 (秒)：复核期间有评论增删的帖子
+COMMUNITY_COMMENT_RECONCILE_INTERVAL = float(os.environ.get('COMMUNITY_COMMENT_RECONCILE_INTERVAL', 30))
+# 是否在各进程内启动评论对账线程 (关闭后需依赖 reconcile_comment_counts 定时执行)
+COMMUNITY_COMMENT_WORKER = env_bool('COMMUNITY_COMMENT_WORKER', True)
+
 # --- 用户模型 ---
 AUTH_USER_MODEL = 'users.User'
 
@@ -228,6 +270,18 @@ CSRF_TRUSTED_ORIGINS = list(dict.fromkeys(
 
 # --- 高德地图 ---
 AMAP_WEB_KEY = os.environ.get('AMAP_WEB_KEY', '')
+# 高德 Web 服务地址，离线测试/压测时可指向本地替身服务
+AMAP_BASE_URL = os.environ.get('AMAP_BASE_URL', 'https://restapi.amap.com')
+# 附近餐厅兜底查询最多拉取的页数 (第 2 页起并行请求)
+AMAP_NEARBY_PAGES = int(os.environ.get('AMAP_NEARBY_PAGES', 3))
+# 全进程对高德的请求速率上限 (次/秒)，0 表示不限
+AMAP_RATE_LIMIT = float(os.environ.get('AMAP_RATE_LIMIT', 10))
+# 连接池大小、单次请求超时 (秒)
+AMAP_MAX_CONNECTIONS = int(os.environ.get('AMAP_MAX_CONNECTIONS', 10))
+AMAP_TIMEOUT = float(os.environ.get('AMAP_TIMEOUT', 3))
+# 5xx/429/QPS 超限时的重试次数与指数退避基数 (秒)
+AMAP_MAX_RETRIES = int(os.environ.get('AMAP_MAX_RETRIES', 2))
+AMAP_RETRY_BACKOFF = float(os.environ.get('AMAP_RETRY_BACKOFF', 0.2))
 
 # AI Dynamic Routing Configuration
 # 根据任务类型 (vision/text) 路由到不同的模型供应商
@@ -256,6 +310,44 @@ AI_CONFIG = {
     },
 }
 
+# AI 调用执行层：每个 (供应商, 密钥) 的并发上限、排队等待超时与单次调用总超时 (秒)
+AI_MAX_CONCURRENCY_PER_KEY = int(os.environ.get('AI_MAX_CONCURRENCY_PER_KEY', 4))
+AI_QUEUE_TIMEOUT = float(os.environ.get('AI_QUEUE_TIMEOUT', 15))
+AI_CALL_TIMEOUT = float(os.environ.get('AI_CALL_TIMEOUT', 120))
+# 是否合并内容完全相同的在途 AI 请求
+AI_COALESCE_REQUESTS = env_bool('AI_COALESCE_REQUESTS', True)
+# AI 密钥熔断：统计最近 N 次调用，达到最少调用数且失败率超过阈值后熔断，冷却 (秒) 后放行一次探测
+AI_CIRCUIT_WINDOW = int(os.environ.get('AI_CIRCUIT_WINDOW', 20))
+AI_CIRCUIT_MIN_CALLS = int(os.environ.get('AI_CIRCUIT_MIN_CALLS', 4))
+AI_CIRCUIT_ERROR_RATE = float(os.environ.get('AI_CIRCUIT_ERROR_RATE', 0.5))
+AI_CIRCUIT_COOLDOWN = float(os.environ.get('AI_CIRCUIT_COOLDOWN', 30))
+# AI 调用指标持久化：时间桶大小 (秒)，以及内存缓冲累计多少条或多少秒后批量写库
+AI_METRICS_BUCKET_SECONDS = int(os.environ.get('AI_METRICS_BUCKET_SECONDS', 300))
+AI_METRICS_FLUSH_EVENTS = int(os.environ.get('AI_METRICS_FLUSH_EVENTS', 50))
+AI_METRICS_FLUSH_INTERVAL = float(os.environ.get('AI_METRICS_FLUSH_INTERVAL', 30))
+# 是否在各进程内启动指标回写线程 (关闭后在请求线程内按上述条件同步写库)，以及写库失败时最多保留的缓冲桶数
+AI_METRICS_WORKER = env_bool('AI_METRICS_WORKER', True)
+AI_METRICS_MAX_BUFFERED_BUCKETS = int(os.environ.get('AI_METRICS_MAX_BUFFERED_BUCKETS', 2000))
+# AI 问答服务端会话上下文：发送给模型的历史 token 预算、最多保留消息条数、缓存保留时长 (秒)
+AI_CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('AI_CHAT_CONTEXT_TOKEN_BUDGET', 1500))
+AI_CHAT_CONTEXT_MAX_MESSAGES = int(os.environ.get('AI_CHAT_CONTEXT_MAX_MESSAGES', 20))
+AI_CHAT_CONTEXT_TTL = int(os.environ.get('AI_CHAT_CONTEXT_TTL', 24 * 3600))
+# 是否在各进程内启动会话上下文定时回写线程 (关闭后仅在缓冲满时回写)
+AI_CHAT_CONTEXT_WORKER = env_bool('AI_CHAT_CONTEXT_WORKER', True)
+# 拍照识别结果按图片内容哈希缓存：开关、保留时长 (秒)、最多条目数，以及是否启用感知哈希匹配近似重复图片
+AI_RECOGNITION_CACHE_ENABLED = env_bool('AI_RECOGNITION_CACHE_ENABLED', True)
+AI_RECOGNITION_CACHE_TTL = int(os.environ.get('AI_RECOGNITION_CACHE_TTL', 7 * 24 * 3600))
+AI_RECOGNITION_CACHE_MAX_ENTRIES = int(os.environ.get('AI_RECOGNITION_CACHE_MAX_ENTRIES', 5000))
+AI_RECOGNITION_PERCEPTUAL_HASH = env_bool('AI_RECOGNITION_PERCEPTUAL_HASH', False)
+# 图片送入视觉模型前的预处理：按 EXIF 摆正、长边缩放上限 (像素)、重新编码格式 (JPEG/WEBP) 与质量
+AI_IMAGE_PREPROCESS = env_bool('AI_IMAGE_PREPROCESS', True)
+AI_IMAGE_MAX_EDGE = int(os.environ.get('AI_IMAGE_MAX_EDGE', 1568))
+AI_IMAGE_FORMAT = os.environ.get('AI_IMAGE_FORMAT', 'JPEG')
+AI_IMAGE_QUALITY = int(os.environ.get('AI_IMAGE_QUALITY', 85))
+# 识别接口上传上限 (字节)，以及非 JPEG 图片允许解码的最大像素数
+AI_UPLOAD_MAX_BYTES = int(os.environ.get('AI_UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+AI_IMAGE_MAX_PIXELS = int(os.environ.get('AI_IMAGE_MAX_PIXELS', 40_000_000))
+
 # --- 🚀 CORS 跨域设置 ---
 CORS_ALLOW_ALL_ORIGINS = env_bool('CORS_ALLOW_ALL_ORIGINS', False)
 CORS_ALLOW_CREDENTIALS = True
@@ -9,16 +9,19 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health_life.settings')
 django.setup()
 
 from apps.diet.documents import Restaurant
+from apps.diet.models.mongo.community import Comment, CommunityFeed
+from apps.diet.models.mongo.recipe import Recipe
 
 def fix_indices():
     print("🔧 正在检查 MongoDB 索引...")
     
-    # 1. 强制创建索引
-    try:
-        Restaurant.ensure_indexes()
-        print("✅ 索引 '2dsphere' 创建/确认成功！")
-    except Exception as e:
-        print(f"❌ 索引创建失败: {e}")
+    # 1. 强制创建索引 (完整核对与执行计划见 manage.py check_mongo_indexes)
+    for document in (Restaurant, Recipe, CommunityFeed, Comment):
+        try:
+            document.ensure_indexes()
+            print(f"✅ {document._get_collection_name()} 索引创建/确认成功！")
+        except Exception as e:
+            print(f"❌ {document._get_collection_name()} 索引创建失败: {e}")
 
     # 2. 检查数据量
     count = Restaurant.objects.count()
@@ -13,6 +13,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health_life.settings')
 django.setup()
 
 from apps.diet.documents import Recipe
+from apps.diet.domains.discovery.recipe_catalog import RecipeCatalog
 
 def clean_ingredient(raw_text):
     """
@@ -102,6 +103,7 @@ def import_full_corpus(file_path):
                         difficulty="中等" if len(data.get('recipeInstructions', [])) > 5 else "简单",
                         cooking_time=15
                     )
+                    recipe.clean()  # insert 不会触发校验，这里手动生成检索分词
                     batch.append(recipe)
 
                     # 5. 批量写入
@@ -124,6 +126,9 @@ def import_full_corpus(file_path):
             Recipe.objects.insert(batch, load_bulk=True)
             count += len(batch)
 
+        # 通知各进程内的菜谱索引重建
+        RecipeCatalog.mark_changed()
+
         print(f"\n🎉 导入完成！")
         print(f"✅ 成功: {count} 条")
         print(f"⚠️ 跳过: {skipped} 条")